@@ -0,0 +1,132 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Synthetic benchmark inputs. Files are generated once into ``benchmarks/.fixtures``
+and reused, so every run measures the same input.
+
+MIDI fixtures (see ``MIDI_FIXTURES``):
+
+* ``sparse``: Single notes, two per second.
+* ``chords``: Eight note chords, eight per second.
+* ``stress``: 100,000 overlapping notes, about 40 playing at once.
+"""
+
+import os
+import random
+import mido
+import numpy as np
+import cv2
+from typing import Tuple
+
+FIXTURES = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".fixtures")
+
+# Name: (number of notes, notes per chord, chords per second, note length in seconds)
+MIDI_FIXTURES = {
+    "sparse": (120, 1, 2, 0.4),
+    "chords": (3840, 8, 8, 0.25),
+    "stress": (100000, 4, 25, 0.4),
+}
+
+TICKS_PER_BEAT = 480
+TICKS_PER_SEC = TICKS_PER_BEAT * 2   # Default tempo is 120 BPM.
+
+
+def midi_path(name: str) -> str:
+    """
+    Path of a MIDI fixture. Generated if it doesn't exist.
+    """
+    path = os.path.join(FIXTURES, f"{name}.mid")
+    if not os.path.isfile(path):
+        make_midi(path, *MIDI_FIXTURES[name])
+    return path
+
+
+def make_midi(path: str, num_notes: int, chord_size: int, chord_rate: float, length: float) -> None:
+    """
+    Write a MIDI file of chords at a constant rate. Notes are random (seeded),
+    within the 88 piano keys.
+    """
+    rng = random.Random(num_notes)
+    events = []
+    for i in range(0, num_notes, chord_size):
+        start = int(i / chord_size / chord_rate * TICKS_PER_SEC)
+        end = start + int(length * TICKS_PER_SEC)
+        for note in rng.sample(range(21, 109), min(chord_size, num_notes-i)):
+            events.append((start, 1, note, rng.randint(40, 110)))
+            events.append((end, 0, note, 0))
+    events.sort()
+
+    track = mido.MidiTrack()
+    last = 0
+    for time, on, note, velocity in events:
+        track.append(mido.Message("note_on" if on else "note_off", note=note, velocity=velocity, time=time-last))
+        last = time
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    midi = mido.MidiFile(ticks_per_beat=TICKS_PER_BEAT)
+    midi.tracks.append(track)
+    midi.save(path)
+
+
+def keyboard_path(resolution: Tuple[int, int], frames: int, fps: float) -> str:
+    """
+    Path of a synthetic keyboard video. Generated if it doesn't exist.
+    """
+    path = os.path.join(FIXTURES, f"keyboard_{resolution[0]}x{resolution[1]}_{frames}_{fps}.mp4")
+    if not os.path.isfile(path):
+        make_keyboard(path, resolution, frames, fps)
+    return path
+
+
+def make_keyboard(path: str, resolution: Tuple[int, int], frames: int, fps: float) -> None:
+    """
+    Write a video of a flat keyboard in the middle third of the frame, with
+    random keys lit each frame.
+    """
+    width, height = resolution
+    top, bottom = height // 3, height * 2 // 3
+    key_width = width / 52
+    rng = np.random.default_rng(0)
+
+    base = np.full((height, width, 3), 30, dtype=np.uint8)
+    base[top:bottom] = 230
+    for i in range(52):
+        base[top:bottom, int(i*key_width)] = 60
+        if i % 7 not in (2, 5):
+            x = int((i+0.7) * key_width)
+            base[top:top+(bottom-top)*2//3, x:x+int(key_width*0.6)] = 20
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, resolution)
+    for _ in range(frames):
+        img = base.copy()
+        for key in rng.integers(0, 52, 6):
+            img[top+(bottom-top)*2//3:bottom, int(key*key_width)+1:int((key+1)*key_width)] = (255, 200, 120)
+        writer.write(img)
+    writer.release()
+
+
+def keyboard_crop(resolution: Tuple[int, int]):
+    """
+    ``keyboard.crop`` for a video from ``make_keyboard``.
+    """
+    width, height = resolution
+    top, bottom = height // 3, height * 2 // 3
+    return [[0, top], [width, top], [width, bottom], [0, bottom]]
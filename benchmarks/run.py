@@ -0,0 +1,266 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Kernel benchmarks.
+
+Run all benchmarks and save results::
+
+    python benchmarks/run.py run -o results.json
+
+Compare two runs, and exit with code 1 if any stage got slower::
+
+    python benchmarks/run.py compare old.json new.json
+
+Each stage is timed separately with ``pvkernel.profiler``. Results are keyed by
+``<fixture>/<stage>``, and times are in seconds.
+"""
+
+import sys
+import os
+import time
+import platform
+import argparse
+import json
+import tempfile
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SRC = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC)
+
+import fixtures
+
+# Operators and jobs recorded from the profiler, and their stage names.
+STAGES = {
+    ("op", "midi.parse"): "midi.parse",
+    ("op", "core.running_time"): "core.running_time",
+    ("op", "core.key_pos"): "core.key_pos",
+    ("job", "keyboard_init"): "keyboard.init",
+    ("op", "midi.notes_playing"): "midi.notes_playing",
+    ("op", "blocks.render"): "blocks.render",
+    ("op", "core.overlay"): "core.overlay",
+    ("op", "keyboard.render"): "keyboard.render",
+    ("op", "smoke.simulate"): "smoke.simulate",
+    ("op", "smoke.render"): "smoke.render",
+    ("op", "ptcls.simulate"): "ptcls.simulate",
+    ("op", "ptcls.render"): "ptcls.render",
+    ("op", "glare.apply"): "glare.apply",
+    ("frame", "render"): "frame",
+}
+
+
+def summarize(times) -> dict:
+    times = np.array(times, dtype=np.float64)
+    return {
+        "count": len(times),
+        "mean": times.mean(),
+        "p50": np.percentile(times, 50),
+        "p95": np.percentile(times, 95),
+        "max": times.max(),
+    }
+
+
+def bench_import(repeat: int) -> dict:
+    """
+    Time ``import pvkernel`` in a new interpreter (library already compiled).
+    """
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import pvkernel"], cwd=tempfile.gettempdir(), check=True,
+            env=dict(os.environ, PYTHONPATH=SRC))
+        times.append(time.perf_counter() - t)
+    return summarize(times)
+
+
+def bench_render(name: str, resolution, fps: float, frames: int) -> dict:
+    """
+    Render ``frames`` frames from the middle of a MIDI fixture, with the synthetic
+    keyboard video, and return the times of each stage.
+    """
+    import pvkernel
+    from pvkernel.export import exe_slot, render_frame
+    from pvkernel.profiler import Profiler
+
+    video = pvkernel.Video(resolution, fps)
+    video.props.midi.paths = fixtures.midi_path(name)
+    # Measure parsing, not loading from cache.
+    video.props.midi.cache = False
+    video.props.keyboard.video_path = fixtures.keyboard_path(resolution, frames+10, fps)
+    video.props.keyboard.crop = fixtures.keyboard_crop(resolution)
+
+    profiler = Profiler()
+    video.profiler = profiler
+    exe_slot(video, "init")
+
+    # Frames 10 seconds into the piece, where it is as dense as the rest.
+    start = min(int(video.fps*(video.props.core.pause_start+10)), video.data.core.running_time-frames)
+    # Keyboard video starts at the first rendered frame.
+    video.props.keyboard.video_start = -(start/video.fps - video.props.core.pause_start)
+    for frame in range(start, start+frames):
+        video.buffers.release(render_frame(video, frame))
+    exe_slot(video, "deinit")
+
+    results = {}
+    groups = {}
+    for category, op, _, wall, _, _, _ in profiler.events:
+        stage = STAGES.get((category, op))
+        if stage is not None:
+            groups.setdefault(stage, []).append(wall)
+    for stage, times in groups.items():
+        results[stage] = summarize(times)
+    return results
+
+
+def bench_writers(resolution, fps: float, frames: int) -> dict:
+    """
+    Time writing frames with each writer. Frames are random noise, which is the
+    worst case for the encoders.
+    """
+    from pvkernel.utils import HAS_FFMPEG
+    from pvkernel.videoio import PipelinedWriter, VideoWriter, VideoWriterFFmpeg
+
+    rng = np.random.default_rng(0)
+    imgs = [rng.integers(0, 256, (resolution[1], resolution[0], 3), dtype=np.uint8) for _ in range(4)]
+    writers = {
+        "writer.opencv": lambda path: VideoWriter(path, resolution, fps, None),
+        "writer.ffv1": lambda path: VideoWriter(path, resolution, fps, None, fourcc="FFV1"),
+    }
+    if HAS_FFMPEG:
+        writers["writer.ffmpeg"] = lambda path: VideoWriterFFmpeg(path, resolution, fps, None)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for stage, make in writers.items():
+            ext = ".mkv" if stage == "writer.ffv1" else ".mp4"
+            times = []
+            with make(os.path.join(tmp, stage+ext)) as writer:
+                with PipelinedWriter(writer, 0) as pipe:
+                    for i in range(frames):
+                        t = time.perf_counter()
+                        pipe.write(imgs[i % len(imgs)])
+                        times.append(time.perf_counter() - t)
+            results[stage] = summarize(times)
+    return results
+
+
+def run(args) -> None:
+    resolution = tuple(map(int, args.resolution.split("x")))
+    results = {}
+
+    print("Benchmarking import")
+    results["import/pvkernel"] = bench_import(args.repeat)
+
+    for name in args.fixtures.split(","):
+        print(f"Benchmarking fixture {name}")
+        for stage, stats in bench_render(name, resolution, args.fps, args.frames).items():
+            results[f"{name}/{stage}"] = stats
+
+    print("Benchmarking writers")
+    for stage, stats in bench_writers(resolution, args.fps, args.frames).items():
+        results[f"io/{stage}"] = stats
+
+    commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL).stdout.decode().strip()
+    data = {
+        "meta": {
+            "time": time.time(),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "resolution": resolution,
+            "fps": args.fps,
+            "frames": args.frames,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as fp:
+        json.dump(data, fp, indent=4)
+
+    for key, stats in results.items():
+        print(f"{key:40} {stats['p50']*1000:10.2f} ms  (p95 {stats['p95']*1000:.2f} ms, n={stats['count']})")
+    print(f"Saved results to {args.output}")
+
+
+def compare(args) -> int:
+    """
+    Compare the medians of two runs. Returns the number of regressions.
+    """
+    with open(args.old, "r") as fp:
+        old = json.load(fp)
+    with open(args.new, "r") as fp:
+        new = json.load(fp)
+
+    for key in ("resolution", "fps", "frames", "cpus"):
+        if old["meta"][key] != new["meta"][key]:
+            print(f"WARNING: {key} differs: {old['meta'][key]} vs {new['meta'][key]}")
+
+    regressions = 0
+    for key in sorted(set(old["results"]) | set(new["results"])):
+        if key not in old["results"] or key not in new["results"]:
+            print(f"{key:40} only in {'new' if key in new['results'] else 'old'}")
+            continue
+        before = old["results"][key]["p50"]
+        after = new["results"][key]["p50"]
+        ratio = after / max(before, 1e-9)
+        status = ""
+        if ratio > 1+args.threshold and after-before > args.min_time:
+            status = "REGRESSION"
+            regressions += 1
+        elif ratio < 1-args.threshold and before-after > args.min_time:
+            status = "improved"
+        print(f"{key:40} {before*1000:10.2f} -> {after*1000:10.2f} ms  {ratio:6.2f}x  {status}".rstrip())
+
+    print(f"{regressions} regressions.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Piano Video kernel benchmarks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = subparsers.add_parser("run", help="Run benchmarks.")
+    parser_run.add_argument("-o", "--output", default="benchmark.json", help="Results JSON path.")
+    parser_run.add_argument("--fixtures", default=",".join(fixtures.MIDI_FIXTURES),
+        help="Comma separated MIDI fixtures.")
+    parser_run.add_argument("--resolution", default="1920x1080", help="Render resolution, WxH.")
+    parser_run.add_argument("--fps", type=float, default=30, help="Frames per second.")
+    parser_run.add_argument("--frames", type=int, default=30, help="Frames to render per fixture.")
+    parser_run.add_argument("--repeat", type=int, default=5, help="Repeats of the import benchmark.")
+
+    parser_compare = subparsers.add_parser("compare", help="Compare two results.")
+    parser_compare.add_argument("old", help="Baseline results JSON.")
+    parser_compare.add_argument("new", help="New results JSON.")
+    parser_compare.add_argument("--threshold", type=float, default=0.1,
+        help="Relative change of the median to flag.")
+    parser_compare.add_argument("--min-time", type=float, default=1e-4,
+        help="Ignore changes smaller than this (seconds).")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(1 if compare(args) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -40,10 +40,16 @@ class Property:
       but you may need to check requirements.
 
     **Call** ``super().__init__()`` **AFTER initializing** ``self.default``
+
+    Numeric properties can set ``subtype``:
+
+    * ``"PIXEL"``: The value (or every number in a list) is a length in pixels.
+      The kernel scales it when rendering at a different scale (e.g. draft mode).
     """
     type: Type
     name: str
     description: str
+    subtype: str = ""
 
     default: Any
     value: Any
@@ -84,12 +90,13 @@ class IntProp(Property):
     max: int
 
     def __init__(self, name: str = "", description: str = "", default: int = 0,
-            min: int = ..., max: int = ...) -> None:
+            min: int = ..., max: int = ..., subtype: str = "") -> None:
         self.name = name
         self.description = description
         self.default = default
         self.min = min
         self.max = max
+        self.subtype = subtype
 
         super().__init__()
 
@@ -106,12 +113,13 @@ class FloatProp(Property):
     max: float
 
     def __init__(self, name: str = "", description: str = "", default: float = 0,
-            min: float = ..., max: float = ...) -> None:
+            min: float = ..., max: float = ..., subtype: str = "") -> None:
         self.name = name
         self.description = description
         self.default = default
         self.min = min
         self.max = max
+        self.subtype = subtype
 
         super().__init__()
 
@@ -151,10 +159,12 @@ class ListProp(Property):
     """
     type = list
 
-    def __init__(self, name: str = "", description: str = "", default: List[Any] = [0, 0, 0, 0]):
+    def __init__(self, name: str = "", description: str = "", default: List[Any] = [0, 0, 0, 0],
+            subtype: str = ""):
         self.name = name
         self.description = description
         self.default = default
+        self.subtype = subtype
 
         super().__init__()
 
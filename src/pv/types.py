@@ -24,15 +24,17 @@ __all__ = (
     "Operator",
     "OpGroup",
     "Job",
+    "Overlay",
 )
 
 import os
 import json
-from typing import IO, Any, Dict, List, Sequence, TYPE_CHECKING
+from typing import IO, Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
 from .props import Property
 
 Video = None
 if TYPE_CHECKING:
+    import numpy as np
     from pvkernel import Video
 
 
@@ -131,7 +133,7 @@ class Cache:
 
         self._video = video
         self._state = os.path.join(self.path, ".state.json")
-        self._frames = []
+        self._frames = set()
 
         os.makedirs(self.path, exist_ok=True)
 
@@ -156,8 +158,8 @@ class Cache:
         self._check_state()
 
         frame = self._video.frame
-        if mode.startswith("w") and frame not in self._frames:
-            self._frames.append(frame)
+        if mode.startswith("w"):
+            self._frames.add(frame)
         elif mode.startswith("r") and frame not in self._frames and check_exist:
             raise ValueError(f"Frame {frame} does not exist in cache.",
                 "Pass argument check_exist=False to override.")
@@ -173,6 +175,39 @@ class Cache:
         frame = self._video.frame if frame == ... else frame
         return frame in self._frames
 
+    def discard(self, frame: int = ...) -> None:
+        """
+        Delete a frame from the cache, if it exists.
+
+        :param frame: Frame to use. Defaults to current video frame.
+        """
+        frame = self._video.frame if frame == ... else frame
+        self._frames.discard(frame)
+        if os.path.isfile(self.frame_path(frame)):
+            os.remove(self.frame_path(frame))
+
+    def load(self, last: int = None) -> None:
+        """
+        Add frames already in the cache folder (e.g. from an interrupted render)
+        to the internal frame list. Nothing is loaded if any of the ``depends``
+        properties changed since the frames were written.
+
+        :param last: Only load frames up to and including this frame.
+        """
+        from .utils import multigetattr
+
+        if not os.path.isfile(self._state):
+            return
+        with open(self._state, "r") as fp:
+            props = json.load(fp)["props"]
+        for attr in self.depends:
+            if attr not in props or multigetattr(self._video.props, attr) != props[attr]:
+                return
+
+        for name in os.listdir(self.path):
+            if name.lstrip("-").isdigit() and (last is None or int(name) <= last):
+                self._frames.add(int(name))
+
     def _check_state(self):
         from .utils import multigetattr
 
@@ -181,7 +216,7 @@ class Cache:
                 props = json.load(fp)["props"]
             for attr in self.depends:
                 if multigetattr(self._video.props, attr) != props[attr]:
-                    self._frames = []
+                    self._frames = set()
 
         info = {
             "props": {name: multigetattr(self._video.props, name) for name in self.depends},
@@ -250,9 +285,58 @@ class Job:
     * ``idname``: Job idname.
     * ``ops``: List of operator idnames (``"group.idname"``) to run.
     * ``execute``: This function will run before running the operators. Default does nothing.
+
+    Frame jobs can also draw into their own layer (see ``pvkernel.layers``), which
+    is kept and reused on later frames if nothing it depends on changed:
+
+    * ``layer``: Layer name. Operators draw on ``video.layer`` instead of the
+      render image. Default None, draw on the render image.
+    * ``blend``: How the layer is blended on the render image, ``"OVER"`` or ``"MAX"``.
+    * ``layer_key(video)``: Everything the layer depends on at the current frame.
+      If it is the same as when the layer was drawn, the operators are skipped.
+      Default None, always draw.
+
+    Jobs that run while rendering a frame report where they drew (see
+    ``pvkernel.dirty``), so the rest of the frame can be skipped:
+
+    * ``region(video)``: Boxes ``(y0, y1, x0, x1)`` of the render image the job
+      drew on at the current frame, called after the operators. Black pixels
+      outside of them must be left black. Default None, the whole image. Return
+      an empty list if the job doesn't draw, or its operators add what they drew
+      to ``video.dirty``. Not used for jobs with a layer (the layer's box is used).
     """
     idname: str
     ops: Sequence[str] = ()
+    layer: Optional[str] = None
+    blend: str = "OVER"
 
     def execute(self, video: Video) -> None:
         ...
+
+    def layer_key(self, video: Video) -> Any:
+        return None
+
+    def region(self, video: Video) -> Optional[Sequence[Tuple[int, int, int, int]]]:
+        return None
+
+
+class Overlay:
+    """
+    A static overlay: something drawn the same way on every frame, e.g. dimming or
+    lines at fixed places. All overlays are built once before rendering into a gain
+    map and a floor, which are applied to the render image in one vectorized
+    operation per frame, after the blocks: every pixel is multiplied by its gain,
+    then raised to its floor.
+
+    Inherit and define:
+
+    * ``idname``: Overlay idname.
+    * ``build(video, gain, floor)``: Multiply ``gain`` (float, ``(height, width)``,
+      starts at 1) by the factor of each pixel, and raise ``floor`` (uint8,
+      ``(height, width, 3)``, starts at 0) to the lowest value of each pixel.
+      Leave them as they are if the overlay is off.
+    """
+    idname: str
+
+    def build(self, video: Video, gain: "np.ndarray", floor: "np.ndarray") -> None:
+        ...
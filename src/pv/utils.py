@@ -18,7 +18,7 @@
 #
 
 from typing import Any, Callable, List, Sequence, Type
-from .types import Cache, DataGroup, Job, Operator, PropertyGroup
+from .types import Cache, DataGroup, Job, Operator, Overlay, PropertyGroup
 
 _caches: List[Type[Cache]] = []
 _caches_callback: List[Callable] = []
@@ -31,6 +31,8 @@ _jobs: List[Type[Job]] = []
 _ops: List[Type[Operator]] = []
 _ops_callback: List[Callable] = []
 
+_overlays: List[Type[Overlay]] = []
+
 _pgroups: List[Type[PropertyGroup]] = []
 _pgroup_callback: List[Callable] = []
 
@@ -57,6 +59,8 @@ def register_class(cls: Type) -> None:
         _caches.append(cls)
         for func in _caches_callback:
             func(cls)
+    elif issubclass(cls, Overlay):
+        _overlays.append(cls)
     else:
         raise ValueError(f"Cannot register {cls}")
 
@@ -123,7 +127,16 @@ def multigetattr(obj, *attrs: str) -> Any:
     return obj
 
 def call_op(video, *idnames: str) -> None:
-    multigetattr(video.ops, *idnames)()
+    """
+    Call an operator. If the video has a profiler, the call is timed.
+    """
+    op = multigetattr(video.ops, *idnames)
+    profiler = getattr(video, "profiler", None)
+    if profiler is None:
+        op()
+    else:
+        with profiler.span("op", ".".join(idnames), video._export_frame):
+            op()
 
 
 def _get_caches() -> List[Type[Cache]]:
@@ -140,3 +153,6 @@ def _get_ogroups() -> List[Type[Operator]]:
 
 def _get_jobs() -> List[Type[Job]]:
     return _jobs
+
+def _get_overlays() -> List[Type[Overlay]]:
+    return _overlays
@@ -26,9 +26,11 @@ This library is a Python module, and handles rendering, effects, MIDI parsing, e
 __version__ = "0.4.0"
 
 import os
-from .startup import PARENT, build, register_addons
+from .startup import PARENT, build, register_addons, source_hash
 
 LAST_COMP = os.path.join(PARENT, "last_compiled.txt")
+# The library is rebuilt if this changed since it was last built.
+BUILD_KEY = f"{__version__} {source_hash()}"
 
 
 def get_last_comp():
@@ -39,13 +41,14 @@ def get_last_comp():
 
 def set_last_comp():
     with open(LAST_COMP, "w") as fp:
-        fp.write(__version__)
+        fp.write(BUILD_KEY)
 
 
-if get_last_comp() != __version__:
+if get_last_comp() != BUILD_KEY or not os.path.isfile(os.path.join(PARENT, "libpvkernel.so")):
     build()
 set_last_comp()
 del build
+del source_hash
 del get_last_comp
 del set_last_comp
 
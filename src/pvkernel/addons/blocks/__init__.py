@@ -25,8 +25,11 @@ import numpy as np
 import pv
 from pv.props import BoolProp, FloatProp, ListProp, StrProp
 from pvkernel import Video
+from pvkernel import draw
 from utils import block_pos
-from .solid import draw_block_solid
+from .block_utils import block_rects
+from .solid import layers_box, solid_layers
+from .strip import init_strip
 
 
 class BUILTIN_PT_Blocks(pv.PropertyGroup):
@@ -49,6 +52,7 @@ class BUILTIN_PT_Blocks(pv.PropertyGroup):
         name="X Offset",
         description="Horizontal offset of blocks.",
         default=0,
+        subtype="PIXEL",
     )
 
     dim_top = BoolProp(
@@ -63,6 +67,13 @@ class BUILTIN_PT_Blocks(pv.PropertyGroup):
         default=True,
     )
 
+    strip = BoolProp(
+        name="Scrolling Strip",
+        description="Draw all blocks once into a tall image, and copy the visible part every frame. "
+            "Same as drawing them at whole pixel offsets (up to rounding), interpolated in between.",
+        default=False,
+    )
+
 
 class BUILTIN_PT_BlocksSolid(pv.PropertyGroup):
     idname = "blocks_solid"
@@ -71,12 +82,14 @@ class BUILTIN_PT_BlocksSolid(pv.PropertyGroup):
         name="Rounding",
         description="Corner rounding radius in pixels.",
         default=8,
+        subtype="PIXEL",
     )
 
     border = FloatProp(
         name="Border",
         description="Border thickness in pixels.",
         default=0.5,
+        subtype="PIXEL",
     )
 
     glow = BoolProp(
@@ -104,6 +117,23 @@ class BUILTIN_PT_BlocksSolid(pv.PropertyGroup):
     )
 
 
+class BUILTIN_DT_Blocks(pv.DataGroup):
+    idname = "blocks"
+
+
+class BUILTIN_OT_BlocksStrip(pv.Operator):
+    group = "blocks"
+    idname = "strip"
+    label = "Scrolling Strip"
+    description = "Draw the scrolling strip of blocks if blocks.strip is on. Saves to blocks_data.strip"
+
+    def execute(self, video: Video) -> None:
+        strip = None
+        if video.props.blocks.strip and video.props.blocks.style == "SOLID":
+            strip = init_strip(video)
+        video.data.blocks.strip = strip
+
+
 class BUILTIN_OT_BlocksRender(pv.Operator):
     group = "blocks"
     idname = "render"
@@ -112,35 +142,61 @@ class BUILTIN_OT_BlocksRender(pv.Operator):
 
     def execute(self, video: Video) -> None:
         props = video.props.blocks
-        half = video.resolution[1] // 2
 
         if props.style == "SOLID":
-            draw_block_solid(video)
+            layers = solid_layers(video, block_rects(video))
+            strip = video.data.blocks.strip
+            if strip is None or not strip.render(video, layers):
+                draw.rects(video.render_img, *layers)
+            # The strip is black away from the blocks, give or take a pixel.
+            video.dirty.add(*layers_box(layers[0]))
         else:
             raise ValueError(f"Unknown block style: {props.style}")
 
-        if props.dim_top:
-            for y in range(250):
-                v = np.interp(y, [0, 250], [0.65, 1])
-                video.render_img[y, ...] = video.render_img[y, ...] * v
 
-        if props.octave_lines:
+class BUILTIN_ST_DimTop(pv.Overlay):
+    idname = "blocks_dim_top"
+
+    def build(self, video: Video, gain: np.ndarray, floor: np.ndarray) -> None:
+        if video.props.blocks.dim_top:
+            dim_height = int(250 * video.pixel_scale)
+            rows = min(dim_height, gain.shape[0])
+            gain[:rows] *= np.interp(np.arange(rows), [0, dim_height], [0.65, 1])[:, None]
+
+
+class BUILTIN_ST_OctaveLines(pv.Overlay):
+    idname = "blocks_octave_lines"
+
+    def build(self, video: Video, gain: np.ndarray, floor: np.ndarray) -> None:
+        if video.props.blocks.octave_lines:
+            half = video.resolution[1] // 2
             for note in range(3, 88, 12):
                 x, _ = video.data.core.key_pos[note]
-                for y in range(half):
-                    for ch in range(3):
-                        video.render_img[y, int(x), ch] = max(video.render_img[y, int(x), ch], 55)
+                floor[:half, int(x)] = np.maximum(floor[:half, int(x)], 55)
+
+
+class BUILTIN_JT_BlocksInit(pv.Job):
+    idname = "blocks_init"
+    ops = ("blocks.strip",)
 
 
 class BUILTIN_JT_Blocks(pv.Job):
     idname = "blocks"
     ops = ("blocks.render",)
 
+    def region(self, video: Video) -> list:
+        return []
+
 
 classes = (
     BUILTIN_PT_Blocks,
     BUILTIN_PT_BlocksSolid,
+    BUILTIN_DT_Blocks,
+    BUILTIN_OT_BlocksStrip,
     BUILTIN_OT_BlocksRender,
+    BUILTIN_ST_DimTop,
+    BUILTIN_ST_OctaveLines,
+    BUILTIN_JT_BlocksInit,
     BUILTIN_JT_Blocks,
 )
 
@@ -17,23 +17,24 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import numpy as np
 from pvkernel import Video
-from utils import block_pos, first_note
+from utils import visible_notes
 
+# Blocks are cut off this many pixels below the top of the keyboard.
+CLIP_MARGIN = 10
 
-def iter_blocks(video: Video):
+
+def block_rects(video: Video) -> np.ndarray:
     """
-    Iterate through all blocks to draw for the current frame.
-    Return a generator. Each entry is ``(x, y, width, height)``
+    All blocks to draw for the current frame.
+
+    :return: (N, 4) array of ``(x, y, width, height)``
     """
-    height = video.resolution[1]
-    threshold = height / 2
-    first = first_note(video)
+    threshold = video.resolution[1] / 2
+    notes, tops, bottoms = visible_notes(video)
+    bottoms = np.minimum(bottoms, threshold+CLIP_MARGIN)
+    key_pos = video.data.core.key_pos_array[notes["note"]]
 
-    for note in video.data.midi.notes:
-        top, bottom = block_pos(video, note, first)
-        if not (bottom < 0 or top > threshold):
-            x, width = video.data.core.key_pos[note.note]
-            bottom = min(bottom, threshold+10)
+    return np.stack((key_pos[:, 0], tops, key_pos[:, 1], bottoms-tops), axis=1)
 
-            yield (x, top, width, bottom-top)
@@ -17,19 +17,43 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import numpy as np
+from typing import Tuple
 from pvkernel import Video
-from pvkernel import draw
-from .block_utils import iter_blocks
+from pvkernel.utils import rgba
 
 
-def draw_block_solid(video: Video):
-    for rect in iter_blocks(video):
-        props = video.props.blocks_solid
-        rounding = props.rounding
+def solid_layers(video: Video, rects: np.ndarray) -> Tuple[np.ndarray, list, tuple, tuple]:
+    """
+    Layers (glow, fill and border) of solid blocks.
+
+    :param rects: (N, 4) blocks, see ``block_rects``.
+    :return: (dims, colors, borders, radii) to pass to ``draw.rects``.
+    """
+    props = video.props.blocks_solid
+    rounding = props.rounding
+    scale = video.pixel_scale
+
+    # Layers of each block: (rects, color, border, radius)
+    layers = []
+    if props.glow:
+        layers.append((rects + np.array([-3, -3, 6, 6])*scale, props.glow_color, 0, rounding+4*scale))
+    layers.append((rects, props.color, 0, rounding))
+    if props.border > 0:
+        layers.append((rects, props.border_color, props.border, rounding+2*scale))
+
+    dims, colors, borders, radii = zip(*layers)
+    return (np.stack(dims, axis=1), [rgba(c) for c in colors], borders, radii)
+
+
+def layers_box(dims: np.ndarray) -> Tuple[int, int, int, int]:
+    """
+    Box ``(y0, y1, x0, x1)`` around the pixels ``draw.rects`` may draw for the
+    dims of ``solid_layers``, with a margin for antialiasing. Not clipped.
+    """
+    if dims.size == 0:
+        return (0, 0, 0, 0)
+    x, y, w, h = dims.reshape(-1, 4).T
+    return (int(np.floor(y.min()))-2, int(np.ceil((y+h).max()))+2,
+        int(np.floor(x.min()))-2, int(np.ceil((x+w).max()))+2)
 
-        if props.glow:
-            new_rect = (rect[0]-3, rect[1]-3, rect[2]+6, rect[3]+6)
-            draw.rect(video.render_img, props.glow_color, new_rect, border_radius=rounding+4)
-        draw.rect(video.render_img, props.color, rect, border_radius=rounding)
-        if props.border > 0:
-            draw.rect(video.render_img, props.border_color, rect, border=props.border, border_radius=rounding+2)
@@ -0,0 +1,179 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Scrolling strip of blocks.
+
+Blocks move at a constant speed, so the blocks on screen are a window sliding
+over one tall image of all the blocks of the piece. With ``blocks.strip``, the
+image is drawn once in the ``blocks_init`` job, and every frame copies the
+window into the render image. At whole pixel offsets the copy is the same as
+drawing the blocks, apart from rounding (a few edge pixels may be off by one).
+Between them, the two nearest rows are interpolated.
+"""
+
+import hashlib
+import os
+import cv2
+import numpy as np
+from typing import Optional, Tuple
+from pv.utils import multigetattr
+from pvkernel import Video
+from pvkernel import draw
+from utils import block_pos_array, block_speed, first_note
+from .block_utils import CLIP_MARGIN, block_rects
+from .solid import solid_layers
+
+# Properties the strip is drawn with, other than the note table and key positions.
+DEPENDS = (
+    "blocks.speed",
+    "blocks_solid.rounding",
+    "blocks_solid.border",
+    "blocks_solid.glow",
+    "blocks_solid.color",
+    "blocks_solid.border_color",
+    "blocks_solid.glow_color",
+    "midi.reverse",
+    "core.pause_start",
+)
+
+# Strips larger than this many bytes are stored in the cache and memory mapped.
+MEMORY_LIMIT = 1 << 28
+
+
+def strip_key(video: Video) -> str:
+    """
+    Hash of everything the strip of a video is drawn from.
+    """
+    props = [multigetattr(video.props, name) for name in DEPENDS]
+    digest = hashlib.sha256(f"{video.resolution!r} {video.fps!r} {video.pixel_scale!r} {props!r} "
+        f"{first_note(video)!r} {video.data.core.running_time!r}".encode())
+    digest.update(np.ascontiguousarray(video.data.midi.note_table).tobytes())
+    digest.update(video.data.core.key_pos_array.tobytes())
+    return digest.hexdigest()
+
+
+def strip_rows(video: Video) -> Optional[Tuple[int, int]]:
+    """
+    Screen rows the strip can be used for: all rows, except the top rows, where
+    blocks below the screen are culled but their glow may show, and the rows above
+    the keyboard, where blocks are cut off (``CLIP_MARGIN``) or culled.
+
+    :return: ``(start, end)``, or None if there are no such rows.
+    """
+    threshold = video.resolution[1] / 2
+    dims, _, borders, radii = solid_layers(video, np.zeros((1, 4)))
+    above = -dims[0, :, 1]
+    below = dims[0, :, 1] + dims[0, :, 3]
+    # Rows above a layer's bottom that depend on where it is.
+    reach = np.maximum(radii, np.array(borders)+1)
+
+    start = int(np.ceil(below.max())) + 2
+    end = min(video.resolution[1] // 2, int(np.floor(threshold - above.max())) - 1,
+        int(np.floor(np.min(threshold + CLIP_MARGIN + below - reach))))
+    return (start, end) if start < end else None
+
+
+class BlockStrip:
+    """
+    All the blocks of the piece, drawn once into one tall image (``img``).
+
+    Screen row ``y`` at frame ``f`` is row ``y + origin - direction*speed*f`` of
+    the strip, for rows ``rows[0]`` to ``rows[1]`` (see ``strip_rows``). The other
+    rows are drawn every frame.
+
+    :param path: File to store the strip in, if it is larger than ``MEMORY_LIMIT``.
+    """
+    key: str
+    img: np.ndarray
+    rows: Tuple[int, int]
+    origin: float
+    speed: float
+    direction: int
+
+    def __init__(self, video: Video, key: str, rows: Tuple[int, int], path: str) -> None:
+        self.key = key
+        self.rows = rows
+        self.speed = block_speed(video)
+        # Blocks go down the screen as frames go on, or up if reversed.
+        self.direction = -1 if video.props.midi.reverse else 1
+
+        intro = video.props.core.pause_start * video.fps
+        frames = np.array([-intro-1, video.data.core.running_time-intro+1])
+        shifts = self.direction * self.speed * frames
+        self.origin = np.ceil(shifts.max()) + 0.0
+        height = int(np.ceil(rows[1] + self.origin - shifts.min())) + 2
+
+        shape = (height, video.resolution[0], 3)
+        if np.prod(shape) > MEMORY_LIMIT:
+            self.img = np.memmap(path, dtype=np.uint8, mode="w+", shape=shape)
+        else:
+            self.img = np.zeros(shape, dtype=np.uint8)
+
+        table = video.data.midi.note_table
+        tops, bottoms = block_pos_array(video, table["start"], table["end"], first_note(video), frame=0)
+        key_pos = video.data.core.key_pos_array[table["note"]]
+        rects = np.stack((key_pos[:, 0], tops+self.origin, key_pos[:, 1], bottoms-tops), axis=1)
+        draw.rects(self.img, *solid_layers(video, rects))
+
+    def render(self, video: Video, layers: Optional[tuple] = None) -> bool:
+        """
+        Draw the blocks of the current frame on the render image.
+
+        :param layers: ``solid_layers`` of the blocks of the current frame, if known.
+        :return: False if the frame is outside the strip, and nothing was drawn.
+        """
+        start = self.rows[0] + self.origin - self.direction*self.speed*video.frame
+        row = int(np.floor(start))
+        fac = start - row
+        if fac > 1 - 1e-6:
+            row, fac = row+1, 0
+        size = self.rows[1] - self.rows[0]
+        if row < 0 or row+size+1 > self.img.shape[0]:
+            return False
+
+        dest = video.render_img[self.rows[0]:self.rows[1]]
+        if fac < 1e-6:
+            np.copyto(dest, self.img[row:row+size])
+        else:
+            cv2.addWeighted(self.img[row:row+size], 1-fac, self.img[row+1:row+size+1], fac, 0, dst=dest)
+
+        if layers is None:
+            layers = solid_layers(video, block_rects(video))
+        draw.rects(video.render_img, *layers, rows=(0, self.rows[0]))
+        draw.rects(video.render_img, *layers, rows=(self.rows[1], video.resolution[1]))
+        return True
+
+
+def init_strip(video: Video) -> Optional[BlockStrip]:
+    """
+    The strip of a video, reusing the current one (``video.data.blocks.strip``) if
+    nothing it depends on changed, e.g. in forked export workers.
+
+    :return: None if the strip can't be used.
+    """
+    rows = strip_rows(video)
+    if rows is None or video.live_input is not None:
+        return None
+
+    key = strip_key(video)
+    strip = video.data.blocks.items.get("strip")
+    if strip is not None and strip.key == key:
+        return strip
+    return BlockStrip(video, key, rows, os.path.join(video.cache, "blocks_strip.raw"))
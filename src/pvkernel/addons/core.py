@@ -28,9 +28,11 @@ Will register:
 * Job group ``core``
 """
 
+import numpy as np
 import pv
 from pv.props import FloatProp
 from pvkernel import Video
+from pvkernel.overlay import StaticOverlay
 
 
 class BUILTIN_PT_Core(pv.PropertyGroup):
@@ -61,10 +63,9 @@ class BUILTIN_OT_RunningTime(pv.Operator):
 
     def execute(self, video: Video) -> None:
         pause = video.fps * (video.props.core.pause_start+video.props.core.pause_end)
-        first_note = min(video.data.midi.notes, key=lambda n: n.start).start
-        last_note = max(video.data.midi.notes, key=lambda n: n.end).end
-
-        total = pause + (last_note-first_note)
+        table = video.data.midi.note_table
+        # No notes yet in live mode.
+        total = pause + (table["end"].max()-table["start"].min() if len(table) > 0 else 0)
         video.data.core.running_time = int(total)
 
 
@@ -72,7 +73,7 @@ class BUILTIN_OT_KeyPos(pv.Operator):
     group = "core"
     idname = "key_pos"
     label = "Key Positions"
-    description = "Calculate key X positions and widths and store in a list at core_data.key_pos"
+    description = "Calculate key X positions and widths and store in a list at core_data.key_pos, and as an array at core_data.key_pos_array"
 
     @staticmethod
     def is_white(key: int):
@@ -99,6 +100,27 @@ class BUILTIN_OT_KeyPos(pv.Operator):
                 video.data.core.key_pos[key] = (x-black_width/2, black_width)
 
         assert None not in video.data.core.key_pos, "Error calculating key position."
+        video.data.core.key_pos_array = np.array(video.data.core.key_pos, dtype=np.float64)
+
+
+class BUILTIN_OT_OverlayInit(pv.Operator):
+    group = "core"
+    idname = "overlay_init"
+    label = "Build Static Overlay"
+    description = "Build all registered static overlays (pv.Overlay) into one. Saves to core_data.overlay"
+
+    def execute(self, video: Video) -> None:
+        video.data.core.overlay = StaticOverlay(video)
+
+
+class BUILTIN_OT_Overlay(pv.Operator):
+    group = "core"
+    idname = "overlay"
+    label = "Apply Static Overlay"
+    description = "Apply the static overlay on the render image."
+
+    def execute(self, video: Video) -> None:
+        video.data.core.overlay.apply(video)
 
 
 class BUILTIN_JT_Core(pv.Job):
@@ -106,12 +128,30 @@ class BUILTIN_JT_Core(pv.Job):
     ops = ("core.running_time", "core.key_pos")
 
 
+class BUILTIN_JT_OverlayInit(pv.Job):
+    idname = "overlay_init"
+    ops = ("core.overlay_init",)
+
+
+class BUILTIN_JT_Overlay(pv.Job):
+    idname = "overlay"
+    ops = ("core.overlay",)
+
+    def region(self, video: Video) -> list:
+        # The gain can't make a black pixel brighter.
+        return video.data.core.overlay.floor_boxes
+
+
 classes = (
     BUILTIN_PT_Core,
     BUILTIN_DT_Core,
     BUILTIN_OT_RunningTime,
     BUILTIN_OT_KeyPos,
+    BUILTIN_OT_OverlayInit,
+    BUILTIN_OT_Overlay,
     BUILTIN_JT_Core,
+    BUILTIN_JT_OverlayInit,
+    BUILTIN_JT_Overlay,
 )
 
 def register():
@@ -29,6 +29,9 @@ from pvkernel.lib import *
 
 LIB.glare.argtypes = (IMG, I32, I32, F64, F64, AR_UCH, UCH, F64, F64)
 
+# Pixels drawn past the glare radius (``border`` in glare.cpp).
+GLARE_BORDER = 25
+
 
 class GLARE_PT_Props(pv.PropertyGroup):
     idname = "glare"
@@ -49,6 +52,7 @@ class GLARE_PT_Props(pv.PropertyGroup):
         name="Radius",
         description="Glare radius in pixels.",
         default=75,
+        subtype="PIXEL",
     )
 
 
@@ -69,7 +73,7 @@ class GLARE_OT_Apply(pv.Operator):
         end = video.props.keyboard.right_offset + width
         intensity = props.intensity
         radius = props.radius
-        notes = np.array(video.data.midi.notes_playing, dtype=np.uint8)
+        notes = video.data.midi.timeline.playing(video.frame).astype(np.uint8)
 
         LIB.glare(video.render_img, width, height, intensity/2, radius,
             notes, notes.shape[0], start, end)
@@ -79,6 +83,16 @@ class GLARE_JT_Job(pv.Job):
     idname = "glare"
     ops = ("glare.apply",)
 
+    def region(self, video: Video) -> list:
+        props = video.props.glare
+        if not props.on or len(video.data.midi.timeline.playing(video.frame)) == 0:
+            return []
+        # Glare of every key, around the top of the keyboard. glare.cpp draws up to
+        # GLARE_BORDER pixels past a radius of up to 1.1 times the property.
+        mid = video.resolution[1] / 2
+        reach = np.ceil(1.1*props.radius) + GLARE_BORDER + 2
+        return [(int(np.floor(mid-reach)), int(np.ceil(mid+reach)), 0, video.resolution[0])]
+
 
 classes = (
     GLARE_PT_Props,
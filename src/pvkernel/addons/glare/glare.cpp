@@ -46,8 +46,12 @@ extern "C" void glare(UCH* img, const int width, const int height, CD intensity,
         const double curr_intensity = intensity - Random::uniform(0, 0.1);
         const double rad = radius * Random::uniform(1, 0.9);   // Current radius
 
-        for (int x = x_pos-rad-border; x < x_pos+rad+border; x++) {
-            for (int y = mid-rad-border; y < mid+rad+border; y++) {
+        // Clipped to the image, so pixels past the sides don't wrap to other rows.
+        const int x0 = std::max((int)(x_pos-rad-border), 0), y0 = std::max((int)(mid-rad-border), 0);
+        CD x1 = std::min(x_pos+rad+border, (double)width), y1 = std::min(mid+rad+border, (double)height);
+
+        for (int x = x0; x < x1; x++) {
+            for (int y = y0; y < y1; y++) {
                 // const double dx = abs(x-x_pos), dy = abs(y-mid);
                 const double dist = pythag(x-x_pos, y-mid);
                 const double dist_fac = dist / rad;
@@ -43,12 +43,14 @@ class KEYBOARD_PT_Props(pv.PropertyGroup):
         name="Left Offset",
         description="Piano left side pixel offset.",
         default=0,
+        subtype="PIXEL",
     )
 
     right_offset = FloatProp(
         name="Right Offset",
         description="Piano right side pixel offset",
         default=0,
+        subtype="PIXEL",
     )
 
     black_width_fac = FloatProp(
@@ -71,6 +73,7 @@ class KEYBOARD_PT_Props(pv.PropertyGroup):
         name="Crop",
         description="Corner locations in clockwise starting from top left.",
         default=[[0, 0], [1920, 0], [1920, 1080], [0, 1080]],
+        subtype="PIXEL",
     )
 
     height_fac = FloatProp(
@@ -83,6 +86,7 @@ class KEYBOARD_PT_Props(pv.PropertyGroup):
         name="Mask",
         description="Amount of space under the keyboard to show (pixels).",
         default=200,
+        subtype="PIXEL",
     )
 
     sub_dim = FloatProp(
@@ -121,27 +125,39 @@ class KEYBOARD_OT_Render(pv.Operator):
         props = video.props.keyboard
 
         size = data.size
+        out_size = (size[0], int(round(size[1]*props.height_fac)))
+        buffers = video.buffers
 
-        # Read and warp frame to rectangle.
+        # Read and warp frame to rectangle. All temporaries are reused buffers.
         img = read_frame(video, video.frame)
-        img = cv2.warpPerspective(img, data.crop, size)
-        img = cv2.resize(img, size)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        warped = buffers.get("keyboard.warped", (size[1], size[0], 3), np.uint8)
+        cv2.warpPerspective(img, data.crop, size, dst=warped)
+        cv2.cvtColor(warped, cv2.COLOR_BGR2RGB, dst=warped)
 
         # Apply studio lighting
-        apply_lighting(video, img)
+        apply_lighting(video, warped)
 
         # Final processing
-        img = img * data.mask_img
-        img = cv2.resize(img, (0, 0), fx=1, fy=props.height_fac)
-
-        # Perform color manipulations
-        img = np.maximum(img.astype(np.int16)-props.sub_dim, 0).astype(np.uint8)
-        img = img * props.mult_dim
-        for i in range(3):
-            img[..., i] *= props.rgb_mod[i]
-
-        video.render_img[height_mid:height_mid+img.shape[0], ...] = img[:height_mid, ...]
+        masked = buffers.get("keyboard.masked", warped.shape, np.float32)
+        np.multiply(warped, data.mask_img, out=masked)
+        scaled = buffers.get("keyboard.scaled", (out_size[1], out_size[0], 3), np.float32)
+        cv2.resize(masked, out_size, dst=scaled)
+
+        # Perform color manipulations, in float64 and in this order, so pixels are
+        # the same as computing them with new arrays.
+        img = buffers.get("keyboard.color", scaled.shape, np.float64)
+        np.floor(scaled, out=img)
+        np.subtract(img, props.sub_dim, out=img)
+        np.maximum(img, 0, out=img)
+        np.floor(img, out=img)
+        np.multiply(img, props.mult_dim, out=img)
+        np.multiply(img, np.asarray(props.rgb_mod, dtype=np.float64), out=img)
+
+        if video.layer is None:
+            dest = video.render_img[height_mid:height_mid+img.shape[0], ...]
+            np.copyto(dest, img[:dest.shape[0], ...], casting="unsafe")
+        else:
+            video.layer.paint(img, height_mid, 0)
 
 
 class KEYBOARD_DT_Data(pv.DataGroup):
@@ -151,6 +167,12 @@ class KEYBOARD_DT_Data(pv.DataGroup):
 class KEYBOARD_JT_Render(pv.Job):
     idname = "keyboard_render"
     ops = ("keyboard.render",)
+    layer = "keyboard"
+
+    def layer_key(self, video: Video) -> int:
+        # The same keyboard video frame is shown for several frames before it
+        # starts, and if it has a lower frame rate.
+        return max(source_frame(video, video.frame), 0)
 
 
 class KEYBOARD_JT_Deinit(pv.Job):
@@ -160,6 +182,16 @@ class KEYBOARD_JT_Deinit(pv.Job):
         video.data.keyboard.video.release()
 
 
+def source_frame(video: Video, frame: int) -> int:
+    """
+    Frame of ``video.data.keyboard.video`` shown at a frame. Reading a negative
+    frame reads the first frame.
+
+    :param frame: 0 = when the first block starts playing.
+    """
+    return int(video.props.keyboard.video_start*video.data.keyboard.fps + frame/video.fps*video.data.keyboard.fps)
+
+
 def read_frame(video: Video, frame: int) -> np.ndarray:
     """
     Read a frame from ``video.data.keyboard.video``.
@@ -168,13 +200,15 @@ def read_frame(video: Video, frame: int) -> np.ndarray:
     :param frame: Frame to read. 0 = when the first block starts playing.
     """
     data = video.data.keyboard
-    props = video.props.keyboard
+    data.video.set(1, source_frame(video, frame))
 
-    real_frame = int(props.video_start*data.fps + frame/video.fps*data.fps)
-    data.video.set(1, real_frame)
-
-    ret, img = data.video.read()
+    ret, img = data.video.read(data.frame_buf)
     assert ret, "VideoCapture read failed."
+    data.frame_buf = img
+
+    # Crop corners are scaled in draft mode, so scale the frame too.
+    if video.pixel_scale != 1:
+        img = cv2.resize(img, (0, 0), fx=video.pixel_scale, fy=video.pixel_scale, interpolation=cv2.INTER_AREA)
 
     return img
 
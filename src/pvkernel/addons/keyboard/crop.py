@@ -44,6 +44,7 @@ class KEYBOARD_JT_Init(pv.Job):
         mask = props.mask
 
         data.video = cv2.VideoCapture(props.video_path)
+        data.frame_buf = None
         data.fps = video.data.keyboard.video.get(cv2.CAP_PROP_FPS)
 
         #
@@ -26,15 +26,89 @@ Will register:
 * Property group ``midi``
 * Operator group ``midi``
 * Job ``midi``
+
+Notes are stored in ``video.data.midi.note_table``, a structured numpy array with
+fields ``start``, ``end`` (frames), ``note`` and ``velocity``, sorted by start.
+``video.data.midi.notes`` is a list-like view of it as ``Note`` objects, and
+``video.data.midi.note_index`` finds the notes at a frame (see ``utils.NoteIndex``).
+``video.data.midi.timeline`` has the notes playing at every frame (see ``NoteTimeline``).
+Frames are relative to ``video.data.midi.first_note``, the start of the first note.
+
+MIDI messages are kept in ``video.data.midi.events``, a structured numpy array with
+fields ``time`` (frames), ``type`` (index in ``EVENT_TYPES``), ``channel``, ``data1``
+and ``data2`` (see ``EVENT_FIELDS``), sorted by time. Only note on and off events,
+and the events add-ons register with ``register_event``, are kept:
+
+.. code-block:: py
+
+    import midi
+
+    def register():
+        midi.register_event("control_change", controls=(64,))
+
+``video.data.midi.messages`` is a list-like view of it as ``Message`` objects.
+
+The note and event tables are cached in ``video.shared_cache``, keyed by the
+contents of the MIDI files, ``fps``, ``min_len`` and the registered events, and
+memory mapped on later runs.
+
+In live mode (see ``pvkernel.live``), the tables only have the notes on screen,
+and are updated every frame by ``midi.live_update``.
 """
 
 import os
+import hashlib
+import multiprocessing
 import mido
+import numpy as np
 import pv
 from pv.props import BoolProp, FloatProp, StrProp
 from pvkernel import Video
-from utils import block_pos, first_note
-from typing import Any, Dict
+from utils import NoteIndex, block_speed
+from typing import Any, Dict, FrozenSet, Optional, Sequence, Tuple
+
+NOTE_DTYPE = np.dtype([
+    ("start", np.float64),
+    ("end", np.float64),
+    ("note", np.int32),
+    ("velocity", np.int32),
+])
+
+EVENT_DTYPE = np.dtype([
+    ("time", np.float64),
+    ("type", np.uint8),
+    ("channel", np.uint8),
+    ("data1", np.int32),
+    ("data2", np.int32),
+])
+
+# Message types that can be kept as events, and the attributes stored in data1 and data2.
+EVENT_FIELDS = {
+    "note_on": ("note", "velocity"),
+    "note_off": ("note", "velocity"),
+    "polytouch": ("note", "value"),
+    "control_change": ("control", "value"),
+    "program_change": ("program",),
+    "aftertouch": ("value",),
+    "pitchwheel": ("pitch",),
+    "set_tempo": ("tempo",),
+    "time_signature": ("numerator", "denominator"),
+}
+EVENT_TYPES = tuple(EVENT_FIELDS)
+# Channel of meta events.
+NO_CHANNEL = 255
+
+# Tempo before the first tempo change (microseconds per beat, 120 BPM).
+DEFAULT_TEMPO = 500000
+
+# Total size of MIDI files (bytes) to read them in parallel.
+PARALLEL_MIN_SIZE = 1 << 16
+
+# Change when the parse results change, to invalidate old caches.
+CACHE_VERSION = 3
+
+# Registered event types, and the controllers to keep for control_change (None for all).
+_events: Dict[str, Optional[FrozenSet[int]]] = {"note_on": None, "note_off": None}
 
 
 class Message:
@@ -83,6 +157,372 @@ class Note:
         self.velocity = velocity
 
 
+class NoteView(Sequence):
+    """
+    Read only list of ``Note`` objects, created on access from a note table.
+    For compatibility, prefer using the note table.
+    """
+
+    def __init__(self, table: np.ndarray) -> None:
+        self._table = table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        start, end, note, velocity = self._table[index].tolist()
+        return Note(start, end, note, velocity)
+
+
+class MessageView(Sequence):
+    """
+    Read only list of ``Message`` objects, created on access from an event table.
+    For compatibility, prefer using the event table.
+    """
+
+    def __init__(self, events: np.ndarray) -> None:
+        self._events = events
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        time, type, channel, data1, data2 = self._events[index].tolist()
+        type = EVENT_TYPES[type]
+        attrs = {} if channel == NO_CHANNEL else {"channel": channel}
+        for name, value in zip(EVENT_FIELDS[type], (data1, data2)):
+            attrs[name] = value
+        return Message(type, time, **attrs)
+
+
+def register_event(type: str, controls: Optional[Sequence[int]] = None) -> None:
+    """
+    Keep MIDI events of a type in ``video.data.midi.events``. Call this in the
+    ``register`` function of an add-on. Note on and off events are always kept.
+
+    :param type: Message type, one of ``EVENT_TYPES``.
+    :param controls: For ``control_change``, only keep these controller numbers
+        (e.g. ``(64,)`` for the sustain pedal). Default all.
+    """
+    assert type in EVENT_FIELDS, f"Unsupported MIDI event type: {type}"
+    if controls is None or _events.get(type, frozenset()) is None:
+        _events[type] = None
+    else:
+        _events[type] = _events.get(type, frozenset()) | frozenset(controls)
+
+
+def event_row(msg: mido.Message, time: float) -> Optional[Tuple]:
+    """
+    Event table row of a message, or None if its type is not registered
+    (see ``register_event``).
+    """
+    if msg.type not in _events:
+        return None
+    controls = _events[msg.type]
+    if msg.type == "control_change" and controls is not None and msg.control not in controls:
+        return None
+    fields = EVENT_FIELDS[msg.type]
+    return (
+        time,
+        EVENT_TYPES.index(msg.type),
+        getattr(msg, "channel", NO_CHANNEL),
+        getattr(msg, fields[0]) if len(fields) > 0 else 0,
+        getattr(msg, fields[1]) if len(fields) > 1 else 0,
+    )
+
+
+def ticks_to_seconds(ticks: np.ndarray, tempo_ticks: np.ndarray, tempos: np.ndarray,
+        ticks_per_beat: int) -> np.ndarray:
+    """
+    Convert absolute tick positions to seconds with a tempo map.
+
+    :param ticks: Ticks to convert.
+    :param tempo_ticks: Ticks of the tempo changes, sorted.
+    :param tempos: Tempo (microseconds per beat) from each tempo change on.
+        The tempo before the first change is ``DEFAULT_TEMPO``.
+    """
+    tempo_ticks = np.concatenate(([0], tempo_ticks)).astype(np.int64)
+    seconds_per_tick = np.concatenate(([DEFAULT_TEMPO], tempos)) / (ticks_per_beat*1e6)
+    # Seconds at the start of each tempo.
+    tempo_seconds = np.concatenate(([0], np.cumsum(np.diff(tempo_ticks) * seconds_per_tick[:-1])))
+
+    tempo = np.searchsorted(tempo_ticks, ticks, side="right") - 1
+    return tempo_seconds[tempo] + (ticks-tempo_ticks[tempo]) * seconds_per_tick[tempo]
+
+
+def read_file_events(path: str, fps: float) -> np.ndarray:
+    """
+    Read the registered events (see ``register_event``) of one MIDI file into an
+    event table sorted by time. Other messages are skipped.
+
+    The tracks are read as ticks, which are converted to frames with the tempo
+    map of the file at once, so times don't drift in long pieces.
+
+    :param path: MIDI file path.
+    :param fps: Frames per second, to convert times to frames.
+    """
+    rows = []
+    tempo_changes = []
+    with mido.MidiFile(path) as midi:
+        assert midi.type != 2, f"Asynchronous (type 2) MIDI files are not supported: {path}"
+        for track in midi.tracks:
+            tick = 0
+            for msg in track:
+                tick += msg.time
+                if msg.type == "set_tempo":
+                    tempo_changes.append((tick, msg.tempo))
+                row = event_row(msg, tick)
+                if row is not None:
+                    rows.append(row)
+
+    # Same order as playing the file: by tick, then by track.
+    events = np.array(rows, dtype=EVENT_DTYPE)
+    events = events[np.argsort(events["time"], kind="stable")]
+    tempo_changes = np.array(tempo_changes, dtype=np.int64).reshape(-1, 2)
+    tempo_changes = tempo_changes[np.argsort(tempo_changes[:, 0], kind="stable")]
+
+    seconds = ticks_to_seconds(events["time"].astype(np.int64), tempo_changes[:, 0], tempo_changes[:, 1],
+        midi.ticks_per_beat)
+    events["time"] = seconds * fps
+    return events
+
+
+def merge_events(tables: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Merge event tables that are each sorted by time into one table sorted by time.
+    Events at the same time are in the order of the tables.
+
+    Instead of sorting, the position of each event in the result is its index in
+    its own table plus the number of events before it in each other table, found
+    with binary searches.
+    """
+    merged = np.empty(sum(len(table) for table in tables), dtype=EVENT_DTYPE)
+    for i, table in enumerate(tables):
+        positions = np.arange(len(table))
+        for j, other in enumerate(tables):
+            if j != i:
+                positions += np.searchsorted(other["time"], table["time"], side="right" if j < i else "left")
+        merged[positions] = table
+    return merged
+
+
+def read_events(paths: Sequence[str], fps: float) -> np.ndarray:
+    """
+    Read the registered events of MIDI files into one event table sorted by time.
+    Multiple large files are read in parallel processes, then merged.
+
+    :param paths: MIDI file paths.
+    :param fps: Frames per second, to convert times to frames.
+    """
+    # Worker processes of a pool (e.g. export workers) can't start processes.
+    parallel = (len(paths) > 1 and not multiprocessing.current_process().daemon
+        and sum(os.path.getsize(path) for path in paths) >= PARALLEL_MIN_SIZE)
+
+    if parallel:
+        with multiprocessing.get_context("fork").Pool(min(len(paths), os.cpu_count())) as pool:
+            tables = pool.starmap(read_file_events, [(path, fps) for path in paths])
+    else:
+        tables = [read_file_events(path, fps) for path in paths]
+
+    return merge_events(tables)
+
+
+def parse_notes(events: np.ndarray, min_frames: float) -> np.ndarray:
+    """
+    Pair note on and off events into a note table, sorted by start.
+    Each note off ends the last note on of the same key.
+
+    :param events: Event table.
+    :param min_frames: Minimum note length in frames.
+    """
+    types = events["type"]
+    events = events[(types == EVENT_TYPES.index("note_on")) | (types == EVENT_TYPES.index("note_off"))]
+    keys = events["data1"] - 21
+    events, keys = events[(0 <= keys) & (keys < 88)], keys[(0 <= keys) & (keys < 88)]
+
+    # Group by key, keeping the time order in each key.
+    order = np.argsort(keys, kind="stable")
+    events, keys = events[order], keys[order]
+    note_on = (events["type"] == EVENT_TYPES.index("note_on")) & (events["data2"] > 0)
+
+    # Index of the last note on so far, and of the first event of the key.
+    indices = np.arange(len(events))
+    last_on = np.maximum.accumulate(np.where(note_on, indices, -1)) if len(events) > 0 else indices
+    new_key = np.concatenate(([True], keys[1:] != keys[:-1])) if len(events) > 0 else note_on
+    key_start = np.maximum.accumulate(np.where(new_key, indices, 0)) if len(events) > 0 else indices
+
+    off = ~note_on
+    last_on, key_start, order = last_on[off], key_start[off], order[off]
+    # Notes off without a note on before start at 0.
+    starts = np.where(last_on >= key_start, events["time"][last_on], 0)
+    ends = starts + np.maximum(min_frames, events["time"][off]-starts)
+
+    table = np.empty(len(starts), dtype=NOTE_DTYPE)
+    table["start"] = starts
+    table["end"] = ends
+    table["note"] = keys[off]
+    table["velocity"] = events["data2"][off]
+    # Notes in the order they ended, then by start.
+    table = table[np.argsort(order, kind="stable")]
+    return table[np.argsort(table["start"], kind="stable")]
+
+
+def cache_key(paths: Sequence[str], fps: float, min_len: float) -> str:
+    """
+    Hash of the contents of MIDI files, the parse settings, and the registered events.
+    """
+    events = sorted((type, None if c is None else sorted(c)) for type, c in _events.items())
+    digest = hashlib.sha256(f"{CACHE_VERSION} {fps!r} {min_len!r} {events!r}".encode())
+    for path in paths:
+        with open(path, "rb") as fp:
+            digest.update(hashlib.sha256(fp.read()).digest())
+    return digest.hexdigest()
+
+
+class NoteTimeline:
+    """
+    Notes playing (crossing the keyboard) at every frame, built once from the
+    note table, so any frame can be looked up in any order.
+
+    A note is playing at frame ``f`` (``video.frame``) if
+    ``start <= first + f <= end``. The playing notes of all frames are stored
+    one frame after another, in note table order:
+
+    * ``indices``: Note table index of each entry.
+    * ``notes``: Note number of each entry.
+    * ``offsets``: Entries of frame ``f`` are ``offsets[f-frame_start]`` to
+      ``offsets[f-frame_start+1]``.
+    """
+    frame_start: int
+    offsets: np.ndarray
+    indices: np.ndarray
+    notes: np.ndarray
+
+    def __init__(self, table: np.ndarray, first: float) -> None:
+        """
+        :param table: Note table.
+        :param first: ``video.data.midi.first_note``
+        """
+        starts = np.ceil(table["start"] - first).astype(np.int64)
+        ends = np.floor(table["end"] - first).astype(np.int64)
+        lengths = np.maximum(ends-starts+1, 0)
+
+        self.frame_start = int(starts.min()) if len(table) > 0 else 0
+        num_frames = int(ends.max()) - self.frame_start + 1 if len(table) > 0 else 0
+
+        # Sweep: one entry per note per frame it plays.
+        indices = np.repeat(np.arange(len(table)), lengths)
+        entry_starts = np.cumsum(lengths) - lengths
+        frames = np.repeat(starts, lengths) + np.arange(len(indices)) - np.repeat(entry_starts, lengths)
+        order = np.lexsort((indices, frames))
+
+        self.indices = indices[order]
+        self.notes = table["note"][self.indices]
+        counts = np.bincount(frames-self.frame_start, minlength=num_frames)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        self._bounds_key = None
+
+    def _slice(self, frame: int) -> slice:
+        i = frame - self.frame_start
+        if not 0 <= i < len(self.offsets)-1:
+            return slice(0, 0)
+        return slice(self.offsets[i], self.offsets[i+1])
+
+    def playing(self, frame: int) -> np.ndarray:
+        """
+        Note numbers playing at a frame.
+        """
+        return self.notes[self._slice(frame)]
+
+    def key_bounds(self, frame: int, key_pos: np.ndarray, margin: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        X start and end of the keys playing at a frame, moved inwards by ``margin``.
+        Computed for all frames on the first call (and when the arguments change),
+        then looked up.
+
+        :param key_pos: ``video.data.core.key_pos_array``
+        """
+        key = (margin, key_pos.tobytes())
+        if self._bounds_key != key:
+            x = key_pos[self.notes, 0]
+            self._starts = x + margin
+            self._ends = x + key_pos[self.notes, 1] - margin
+            self._bounds_key = key
+        s = self._slice(frame)
+        return (self._starts[s], self._ends[s])
+
+
+class LiveNotes:
+    """
+    Note table of live MIDI input (see ``pvkernel.live``), updated every frame.
+    Notes are kept until they are off screen, and held notes end at the current
+    frame. Stored at ``video.data.midi.live_notes``.
+    """
+    finished: np.ndarray
+    held_start: np.ndarray
+    held_velocity: np.ndarray
+
+    def __init__(self) -> None:
+        self.finished = np.empty(0, dtype=NOTE_DTYPE)
+        self.held_start = np.full(88, np.nan)
+        self.held_velocity = np.zeros(88, dtype=np.int32)
+
+    def update(self, events: np.ndarray, now: float, min_frames: float, keep: float) -> np.ndarray:
+        """
+        Add events and return the note table at frame ``now``.
+
+        :param events: New events.
+        :param min_frames: Minimum note length in frames.
+        :param keep: Frames to keep notes after they end.
+        """
+        notes = []
+        for time, type, _, note, velocity in events.tolist():
+            key = note - 21
+            if EVENT_TYPES[type] not in ("note_on", "note_off") or not 0 <= key < 88:
+                continue
+            if EVENT_TYPES[type] == "note_on" and velocity > 0:
+                self.held_start[key] = time
+                self.held_velocity[key] = velocity
+            elif not np.isnan(self.held_start[key]):
+                start = self.held_start[key]
+                notes.append((start, start+max(min_frames, time-start), key, self.held_velocity[key]))
+                self.held_start[key] = np.nan
+
+        finished = np.concatenate((self.finished, np.array(notes, dtype=NOTE_DTYPE)))
+        self.finished = finished[finished["end"] >= now-keep]
+
+        keys = np.nonzero(~np.isnan(self.held_start))[0]
+        held = np.empty(len(keys), dtype=NOTE_DTYPE)
+        held["start"] = self.held_start[keys]
+        held["end"] = np.maximum(now, held["start"])
+        held["note"] = keys
+        held["velocity"] = self.held_velocity[keys]
+
+        table = np.concatenate((self.finished, held))
+        return table[np.argsort(table["start"], kind="stable")]
+
+
+def set_notes(video: Video, events: np.ndarray, table: np.ndarray, first: float) -> None:
+    """
+    Store an event table and a note table, and build the note lookups, in
+    ``video.data.midi``.
+
+    :param first: Frame the video time is relative to (``first_note``).
+    """
+    video.data.midi.events = events
+    video.data.midi.messages = MessageView(events)
+    video.data.midi.note_table = table
+    video.data.midi.first_note = first
+    video.data.midi.note_index = NoteIndex(table)
+    video.data.midi.timeline = NoteTimeline(table, first)
+    video.data.midi.notes = NoteView(table)
+
+
 class MIDI_PT_Midi(pv.PropertyGroup):
     idname = "midi"
 
@@ -97,6 +537,12 @@ class MIDI_PT_Midi(pv.PropertyGroup):
         default=0.1,
     )
 
+    cache = BoolProp(
+        name="Cache",
+        description="Cache parsed MIDI files, so they are only parsed again when they change.",
+        default=True,
+    )
+
     reverse = BoolProp(
         name="Reverse Notes",
         description="Notes start from the piano and go up instead.",
@@ -115,35 +561,56 @@ class MIDI_OT_Parse(pv.Operator):
     description = "Parse selected midi files and store in data group."
 
     def execute(self, video: Video) -> None:
-        paths = video.props.midi.paths.split(os.path.pathsep)
-        messages = []
-        for path in paths:
-            with mido.MidiFile(os.path.realpath(path)) as midi:
-                time = 0
-                for msg in midi:
-                    time += msg.time * video.fps
-                    attrs = {a: getattr(msg, a) for a in dir(msg) if (not a.startswith("_")) and (a not in ("time", "type"))}
-                    messages.append(Message(msg.type, time, **attrs))
-        messages.sort(key=lambda m: m.time)
-
-        min_frames = video.fps * video.props.midi.min_len
-        notes = []
-        on = [0] * 88   # When the note was on
-        for msg in messages:
-            if msg.type in ("note_on", "note_off"):
-                note = msg.note - 21
-                note_on = (msg.type == "note_on" and msg.velocity > 0)
-                if 0 <= note < 88:
-                    if note_on:
-                        on[note] = msg.time
-                    else:
-                        start = on[note]
-                        length = max(min_frames, msg.time-start)
-                        notes.append(Note(start, start+length, note, msg.velocity))
-        notes.sort(key=lambda n: n.start)
-
-        video.data.midi.messages = messages
-        video.data.midi.notes = notes
+        if video.live_input is not None:
+            # Notes arrive while rendering, see midi.live_update.
+            video.data.midi.live_notes = LiveNotes()
+            set_notes(video, np.empty(0, dtype=EVENT_DTYPE), np.empty(0, dtype=NOTE_DTYPE), 0)
+            return
+
+        paths = [os.path.realpath(path) for path in video.props.midi.paths.split(os.path.pathsep)]
+        min_len = video.props.midi.min_len
+
+        cache_paths = None
+        if video.props.midi.cache:
+            key = cache_key(paths, video.fps, min_len)
+            cache_paths = [os.path.join(video.shared_cache, "midi", f"{key}.{name}.npy") for name in ("events", "notes")]
+
+        if cache_paths is not None and all(os.path.isfile(path) for path in cache_paths):
+            events, table = (np.load(path, mmap_mode="r") for path in cache_paths)
+        else:
+            events = read_events(paths, video.fps)
+            table = parse_notes(events, video.fps*min_len)
+            if cache_paths is not None:
+                os.makedirs(os.path.dirname(cache_paths[0]), exist_ok=True)
+                for path, array in zip(cache_paths, (events, table)):
+                    # Write to a temporary file first, so other processes never read a partial file.
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as fp:
+                        np.save(fp, array)
+                    os.replace(tmp_path, path)
+
+        set_notes(video, events, table, float(table["start"][0]) if len(table) > 0 else 0)
+
+
+class MIDI_OT_LiveUpdate(pv.Operator):
+    group = "midi"
+    idname = "live_update"
+    label = "Live Update"
+    description = "In live mode, add the MIDI messages received since the last frame. " \
+        "``midi.events`` has only the new events."
+
+    def execute(self, video: Video) -> None:
+        if video.live_input is None:
+            return
+
+        rows = (event_row(msg, time) for time, msg in video.live_input.messages)
+        events = np.array([row for row in rows if row is not None], dtype=EVENT_DTYPE)
+
+        # Keep notes until their blocks are off screen.
+        speed = block_speed(video)
+        keep = video.resolution[1] / 2 / speed + 1 if speed > 0 else np.inf
+        table = video.data.midi.live_notes.update(events, video.frame, video.fps*video.props.midi.min_len, keep)
+        set_notes(video, events, table, 0)
 
 
 class MIDI_OT_NotesPlaying(pv.Operator):
@@ -153,14 +620,7 @@ class MIDI_OT_NotesPlaying(pv.Operator):
     description = "Calculate notes currently playing and store in ``midi.notes_playing``"
 
     def execute(self, video: Video) -> None:
-        threshold = video.resolution[1] / 2
-        first = first_note(video)
-
-        video.data.midi.notes_playing = []
-        for note in video.data.midi.notes:
-            top, bottom = block_pos(video, note, first)
-            if top <= threshold <= bottom:
-                video.data.midi.notes_playing.append(note.note)
+        video.data.midi.notes_playing = video.data.midi.timeline.playing(video.frame).tolist()
 
 
 class MIDI_JT_Init(pv.Job):
@@ -172,11 +632,20 @@ class MIDI_JT_FrameInit(pv.Job):
     idname = "midi_frame_init"
     ops = ("midi.notes_playing",)
 
+    def execute(self, video: Video) -> None:
+        # Before the operators, so the notes playing include the new events.
+        if video.live_input is not None:
+            pv.utils.call_op(video, "midi.live_update")
+
+    def region(self, video: Video) -> list:
+        return []
+
 
 classes = (
     MIDI_PT_Midi,
     MIDI_DT_Midi,
     MIDI_OT_Parse,
+    MIDI_OT_LiveUpdate,
     MIDI_OT_NotesPlaying,
     MIDI_JT_Init,
     MIDI_JT_FrameInit,
@@ -27,8 +27,8 @@ from pv.props import BoolProp, FloatProp, ListProp
 from pvkernel import Video
 from pvkernel.lib import *
 
-sim_args = (F64, I32, I32, I32, AR_DBL, AR_DBL, F64, AR_CH, AR_CH, I32, I32)
-render_args = (IMG, I32, I32, AR_CH, F64, UCH, UCH, UCH)
+sim_args = (F64, I32, I32, I32, AR_DBL, AR_DBL, F64, AR_CH, AR_CH, I32, I32, F64)
+render_args = (IMG, I32, I32, AR_CH, F64, UCH, UCH, UCH, AR_I32)
 LIB.ptcl_sim.argtypes = sim_args
 LIB.ptcl_render.argtypes = render_args
 sim_func = LIB.ptcl_sim
@@ -80,9 +80,40 @@ class PTCLS_OT_Apply(pv.Operator):
         render(video)
 
 
+class PTCLS_OT_Simulate(pv.Operator):
+    group = "ptcls"
+    idname = "simulate"
+    label = "Simulate Particles"
+    description = "Simulate particles for the current frame and save to cache."
+
+    def execute(self, video: Video) -> None:
+        simulate(video)
+
+
+class PTCLS_OT_Render(pv.Operator):
+    group = "ptcls"
+    idname = "render"
+    label = "Render Particles"
+    description = "Render particles of the current frame from cache."
+
+    def execute(self, video: Video) -> None:
+        render(video)
+
+
+class PTCLS_JT_Simulate(pv.Job):
+    idname = "ptcls_sim"
+    ops = ("ptcls.simulate",)
+
+    def region(self, video: Video) -> list:
+        return []
+
+
 class PTCLS_JT_Job(pv.Job):
     idname = "ptcls"
-    ops = ("ptcls.apply",)
+    ops = ("ptcls.render",)
+
+    def region(self, video: Video) -> list:
+        return []
 
 
 class PTCLS_CT_Cache(pv.Cache):
@@ -105,23 +136,19 @@ def simulate(video: Video):
     cache: pv.Cache = video.caches.ptcls
     frame = video.frame
 
-    in_path = get_cpath(cache, frame-1)
+    in_path = get_cpath(cache, frame-video.frame_step)
     out_path = get_cpath(cache, frame, check_exist=False)
     cache.fp_frame("w").close()
 
-    ppf = int(video.props.ptcls.pps / video.fps)
+    # In draft mode, simulate every frame_step frames with a larger timestep.
+    fps = video.fps / video.frame_step
+    ppf = int(video.props.ptcls.pps / fps * video.pixel_scale**2)
 
-    key_starts = []
-    key_ends = []
-    for note in video.data.midi.notes_playing:
-        x, width = video.data.core.key_pos[note]
-        key_starts.append(x+5)
-        key_ends.append(x+width-5)
-    key_starts = np.array(key_starts, dtype=np.float64)
-    key_ends = np.array(key_ends, dtype=np.float64)
+    key_starts, key_ends = video.data.midi.timeline.key_bounds(video.frame, video.data.core.key_pos_array,
+        5*video.pixel_scale)
 
-    sim_func(video.fps, video.frame, ppf, key_starts.shape[0], key_starts, key_ends, video.resolution[1]/2,
-        in_path, out_path, *video.resolution)
+    sim_func(fps, video.frame, ppf, key_starts.shape[0], key_starts, key_ends, video.resolution[1]/2,
+        in_path, out_path, *video.resolution, video.pixel_scale)
 
 
 def render(video: Video):
@@ -133,12 +160,17 @@ def render(video: Video):
     frame = video.frame
 
     path = get_cpath(cache, frame)
-    render_func(video.render_img, *video.resolution, path, video.props.ptcls.intensity*0.7, *video.props.ptcls.color)
+    box = np.zeros(4, dtype=np.int32)
+    render_func(video.render_img, *video.resolution, path, video.props.ptcls.intensity*0.7, *video.props.ptcls.color, box)
+    video.dirty.add(*box)
 
 
 classes = (
     PTCLS_PT_Props,
     PTCLS_OT_Apply,
+    PTCLS_OT_Simulate,
+    PTCLS_OT_Render,
+    PTCLS_JT_Simulate,
     PTCLS_JT_Job,
     PTCLS_CT_Cache,
 )
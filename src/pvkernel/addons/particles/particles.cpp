@@ -95,13 +95,14 @@ void ptcl_write_cache(std::vector<Particle>& ptcls, std::ofstream& fp) {
  * @param y_start Y coordinate.
  * @param ip Input file path (leave blank if no input).
  * @param op Output file path.
+ * @param scale Pixel scale of the render (less than 1 in draft mode).
  */
 extern "C" void ptcl_sim(CD fps, const int frame, const int num_new, const int num_notes,
         CD* x_starts, CD* x_ends, CD y_start, const char* ip, const char* op, const int width,
-        const int height) {
+        const int height, CD scale) {
 
-    CD vx_min = VX_MIN/fps, vx_max = VX_MAX/fps;
-    CD vy_min = VY_MIN/fps, vy_max = VY_MAX/fps;
+    CD vx_min = VX_MIN*scale/fps, vx_max = VX_MAX*scale/fps;
+    CD vy_min = VY_MIN*scale/fps, vy_max = VY_MAX*scale/fps;
 
     std::vector<Particle> ptcls;
     ptcls.reserve((int)1e4);
@@ -124,8 +125,8 @@ extern "C" void ptcl_sim(CD fps, const int frame, const int num_new, const int n
 
         CD real_start = start + gap;
         CD real_end = start + gap + x_size/2.0;
-        CD real_vmin = vx_min + phase/5.0;
-        CD real_vmax = vx_max + phase/5.0;
+        CD real_vmin = vx_min + phase*scale/5.0;
+        CD real_vmax = vx_max + phase*scale/5.0;
 
         for (int j = 0; j < num_new; j++) {
             Particle ptcl;
@@ -163,8 +164,8 @@ extern "C" void ptcl_sim(CD fps, const int frame, const int num_new, const int n
         const float age = ptcl.age + ptcl.x/10000;
         const float x_wind = sin(age*4.3 + Random::uniform(-0.1, 0.1)) + Random::uniform(-0.1, 0.1);
         const float y_wind = sin(age*5.7 + Random::uniform(-2.1, 2.1)) + Random::uniform(-0.1, 0.1);
-        ptcl.vx += x_wind / 15.0;
-        ptcl.vy += y_wind / 15.0;
+        ptcl.vx += x_wind * scale / 15.0;
+        ptcl.vy += y_wind * scale / 15.0;
     }
 
     // Simulate attracted to each other
@@ -200,9 +201,10 @@ extern "C" void ptcl_sim(CD fps, const int frame, const int num_new, const int n
  * Render smoke on the image.
  * @param path Input cache path.
  * @param intensity Intensity multiplier.
+ * @param box Output {y0, y1, x0, x1} of the pixels drawn, empty if none.
  */
 extern "C" void ptcl_render(UCH* img, const int width, const int height, const char* path, CD intensity,
-        const UCH r, const UCH g, const UCH b) {
+        const UCH r, const UCH g, const UCH b, int* box) {
 
     std::ifstream fp(path);
     std::vector<Particle> ptcls;
@@ -210,6 +212,7 @@ extern "C" void ptcl_render(UCH* img, const int width, const int height, const c
     ptcl_read_cache(ptcls, fp);
 
     const int size = ptcls.size();
+    box[0] = box[1] = box[2] = box[3] = 0;
 
     for (int i = 0; i < size; i++) {
         const int x = (int)ptcls[i].x, y = (int)ptcls[i].y;
@@ -228,6 +231,8 @@ extern "C" void ptcl_render(UCH* img, const int width, const int height, const c
 
             // Render pixels surrounding particle (also including)
             img_mixadd(img, width, x, y, intensity, color_main);
+            // The border is one pixel around, the streak goes up and left.
+            img_box_add(box, width, height, y-STREAK_LEN, y+2, x-STREAK_LEN, x+2);
             if (value_border > 0) {
                 for (int dx = -1; dx <= 1; dx++) {
                     for (int dy = -1; dy <= 1; dy++) {
@@ -29,7 +29,7 @@ from pvkernel.lib import *
 from pvkernel.utils import CUDA
 
 sim_args = (F64, I32, I32, I32, AR_DBL, AR_DBL, *[F64 for _ in range(5)], AR_CH, AR_CH, I32, I32)
-render_args = (IMG, I32, I32, AR_CH, F64, UCH, UCH, UCH)
+render_args = (IMG, I32, I32, AR_CH, F64, UCH, UCH, UCH, AR_I32)
 LIB.smoke_sim.argtypes = sim_args
 LIB.smoke_render.argtypes = render_args
 sim_func = LIB.smoke_sim
@@ -81,9 +81,40 @@ class SMOKE_OT_Apply(pv.Operator):
         render(video)
 
 
+class SMOKE_OT_Simulate(pv.Operator):
+    group = "smoke"
+    idname = "simulate"
+    label = "Simulate Smoke"
+    description = "Simulate smoke for the current frame and save to cache."
+
+    def execute(self, video: Video) -> None:
+        simulate(video)
+
+
+class SMOKE_OT_Render(pv.Operator):
+    group = "smoke"
+    idname = "render"
+    label = "Render Smoke"
+    description = "Render smoke of the current frame from cache."
+
+    def execute(self, video: Video) -> None:
+        render(video)
+
+
+class SMOKE_JT_Simulate(pv.Job):
+    idname = "smoke_sim"
+    ops = ("smoke.simulate",)
+
+    def region(self, video: Video) -> list:
+        return []
+
+
 class SMOKE_JT_Job(pv.Job):
     idname = "smoke"
-    ops = ("smoke.apply",)
+    ops = ("smoke.render",)
+
+    def region(self, video: Video) -> list:
+        return []
 
 
 class SMOKE_CT_Cache(pv.Cache):
@@ -107,23 +138,20 @@ def simulate(video: Video):
     cache: pv.Cache = video.caches.smoke
     frame = video.frame
 
-    in_path = get_cpath(cache, frame-1)
+    in_path = get_cpath(cache, frame-video.frame_step)
     out_path = get_cpath(cache, frame, check_exist=False)
     cache.fp_frame("w").close()
 
-    ppf = int(video.props.smoke.pps / video.fps)
+    # In draft mode, simulate every frame_step frames with a larger timestep.
+    fps = video.fps / video.frame_step
+    ppf = int(video.props.smoke.pps / fps * video.pixel_scale**2)
 
-    key_starts = []
-    key_ends = []
-    for note in video.data.midi.notes_playing:
-        x, width = video.data.core.key_pos[note]
-        key_starts.append(x+5)
-        key_ends.append(x+width-5)
-    key_starts = np.array(key_starts, dtype=np.float64)
-    key_ends = np.array(key_ends, dtype=np.float64)
+    key_starts, key_ends = video.data.midi.timeline.key_bounds(video.frame, video.data.core.key_pos_array,
+        5*video.pixel_scale)
 
-    sim_func(video.fps, video.frame, ppf, key_starts.shape[0], key_starts, key_ends, video.resolution[1]/2,
-        -10, 10, -125, -100, in_path, out_path, *video.resolution, video.props.smoke.diffusion)
+    vel = np.array([-10, 10, -125, -100]) * video.pixel_scale
+    sim_func(fps, video.frame, ppf, key_starts.shape[0], key_starts, key_ends, video.resolution[1]/2,
+        *vel, in_path, out_path, *video.resolution, video.props.smoke.diffusion)
 
 
 def render(video: Video):
@@ -135,12 +163,17 @@ def render(video: Video):
     frame = video.frame
 
     path = get_cpath(cache, frame)
-    render_func(video.render_img, *video.resolution, path, video.props.smoke.intensity/7, *video.props.smoke.color)
+    box = np.zeros(4, dtype=np.int32)
+    render_func(video.render_img, *video.resolution, path, video.props.smoke.intensity/7, *video.props.smoke.color, box)
+    video.dirty.add(*box)
 
 
 classes = (
     SMOKE_PT_Props,
     SMOKE_OT_Apply,
+    SMOKE_OT_Simulate,
+    SMOKE_OT_Render,
+    SMOKE_JT_Simulate,
     SMOKE_JT_Job,
     SMOKE_CT_Cache,
 )
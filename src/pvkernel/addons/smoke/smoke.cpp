@@ -197,9 +197,10 @@ extern "C" void smoke_sim(CD fps, const int frame, const int num_new, const int
  * Render smoke on the image.
  * @param path Input cache path.
  * @param intensity Intensity multiplier.
+ * @param box Output {y0, y1, x0, x1} of the pixels drawn, empty if none.
  */
 extern "C" void smoke_render(UCH* img, const int width, const int height, const char* path, CD intensity,
-        const UCH r, const UCH g, const UCH b) {
+        const UCH r, const UCH g, const UCH b, int* box) {
 
     std::ifstream fp(path);
     std::vector<SmokePtcl> ptcls;
@@ -207,6 +208,7 @@ extern "C" void smoke_render(UCH* img, const int width, const int height, const
     smoke_read_cache(ptcls, fp);
 
     const int size = ptcls.size();
+    box[0] = box[1] = box[2] = box[3] = 0;
 
     for (int i = 0; i < size; i++) {
         const int x = (int)ptcls[i].x, y = (int)ptcls[i].y;
@@ -218,6 +220,7 @@ extern "C" void smoke_render(UCH* img, const int width, const int height, const
 
             CD fac = intensity / Random::uniform(9, 11);
             img_mixadd(img, width, x, y, fac, color);
+            img_box_add(box, width, height, y-2, y+3, x-2, x+3);
 
             for (int dx = -2; dx <= 2; dx++) {
                 for (int dy = -2; dy <= 2; dy++) {
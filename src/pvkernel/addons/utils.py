@@ -21,15 +21,23 @@
 Utils for use by builtin addons.
 """
 
+import numpy as np
 from pvkernel import Video
-from typing import Tuple
+from typing import Optional, Tuple
 
 
 def first_note(video: Video) -> float:
     """
-    :return: The frame the first note starts.
+    :return: The frame the first note starts. Video frames are relative to this.
     """
-    return min(video.data.midi.notes, key=lambda n: n.start).start
+    return video.data.midi.first_note
+
+
+def block_speed(video: Video) -> float:
+    """
+    :return: Block speed in pixels per frame.
+    """
+    return video.props.blocks.speed * video.resolution[1] / video.fps
 
 
 def block_pos(video: Video, note, first_note: float) -> Tuple[float, float]:
@@ -43,13 +51,26 @@ def block_pos(video: Video, note, first_note: float) -> Tuple[float, float]:
         0 is the bottom (where the blocks hit the piano).
         Going up from 0 makes the y value smaller.
     """
-    frame = video.frame
-    height = video.resolution[1]
-    threshold = height / 2
-    speed = video.props.blocks.speed * height / video.fps   # pixels per frame
+    top, bottom = block_pos_array(video, note.start, note.end, first_note)
+    return (top, bottom)
+
+
+def block_pos_array(video: Video, starts: np.ndarray, ends: np.ndarray, first_note: float,
+        frame: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized ``block_pos``. Get the start and end block positions of many notes.
+
+    :param starts: Note start frames.
+    :param ends: Note end frames.
+    :param frame: Frame to get the positions at. Default the current frame.
+    :return: (tops, bottoms) arrays.
+    """
+    frame = video.frame if frame is None else frame
+    threshold = video.resolution[1] / 2
+    speed = block_speed(video)
 
-    start = note.start - first_note - frame
-    end = note.end - first_note - frame
+    start = starts - first_note - frame
+    end = ends - first_note - frame
     if video.props.midi.reverse:
         top = threshold + start*speed
         bottom = threshold + end*speed
@@ -58,3 +79,96 @@ def block_pos(video: Video, note, first_note: float) -> Tuple[float, float]:
         bottom = threshold - start*speed
 
     return (top, bottom)
+
+
+class NoteIndex:
+    """
+    Interval index over a note table (sorted by start), built once in the ``midi``
+    init job and stored at ``video.data.midi.note_index``.
+
+    Notes are grouped by length into classes: up to 1 frame, then ``2**(c-1)`` to
+    ``2**c`` frames. A note of a class that overlaps a time window starts at most
+    the longest length of its class before the window, so two binary searches in
+    the starts of each class find the notes that may overlap it. A long note
+    (e.g. a held or unmatched note) only adds itself, not the notes during it.
+    The notes found that don't overlap the window ended less than a class length
+    before it, so there are few of them, and a query costs ``O(log n + k)``.
+    """
+    indices: np.ndarray
+    starts: np.ndarray
+    bounds: np.ndarray
+    reach: np.ndarray
+
+    def __init__(self, table: np.ndarray) -> None:
+        lengths = table["end"] - table["start"]
+        classes = np.ceil(np.log2(np.maximum(lengths, 1))).astype(np.int64)
+
+        # Note table indices grouped by class, sorted by start in each class.
+        self.indices = np.argsort(classes, kind="stable")
+        self.starts = table["start"][self.indices]
+        counts = np.bincount(classes)
+        self.bounds = np.concatenate(([0], np.cumsum(counts)))
+        # Longest note of each class.
+        self.reach = np.zeros(len(counts))
+        np.maximum.at(self.reach, classes, lengths)
+
+    def query(self, t0: float, t1: float) -> np.ndarray:
+        """
+        Sorted note table indices of all notes that overlap frames ``t0`` to ``t1``
+        (inclusive), and possibly a few that don't.
+        """
+        parts = []
+        for lo, hi, reach in zip(self.bounds[:-1].tolist(), self.bounds[1:].tolist(), self.reach.tolist()):
+            if lo < hi:
+                starts = self.starts[lo:hi]
+                first = lo + np.searchsorted(starts, t0-reach, side="left")
+                last = lo + np.searchsorted(starts, t1, side="right")
+                parts.append(self.indices[first:last])
+        if len(parts) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+
+def _note_window(video: Video, t0: float, t1: float) -> Tuple[np.ndarray, float]:
+    """
+    Notes of the note table that may overlap frames ``t0`` to ``t1`` (relative to
+    the current frame), and the first note start.
+    """
+    first = first_note(video)
+    now = first + video.frame
+    # One frame of margin for rounding, callers test exactly.
+    window = video.data.midi.note_index.query(now+t0-1, now+t1+1)
+    return (video.data.midi.note_table[window], first)
+
+
+def visible_notes(video: Video) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Notes with blocks on screen at the current frame, in the order of the note table.
+
+    :return: (notes, tops, bottoms). ``notes`` are rows of
+        ``video.data.midi.note_table``.
+    """
+    threshold = video.resolution[1] / 2
+    speed = block_speed(video)
+    screen = threshold/speed if speed > 0 else np.inf
+    if video.props.midi.reverse:
+        table, first = _note_window(video, -screen, 0)
+    else:
+        table, first = _note_window(video, 0, screen)
+
+    tops, bottoms = block_pos_array(video, table["start"], table["end"], first)
+    mask = (bottoms >= 0) & (tops <= threshold)
+    return (table[mask], tops[mask], bottoms[mask])
+
+
+def playing_notes(video: Video) -> np.ndarray:
+    """
+    Notes with blocks crossing the keyboard at the current frame, in the order of
+    the note table.
+
+    :return: Rows of ``video.data.midi.note_table``.
+    """
+    threshold = video.resolution[1] / 2
+    table, first = _note_window(video, 0, 0)
+    tops, bottoms = block_pos_array(video, table["start"], table["end"], first)
+    return table[(tops <= threshold) & (threshold <= bottoms)]
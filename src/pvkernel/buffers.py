@@ -0,0 +1,181 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Reusable frame buffers, so the render loop doesn't allocate full size images
+every frame.
+"""
+
+import threading
+import weakref
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from .dirty import DirtyRegion
+
+
+class BufferPool:
+    """
+    Pool of reusable numpy arrays. Accessed with ``video.buffers``.
+
+    There are two kinds of buffers:
+
+    * Scratch buffers (``get``): One buffer per name, kept by the pool and returned
+      again every call. Use these for temporary images inside an operator.
+    * Frame buffers (``acquire`` and ``release``): Borrowed until released, e.g.
+      the render image, which is passed to the writer threads. Released buffers
+      are reused by the next ``acquire`` of the same shape and dtype. A buffer
+      that is never released is freed by the garbage collector as usual.
+
+    A frame buffer can carry the region of it that was drawn on (``set_region``),
+    so that clearing it (``acquire(zero=True)``) and converting it only process
+    that region. The region is forgotten when the buffer is acquired again.
+
+    The pool counts the bytes it allocates, so a render loop that reuses all of
+    its buffers allocates nothing after the first few frames. Call ``end_frame``
+    after each frame to record the bytes allocated per frame (see ``report``).
+
+    .. code-block:: py
+
+        tmp = video.buffers.get("keyboard.warp", (height, width, 3), np.uint8)
+        cv2.warpPerspective(img, crop, (width, height), dst=tmp)
+    """
+    allocated: int
+    frame_bytes: List[int]
+
+    def __init__(self) -> None:
+        self.allocated = 0
+        self.frame_bytes = []
+        self._last_allocated = 0
+        self._scratch: Dict[str, np.ndarray] = {}
+        self._free: Dict[Tuple, List[np.ndarray]] = {}
+        self._owned = weakref.WeakValueDictionary()
+        self._regions: Dict[int, DirtyRegion] = {}
+        self._lock = threading.Lock()
+
+    def _alloc(self, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        buf = np.empty(shape, dtype=dtype)
+        self.allocated += buf.nbytes
+        return buf
+
+    def get(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """
+        Return the scratch buffer ``name``. It is reallocated if the shape or dtype
+        changed. The contents are whatever was last written to it.
+
+        :param name: Unique name, e.g. ``"addon.purpose"``.
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        with self._lock:
+            buf = self._scratch.get(name)
+            if buf is None or buf.shape != shape or buf.dtype != dtype:
+                buf = self._alloc(shape, dtype)
+                self._scratch[name] = buf
+        return buf
+
+    def acquire(self, shape: Tuple[int, ...], dtype=np.uint8, zero: bool = False) -> np.ndarray:
+        """
+        Borrow a buffer. The contents are undefined. Thread safe.
+
+        :param zero: Make the buffer black. Only its last region is cleared, if it
+            has one (see ``set_region``).
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.get(key)
+            region = None
+            if free:
+                buf = free.pop()
+                region = self._regions.pop(id(buf), None)
+            else:
+                buf = self._alloc(shape, dtype)
+                self._owned[id(buf)] = buf
+                # The region of a freed buffer with the same id.
+                self._regions.pop(id(buf), None)
+
+        if zero:
+            if region is None:
+                buf.fill(0)
+            else:
+                region.clear(buf)
+        return buf
+
+    def set_region(self, buf: np.ndarray, region: DirtyRegion) -> None:
+        """
+        Set the region of a buffer from ``acquire`` that may not be black. Outside
+        of it, the buffer must be black. Ignored for other arrays. Thread safe.
+        """
+        with self._lock:
+            if self._owned.get(id(buf)) is buf:
+                self._regions[id(buf)] = region
+
+    def region(self, buf: np.ndarray) -> Optional[DirtyRegion]:
+        """
+        The region of a buffer set with ``set_region``, or None if not set.
+        """
+        with self._lock:
+            if self._owned.get(id(buf)) is not buf:
+                return None
+            return self._regions.get(id(buf))
+
+    def release(self, buf: np.ndarray) -> None:
+        """
+        Return a buffer from ``acquire``, so it can be reused. Thread safe.
+        The buffer must not be used after releasing it.
+        """
+        key = (buf.shape, buf.dtype.str)
+        with self._lock:
+            # Ignore arrays not from acquire, e.g. an add-on replaced the render image.
+            if self._owned.get(id(buf)) is not buf:
+                return
+            free = self._free.setdefault(key, [])
+            if not any(b is buf for b in free):
+                free.append(buf)
+
+    def end_frame(self) -> int:
+        """
+        Record and return the bytes allocated since the last call.
+        """
+        with self._lock:
+            count = self.allocated - self._last_allocated
+            self._last_allocated = self.allocated
+        self.frame_bytes.append(count)
+        return count
+
+    def report(self) -> str:
+        """
+        Bytes allocated in total and per frame.
+        Steady state is the mean of the second half of the frames.
+        """
+        frames = len(self.frame_bytes)
+        if frames == 0:
+            return f"Buffer pool: {self.allocated/1e6:.1f} MB allocated."
+        steady = np.mean(self.frame_bytes[frames//2:])
+        return (f"Buffer pool: {self.allocated/1e6:.1f} MB allocated, "
+            f"{np.mean(self.frame_bytes)/1e3:.1f} KB per frame, {steady/1e3:.1f} KB per frame in steady state.")
+
+    def clear(self) -> None:
+        """
+        Free all buffers held by the pool.
+        """
+        with self._lock:
+            self._scratch.clear()
+            self._free.clear()
+            self._owned.clear()
+            self._regions.clear()
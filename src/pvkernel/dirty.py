@@ -0,0 +1,111 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Dirty regions: the parts of a frame that were drawn on.
+
+Every job of a frame reports where it drew (see ``pv.Job.region``), into
+``video.dirty``. The rest of the frame is black. The region is kept with the
+frame buffer (see ``BufferPool.set_region``), so when the buffer is reused, only
+the region is cleared, and the color conversion of the writer only converts the
+region. In sparse passages, and before and after the piece (``core.pause_start``
+and ``core.pause_end``), only the keyboard and the few pixels drawn above it are
+processed.
+"""
+
+import cv2
+import numpy as np
+from typing import List, Tuple
+from .lib import *
+
+AR_TILES = np.ctypeslib.ndpointer(dtype=np.bool_, ndim=2, flags="aligned, c_contiguous")
+LIB.img_clear_tiles.argtypes = (IMG, I32, I32, AR_TILES, I32)
+
+# Tile size in pixels. Regions are tracked per tile.
+TILE = 16
+# Fraction of dirty tiles above which whole images are converted, as it is faster
+# than converting many boxes.
+FULL = 0.5
+
+
+class DirtyRegion:
+    """
+    Part of an image that may not be black, as a grid of ``TILE`` pixel tiles.
+
+    :param shape: ``(height, width)`` of the image.
+    """
+    shape: Tuple[int, int]
+    tiles: np.ndarray
+
+    def __init__(self, shape: Tuple[int, int]) -> None:
+        self.shape = tuple(shape[:2])
+        self.tiles = np.zeros((-(-self.shape[0] // TILE), -(-self.shape[1] // TILE)), dtype=bool)
+
+    @property
+    def empty(self) -> bool:
+        return not self.tiles.any()
+
+    def add(self, y0: int, y1: int, x0: int, x1: int) -> None:
+        """
+        Add a box of pixels. Clipped to the image.
+        """
+        height, width = self.shape
+        y0, y1 = max(int(y0), 0), min(int(y1), height)
+        x0, x1 = max(int(x0), 0), min(int(x1), width)
+        if y0 < y1 and x0 < x1:
+            self.tiles[y0//TILE:-(-y1//TILE), x0//TILE:-(-x1//TILE)] = True
+
+    def add_all(self) -> None:
+        """
+        Add the whole image.
+        """
+        self.tiles[:] = True
+
+    def boxes(self) -> List[Tuple[int, int, int, int]]:
+        """
+        Boxes ``(y0, y1, x0, x1)`` of pixels covering the region. Rows of tiles that
+        are the same are merged, and each is split into runs of dirty tiles.
+        """
+        height, width = self.shape
+        # Starts of groups of the same rows of tiles.
+        starts = np.flatnonzero(np.r_[True, (self.tiles[1:] != self.tiles[:-1]).any(axis=1)])
+        ends = np.r_[starts[1:], len(self.tiles)]
+        boxes = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            edges = np.flatnonzero(np.diff(self.tiles[start], prepend=False, append=False)).tolist()
+            y0, y1 = start*TILE, min(end*TILE, height)
+            for x0, x1 in zip(edges[::2], edges[1::2]):
+                boxes.append((y0, y1, x0*TILE, min(x1*TILE, width)))
+        return boxes
+
+    def clear(self, img: np.ndarray) -> None:
+        """
+        Make the region of an image (uint8, 3 channels) black.
+        """
+        LIB.img_clear_tiles(img, self.shape[1], self.shape[0], self.tiles, TILE)
+
+    def convert(self, src: np.ndarray, dest: np.ndarray, code: int) -> None:
+        """
+        ``cv2.cvtColor`` of the region of ``src`` into ``dest``.
+        """
+        if self.tiles.mean() > FULL:
+            cv2.cvtColor(src, code, dst=dest)
+            return
+        for y0, y1, x0, x1 in self.boxes():
+            cv2.cvtColor(src[y0:y1, x0:x1], code, dst=dest[y0:y1, x0:x1])
@@ -18,12 +18,16 @@
 #
 
 import numpy as np
-from typing import Tuple
+from typing import Optional, Tuple
 from ..lib import *
 from ..utils import rgba
 
 LIB.draw_circle.argtypes = [IMG, I32, I32, *[F64 for _ in range(8)]]
 LIB.draw_rect.argtypes = [IMG, I32, I32, *[F64 for _ in range(14)]]
+LIB.draw_rects.argtypes = [IMG, I32, I32, I32, I32, AR_DBL, AR_DBL, AR_DBL, AR_DBL, I32, I32]
+
+# Most layers per rectangle of ``rects``.
+MAX_LAYERS = 8
 
 
 def circle(img: np.ndarray, color: Tuple[float, ...], center: Tuple[float, float],
@@ -61,3 +65,38 @@ def rect(img: np.ndarray, color: Tuple[float, ...], dims: Tuple[float, float, fl
     assert img.dtype == np.uint8
     color = rgba(color)
     LIB.draw_rect(img, img.shape[1], img.shape[0], *dims, border, border_radius, tl_rad, tr_rad, bl_rad, br_rad, *color)
+
+
+def rects(img: np.ndarray, dims: np.ndarray, colors: np.ndarray, borders=0, radii=0,
+        rows: Optional[Tuple[int, int]] = None) -> None:
+    """
+    Draws many rectangles in one call. Each rectangle has one or more layers (e.g.
+    glow, fill and border) drawn on top of each other, in one pass over its pixels.
+    Same as calling ``rect`` for each layer of each rectangle in order.
+
+    :param img: Image.
+    :param dims: (N, L, 4) X, Y, W, H of each layer of each rectangle, or (N, 4)
+        for one layer.
+    :param colors: RGB or RGBA colors of each layer, (L, 3 or 4) or (N, L, 3 or 4).
+    :param borders: Border thickness of each layer, broadcast to (N, L).
+    :param radii: Corner rounding radius of each layer, broadcast to (N, L).
+    :param rows: ``(start, end)``, only draw these rows. Pixels are the same as
+        when drawing all rows.
+    """
+    assert img.dtype == np.uint8
+    rows = (0, img.shape[0]) if rows is None else rows
+    dims = np.asarray(dims, dtype=np.float64)
+    if dims.ndim == 2:
+        dims = dims[:, None, :]
+    num, layers = dims.shape[:2]
+    assert layers <= MAX_LAYERS, f"At most {MAX_LAYERS} layers are supported."
+
+    colors = np.asarray(colors, dtype=np.float64)
+    if colors.shape[-1] == 3:
+        colors = np.concatenate((colors, np.full((*colors.shape[:-1], 1), 255.0)), axis=-1)
+
+    def flat(array, shape):
+        return np.ascontiguousarray(np.broadcast_to(np.asarray(array, dtype=np.float64), shape)).ravel()
+
+    LIB.draw_rects(img, img.shape[1], img.shape[0], num, layers, flat(dims, (num, layers, 4)),
+        flat(borders, (num, layers)), flat(radii, (num, layers)), flat(colors, (num, layers, 4)), *rows)
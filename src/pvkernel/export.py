@@ -17,49 +17,406 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import os
+import multiprocessing
+import shutil
+import tempfile
 import numpy as np
 import cv2
-from tqdm import trange
-from typing import TYPE_CHECKING
+from tqdm import tqdm, trange
+from typing import Iterator, List, Optional, TYPE_CHECKING, Tuple
 from pv import Job
 from pv.utils import call_op
-from .videoio import VideoWriter, VideoWriterFFmpeg
+from .dirty import DirtyRegion
+from .profiler import profile_video
+from .resume import ResumeManifest
+from .videoio import PipelinedWriter, VideoWriter, VideoWriterFFmpeg
 
 Video = None
 if TYPE_CHECKING:
     from .video import Video
 
+# Video, and the folder of the worker caches, used by worker processes.
+# Set before forking so the workers inherit them.
+_worker_context = None
+_worker_cache = None
+
 
 def exe_job(video: Video, job: Job):
-    job.execute(video)
-    for op in job.ops:
-        call_op(video, op)
+    if video.profiler is None:
+        _exe_job(video, job)
+    else:
+        with video.profiler.span("job", job.idname, video._export_frame):
+            _exe_job(video, job)
+
+
+def _exe_job(video: Video, job: Job):
+    if job.layer is None:
+        job.execute(video)
+        for op in job.ops:
+            call_op(video, op)
+        boxes = job.region(video)
+        if boxes is None:
+            video.dirty.add_all()
+        else:
+            for box in boxes:
+                video.dirty.add(*box)
+        return
+
+    res = video.resolution
+    layer = video.layers.get(job.layer, job.blend, (res[1], res[0]))
+    key = job.layer_key(video)
+    if key is None or key != layer.key:
+        layer.clear()
+        video.layer = layer
+        try:
+            job.execute(video)
+            for op in job.ops:
+                call_op(video, op)
+        finally:
+            video.layer = None
+        layer.key = key
+    layer.composite(video.render_img)
+    video.dirty.add(*layer.box)
+
+
+def exe_slot(video: Video, slot: str):
+    if slot == "init":
+        # Properties may have changed since the layers were drawn.
+        video.layers.reset()
+    for job in video.get_jobs(slot):
+        exe_job(video, job)
+
 
+def set_frame(context: Video, frame: int) -> None:
+    """
+    Set the current frame of the video.
 
-def export(context: Video, path: str) -> None:
-    """Exports the video from a video."""
-    for job in context.get_jobs("init"):
-        exe_job(context, job)
+    :param frame: Frame index, starting from 0 at the beginning of the video.
+        Kept in ``context._export_frame`` to tag profiler spans, so job and
+        operator spans have the same frame as the frame span they are in.
+    """
+    intro = context.props.core.pause_start * context.fps
+    context._frame = int(frame - intro)
+    context._export_frame = frame
 
+
+def simulate_frame(context: Video, frame: int) -> None:
+    """
+    Run only the ``frame_init`` and ``simulate`` jobs of a frame.
+    """
+    set_frame(context, frame)
+    try:
+        if context.profiler is None:
+            exe_slot(context, "frame_init")
+            exe_slot(context, "simulate")
+        else:
+            with context.profiler.span("frame", "simulate", frame):
+                exe_slot(context, "frame_init")
+                exe_slot(context, "simulate")
+    finally:
+        context._export_frame = None
+
+
+def render_frame(context: Video, frame: int, simulate: bool = True) -> np.ndarray:
+    """
+    Render one frame and return the (RGB) image.
+    The image is borrowed from ``context.buffers``. Release it when done with it
+    (``PipelinedWriter`` does) so the next frame can reuse it.
+
+    :param frame: Frame index, starting from 0 at the beginning of the video.
+    :param simulate: Whether to run the ``simulate`` jobs. Set to False if the
+        simulation was already run for this frame.
+    """
+    try:
+        if context.profiler is not None:
+            with context.profiler.span("frame", "render", frame):
+                return _render_frame(context, frame, simulate)
+        return _render_frame(context, frame, simulate)
+    finally:
+        # Jobs run between frames (e.g. deinit) are not tagged with a frame.
+        context._export_frame = None
+
+
+def _render_frame(context: Video, frame: int, simulate: bool) -> np.ndarray:
     res = context.resolution
+    set_frame(context, frame)
+    # Only the region drawn on when the buffer was last used is cleared.
+    context._render_img = context.buffers.acquire((res[1], res[0], 3), np.uint8, zero=True)
+    context.dirty = DirtyRegion((res[1], res[0]))
+
+    exe_slot(context, "frame_init")
+    if simulate:
+        exe_slot(context, "simulate")
+    exe_slot(context, "frame")
+    exe_slot(context, "frame_deinit")
+    exe_slot(context, "modifiers")
+
+    context.buffers.set_region(context.render_img, context.dirty)
+    return context.render_img
+
+
+def export(context: Video, path: str, workers: int = 1, chunk: float = 60, warmup: float = 6,
+        two_phase: bool = False, pipeline: int = 8, start: int = 0, end: Optional[int] = None,
+        resume: bool = False, shard: Optional[str] = None, profile: Optional[str] = None,
+        memory: Optional[str] = None, memory_every: int = 30, memory_limit: Optional[float] = None) -> None:
+    """
+    Exports the video from a video.
+
+    :param workers: Number of processes to render with.
+        If more than 1, frames are rendered in parallel (see ``render_parallel``).
+    :param chunk: Seconds of video in each parallel or resumable work unit.
+    :param warmup: Seconds simulated before the first frame of a range or chunk, so
+        stateful simulations (smoke, particles) reach a steady state.
+    :param two_phase: Run the ``simulate`` jobs for the whole video first, then
+        render all frames. Simulation results are stored in the caches, so the render
+        pass can process frames in any order.
+    :param pipeline: Max frames queued between the render, color conversion and encode
+        stages, which run concurrently. Set to 0 to run them one after another.
+    :param start: First frame to render.
+    :param end: Frame to stop rendering at (not included). Default end of video.
+    :param resume: Render in chunks saved next to the output, and record finished
+        chunks in a manifest (see ``pvkernel.resume``). If the export is interrupted,
+        calling it again with the same settings continues where it stopped.
+    :param shard: Shared folder for sharded rendering (see ``pvkernel.shard``). Any
+        number of processes, on any machine that can access the folder, can call
+        export with the same settings and shard folder to render together.
+    :param profile: Time every job, operator, frame and writer stage, print a
+        summary, and save a Chrome trace to this path (see ``pvkernel.profiler``).
+        With multiple workers, only this process (e.g. the simulation) is recorded.
+        The serial export also prints the writer stage and buffer pool reports
+        when profiling.
+    :param memory: Record memory usage every ``memory_every`` frames, and the growth
+        of each job and operator, print a summary and save the samples as JSON to
+        this path (see ``pvkernel.profiler.MemoryProfiler``).
+    :param memory_every: Frames between memory samples.
+    :param memory_limit: Stop the export with ``MemoryError`` if the process uses
+        more than this many MB.
+
+    In draft mode (see ``Video.draft``), only every ``frame_step`` frames are
+    rendered, and only the serial export is supported.
+    """
+    with profile_video(context, profile, memory, memory_every, memory_limit):
+        draft = context.frame_step > 1 or context.pixel_scale != 1
+        assert not draft or (workers == 1 and not resume and shard is None), \
+            "Draft mode only supports serial export."
+
+        exe_slot(context, "init")
+        total = context.data.core.running_time
+        end = total if end is None else min(end, total)
+        assert 0 <= start < end, f"Invalid frame range: {start} to {end}"
+        warmup = int(warmup * context.fps)
+
+        if shard is not None:
+            from .shard import export_shard
+            export_shard(context, path, shard, chunk, warmup, pipeline, start, end)
+        elif resume:
+            export_resume(context, path, workers, chunk, warmup, two_phase, pipeline, start, end)
+        elif workers > 1:
+            if two_phase:
+                simulate_range(context, max(start-warmup, 0), end)
+            exe_slot(context, "deinit")
+
+            spans = split_range(start, end, max(int(chunk*context.fps), 1))
+            seg_paths = [os.path.join(context.cache, f"segment_{s}-{e}.mkv") for s, e in spans]
+            results = render_parallel(context, spans, seg_paths, workers, warmup, two_phase, pipeline)
+            with open_writer(context, path) as video:
+                pbar = tqdm(total=end-start, desc=f"Rendering video ({workers} workers)")
+                for _, seg_path in results:
+                    copy_segment(seg_path, video, pbar)
+                    os.remove(seg_path)
+                pbar.close()
+        else:
+            # Warm up on frames aligned with start, so draft mode simulates the rendered frames.
+            step = context.frame_step
+            simulate_range(context, start - min(warmup, start)//step*step, end if two_phase else start)
+            with open_writer(context, path) as video:
+                with PipelinedWriter(video, pipeline, context.buffers, context.profiler) as pipe:
+                    for frame in trange(start, end, step, desc="Rendering video"):
+                        pipe.write(render_frame(context, frame, not two_phase))
+                        context.buffers.end_frame()
+            if context.profiler is not None:
+                print(pipe.report())
+                print(context.buffers.report())
+            exe_slot(context, "deinit")
+
+
+def export_resume(context: Video, path: str, workers: int, chunk: float, warmup: int,
+        two_phase: bool, pipeline: int, start: int, end: int) -> None:
+    """
+    Resumable export. The ``init`` jobs must have been run.
+
+    Frames are rendered in chunks into lossless segments next to the output.
+    A ``ResumeManifest`` records finished segments and how far the simulation caches
+    are complete. When all segments are finished, they are copied into the output,
+    and the segments and manifest are removed.
+    """
+    chunk_size = max(int(chunk*context.fps), 1)
+    settings = {
+        "start": start,
+        "end": end,
+        "chunk": chunk_size,
+        "fps": context.fps,
+        "resolution": context.resolution,
+        "two_phase": two_phase,
+    }
+    manifest = ResumeManifest(path, context, settings)
+
+    spans = split_range(start, end, chunk_size)
+    todo = [span for span in spans if not manifest.finished(span)]
+    if len(todo) < len(spans):
+        print(f"Resuming export: {len(spans)-len(todo)} of {len(spans)} chunks already done.")
+
+    if two_phase:
+        # Simulate in chunks, and checkpoint after each.
+        sim_start = max(start-warmup, 0) if manifest.checkpoint is None else manifest.checkpoint+1
+        for s, e in split_range(sim_start, end, chunk_size):
+            simulate_range(context, s, e)
+            manifest.set_checkpoint(e-1)
+
+    if workers > 1:
+        exe_slot(context, "deinit")
+        seg_paths = [manifest.segment_path(span) for span in todo]
+        for span, seg_path in render_parallel(context, todo, seg_paths, workers, warmup, two_phase, pipeline):
+            manifest.add_segment(span, seg_path)
+
+    else:
+        for span in tqdm(todo, desc="Rendering video"):
+            if not two_phase and manifest.checkpoint != span[0]-1:
+                simulate_range(context, max(span[0]-warmup, 0), span[0])
+            render_segment(context, span, manifest.segment_path(span), two_phase, pipeline)
+            manifest.add_segment(span, manifest.segment_path(span))
+            if not two_phase:
+                manifest.set_checkpoint(span[1]-1)
+        exe_slot(context, "deinit")
+
+    with open_writer(context, path) as video:
+        pbar = tqdm(total=end-start, desc="Compiling video")
+        for span in spans:
+            copy_segment(manifest.segment_path(span), video, pbar)
+        pbar.close()
+    manifest.remove()
+
+
+def open_writer(context: Video, path: str):
+    """
+    Return the output writer for the video.
+    """
     video_writer = VideoWriterFFmpeg if context.ffmpeg else VideoWriter
-    with video_writer(path, res, int(context.fps), context) as video:
-        intro = context.props.core.pause_start * context.fps
-        for frame in trange(context.data.core.running_time, desc="Rendering video"):
-            context._frame = int(frame - intro)
-            context._render_img = np.zeros((res[1], res[0], 3), dtype=np.uint8)
-
-            for job in context.get_jobs("frame_init"):
-                exe_job(context, job)
-            for job in context.get_jobs("frame"):
-                exe_job(context, job)
-            for job in context.get_jobs("frame_deinit"):
-                exe_job(context, job)
-            for job in context.get_jobs("modifiers"):
-                exe_job(context, job)
-
-            img = cv2.cvtColor(context.render_img, cv2.COLOR_BGR2RGB)
-            video.write(img)
-
-    for job in context.get_jobs("deinit"):
-        exe_job(context, job)
+    return video_writer(path, context.resolution, int(context.fps)/context.frame_step, context)
+
+
+def split_range(start: int, end: int, size: int) -> List[Tuple[int, int]]:
+    """
+    Split frames ``start`` to ``end`` into ``(start, end)`` spans of ``size`` frames.
+    """
+    return [(s, min(s+size, end)) for s in range(start, end, size)]
+
+
+def simulate_range(context: Video, start: int, end: int) -> None:
+    """
+    Run the ``simulate`` jobs of frames ``start`` to ``end`` in order, every
+    ``frame_step`` frames. The ``init`` jobs must have been run.
+    """
+    if end > start:
+        for frame in trange(start, end, context.frame_step, desc="Simulating"):
+            simulate_frame(context, frame)
+
+
+def render_segment(context: Video, span: Tuple[int, int], seg_path: str, two_phase: bool,
+        pipeline: int, lossless: bool = True) -> None:
+    """
+    Render frames ``span[0]`` to ``span[1]`` into a segment.
+    The file is written under a temporary name and renamed when done, so a segment
+    that exists is always complete.
+
+    :param lossless: Encode with FFV1. Otherwise, use the output writer of the video.
+    """
+    root, ext = os.path.splitext(seg_path)
+    tmp_path = root + ".tmp" + ext
+    if lossless:
+        writer = VideoWriter(tmp_path, context.resolution, int(context.fps), context, fourcc="FFV1")
+    else:
+        writer = open_writer(context, tmp_path)
+    with writer as video:
+        with PipelinedWriter(video, pipeline, context.buffers, context.profiler) as pipe:
+            for frame in range(*span):
+                pipe.write(render_frame(context, frame, not two_phase))
+    os.replace(tmp_path, seg_path)
+
+
+def copy_segment(seg_path: str, video, pbar: tqdm = None) -> None:
+    """
+    Read all frames of a segment and write them to ``video``.
+    """
+    capture = cv2.VideoCapture(seg_path)
+    img = None
+    while True:
+        ret, img = capture.read(img)
+        if not ret:
+            break
+        video.write(img)
+        if pbar is not None:
+            pbar.update(1)
+    capture.release()
+
+
+def render_parallel(context: Video, spans: List[Tuple[int, int]], seg_paths: List[str], workers: int,
+        warmup: int, two_phase: bool, pipeline: int) -> Iterator[Tuple[Tuple[int, int], str]]:
+    """
+    Render spans of frames into segments with a pool of worker processes.
+    The ``deinit`` jobs must have been run, so no files (e.g. the keyboard video)
+    are open while forking.
+
+    Each worker is forked from this process, runs the ``init`` jobs itself, renders a
+    span into a lossless segment, and runs the ``deinit`` jobs. Yields
+    ``(span, seg_path)`` in order as soon as each segment is done, while the other
+    workers keep rendering.
+
+    If ``two_phase``, the simulation must already be done, and the workers only
+    render, reading simulation results from the caches.
+
+    Otherwise, before each span the worker simulates ``warmup`` frames before it,
+    so the particle and smoke simulations have the same amount of history as in a
+    serial render. Every worker process uses its own cache directory, which is
+    removed when the pool exits.
+    """
+    global _worker_context, _worker_cache
+
+    _worker_context = context
+    _worker_cache = tempfile.mkdtemp(prefix="workers_", dir=context.cache)
+    ctx = multiprocessing.get_context("fork")
+    try:
+        with ctx.Pool(workers) as pool:
+            args = [(*span, seg_path, warmup, two_phase, pipeline) for span, seg_path in zip(spans, seg_paths)]
+            for span, seg_path in zip(spans, pool.imap(_render_span, args)):
+                yield span, seg_path
+    finally:
+        shutil.rmtree(_worker_cache, ignore_errors=True)
+        _worker_context = None
+        _worker_cache = None
+
+
+def _render_span(args: Tuple[int, int, str, int, bool, int]) -> str:
+    """
+    Worker process target. Renders frames ``start`` to ``end`` into a segment file.
+
+    :param args: (start, end, seg_path, warmup_frames, two_phase, pipeline)
+    :return: Segment path.
+    """
+    start, end, seg_path, warmup, two_phase, pipeline = args
+    context = _worker_context
+
+    if not two_phase:
+        # Separate cache so simulations don't read and write the same frames as other
+        # workers. New caches each span, so frames of the last span aren't read.
+        context._set_cache(os.path.join(_worker_cache, f"worker_{os.getpid()}"))
+
+    exe_slot(context, "init")
+    if not two_phase:
+        for frame in range(max(start-warmup, 0), start):
+            simulate_frame(context, frame)
+    render_segment(context, (start, end), seg_path, two_phase, pipeline)
+    exe_slot(context, "deinit")
+
+    return seg_path
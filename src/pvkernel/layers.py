@@ -0,0 +1,147 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Render layers, so a job's drawing can be kept and reused on later frames.
+
+A job with a ``layer`` (see ``pv.Job``) draws into its own layer instead of the
+render image, and the layer is composited on the render image when the job
+runs. If the job's ``layer_key`` is the same as when the layer was drawn, the
+operators are skipped and the layer is composited again.
+
+Layers are premultiplied RGBA. Blend modes:
+
+* ``"OVER"``: ``render*(1-alpha) + layer``, the same as ``img_mixadd`` of the
+  unpremultiplied color with a factor of alpha. Exact for alpha 0 and 1.
+* ``"MAX"``: Maximum of each channel, where alpha is not 0, like ``img_addc``.
+"""
+
+import numpy as np
+from typing import Any, Dict, Tuple
+from .lib import *
+
+LIB.img_composite.argtypes = (IMG, I32, IMG, I32, I32, I32, I32, I32)
+
+BLEND_MODES = ("OVER", "MAX")
+
+
+class Layer:
+    """
+    A premultiplied RGBA image (``img``, uint8). Operators of the layer's job
+    draw on it through ``video.layer``, and mark what they drew with ``touch``,
+    or draw opaque images with ``paint``. Only the touched box is composited.
+
+    * ``key``: ``layer_key`` of the job when the layer was drawn.
+    * ``box``: ``(y0, y1, x0, x1)`` of the pixels drawn, empty if none.
+    """
+    name: str
+    blend: str
+    img: np.ndarray
+    key: Any
+    box: Tuple[int, int, int, int]
+
+    def __init__(self, name: str, blend: str, shape: Tuple[int, int]) -> None:
+        assert blend in BLEND_MODES, f"Unknown blend mode: {blend}"
+        self.name = name
+        self.blend = blend
+        self.img = np.zeros((*shape, 4), dtype=np.uint8)
+        self.key = None
+        self.box = (0, 0, 0, 0)
+
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.img[..., :3]
+
+    @property
+    def alpha(self) -> np.ndarray:
+        return self.img[..., 3]
+
+    def touch(self, y0: int, y1: int, x0: int, x1: int) -> None:
+        """
+        Add a box to the pixels drawn. Clipped to the layer.
+        """
+        height, width = self.img.shape[:2]
+        y0, y1 = max(y0, 0), min(y1, height)
+        x0, x1 = max(x0, 0), min(x1, width)
+        if y0 >= y1 or x0 >= x1:
+            return
+        if self.box[0] < self.box[1]:
+            y0, y1 = min(y0, self.box[0]), max(y1, self.box[1])
+            x0, x1 = min(x0, self.box[2]), max(x1, self.box[3])
+        self.box = (y0, y1, x0, x1)
+
+    def paint(self, img: np.ndarray, y: int, x: int) -> None:
+        """
+        Draw an opaque RGB image with its top left corner at ``(x, y)`` (not
+        negative). Values are cast to uint8 like assigning to the render image.
+        """
+        height, width = self.img.shape[:2]
+        y1, x1 = min(y+img.shape[0], height), min(x+img.shape[1], width)
+        if y >= y1 or x >= x1:
+            return
+        np.copyto(self.rgb[y:y1, x:x1], img[:y1-y, :x1-x], casting="unsafe")
+        self.alpha[y:y1, x:x1] = 255
+        self.touch(y, y1, x, x1)
+
+    def clear(self) -> None:
+        """
+        Make the layer transparent.
+        """
+        y0, y1, x0, x1 = self.box
+        self.img[y0:y1, x0:x1] = 0
+        self.box = (0, 0, 0, 0)
+        self.key = None
+
+    def composite(self, img: np.ndarray) -> None:
+        """
+        Blend the layer on an RGB image.
+        """
+        if self.box[0] < self.box[1]:
+            LIB.img_composite(img, img.shape[1], self.img, *self.box, BLEND_MODES.index(self.blend))
+
+
+class LayerStack:
+    """
+    Layers of a video, by name. Accessed with ``video.layers``.
+    """
+    _layers: Dict[str, Layer]
+
+    def __init__(self) -> None:
+        self._layers = {}
+
+    def get(self, name: str, blend: str, shape: Tuple[int, int]) -> Layer:
+        """
+        Return the layer ``name``. It is created (transparent) if it doesn't exist,
+        or the blend mode or shape changed.
+
+        :param shape: ``(height, width)``
+        """
+        layer = self._layers.get(name)
+        if layer is None or layer.blend != blend or layer.img.shape[:2] != tuple(shape):
+            layer = Layer(name, blend, shape)
+            self._layers[name] = layer
+        return layer
+
+    def reset(self) -> None:
+        """
+        Forget the keys of all layers, so they are drawn again.
+        Called before each render, as properties may have changed.
+        """
+        for layer in self._layers.values():
+            layer.key = None
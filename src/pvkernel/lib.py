@@ -27,6 +27,7 @@ __all__ = (
     "AR_CH",
     "AR_UCH",
     "AR_DBL",
+    "AR_I32",
     "I32",
     "I64",
     "F32",
@@ -48,6 +49,7 @@ UCH = ctypes.c_uint8
 AR_CH = np.ctypeslib.ndpointer(dtype=np.int8, ndim=1, flags="aligned, c_contiguous")
 AR_UCH = np.ctypeslib.ndpointer(dtype=np.uint8, ndim=1, flags="aligned, c_contiguous")
 AR_DBL = np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags="aligned, c_contiguous")
+AR_I32 = np.ctypeslib.ndpointer(dtype=np.int32, ndim=1, flags="aligned, c_contiguous")
 I32 = ctypes.c_int32
 I64 = ctypes.c_int64
 F32 = ctypes.c_float
@@ -0,0 +1,358 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Real time rendering from live MIDI input.
+
+Frames are rendered on a fixed clock at ``video.fps``, from the messages of a
+source received so far, and passed to a sink:
+
+.. code-block:: py
+
+    stats = video.live(PortSource("Digital Piano"), WindowSink())
+    print(stats.summary())
+
+Sources: ``PortSource`` (a MIDI input port, or a virtual port other programs
+can send to) and ``ReplaySource`` (plays a MIDI file, as a stand in for a piano).
+Sinks: ``WindowSink`` (OpenCV window) and ``RawSink`` (raw RGB frames to a file
+or pipe).
+
+Blocks go up from the keyboard (``midi.reverse``), as the notes are not known in
+advance. Frames that can't be rendered in time are dropped, and if frames keep
+missing the latency budget, expensive properties (``DEGRADE``) are scaled down
+until they fit, and restored when there is time to spare.
+"""
+
+import time
+from collections import deque
+import mido
+import numpy as np
+import cv2
+from typing import IO, TYPE_CHECKING, Dict, List, Optional, Tuple
+from pv.utils import multigetattr
+from .export import exe_slot, render_frame
+
+Video = None
+if TYPE_CHECKING:
+    from .video import Video
+
+# Properties scaled down when frames are late, and the factor of each level.
+DEGRADE = {
+    "smoke.pps": 0.5,
+    "ptcls.pps": 0.5,
+    "glare.radius": 0.75,
+}
+
+
+class LiveInput:
+    """
+    Set at ``video.live_input`` in live mode.
+
+    * ``messages``: MIDI messages received since the last frame, as
+      ``(frame, mido.Message)``. Frames count from the start of the session.
+    """
+    messages: List[Tuple[float, mido.Message]]
+
+    def __init__(self) -> None:
+        self.messages = []
+
+
+class PortSource:
+    """
+    Messages from a MIDI input port.
+
+    :param name: Port name (see ``mido.get_input_names()``). Default the first port.
+    :param virtual: Create a virtual port named ``name`` instead, which other
+        programs can send to.
+    """
+    done = False
+
+    def __init__(self, name: Optional[str] = None, virtual: bool = False) -> None:
+        self.port = mido.open_input(name, virtual=virtual)
+        self._start = None
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+
+    def poll(self) -> List[Tuple[float, mido.Message]]:
+        """
+        Messages received since the last poll, as ``(seconds, message)``.
+        """
+        now = time.perf_counter() - self._start
+        return [(now, msg) for msg in self.port.iter_pending()]
+
+    def close(self) -> None:
+        self.port.close()
+
+
+class ReplaySource:
+    """
+    Messages of a MIDI file, released at the time they are played, as a stand in
+    for a MIDI port. ``done`` is set after the last message.
+
+    :param path: MIDI file path.
+    :param speed: Playback speed multiplier.
+    """
+    messages: List[Tuple[float, mido.Message]]
+
+    def __init__(self, path: str, speed: float = 1) -> None:
+        self.messages = []
+        seconds = 0
+        with mido.MidiFile(path) as midi:
+            for msg in midi:
+                seconds += msg.time
+                if not msg.is_meta:
+                    self.messages.append((seconds/speed, msg))
+        self._next = 0
+        self._start = None
+
+    @property
+    def done(self) -> bool:
+        return self._next >= len(self.messages)
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+
+    def poll(self) -> List[Tuple[float, mido.Message]]:
+        """
+        Messages played since the last poll, as ``(seconds, message)``.
+        """
+        now = time.perf_counter() - self._start
+        start = self._next
+        while self._next < len(self.messages) and self.messages[self._next][0] <= now:
+            self._next += 1
+        return self.messages[start:self._next]
+
+    def close(self) -> None:
+        pass
+
+
+class WindowSink:
+    """
+    Shows frames in an OpenCV window. Press Escape or Q to stop.
+    """
+
+    def __init__(self, name: str = "Piano Video") -> None:
+        self.name = name
+
+    def write(self, img: np.ndarray) -> bool:
+        """
+        Show a frame (RGB). Returns False to stop.
+        """
+        cv2.imshow(self.name, cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
+        return cv2.waitKey(1) not in (27, ord("q"))
+
+    def close(self) -> None:
+        cv2.destroyWindow(self.name)
+
+
+class RawSink:
+    """
+    Writes raw RGB24 frames to a binary file object, e.g. the stdin of
+    ``ffplay -f rawvideo -pixel_format rgb24 -video_size WxH -``.
+    """
+
+    def __init__(self, fp: IO) -> None:
+        self.fp = fp
+
+    def write(self, img: np.ndarray) -> bool:
+        """
+        Write a frame (RGB). Returns False to stop.
+        """
+        self.fp.write(img.data)
+        return True
+
+    def close(self) -> None:
+        self.fp.flush()
+
+
+class LiveStats:
+    """
+    Statistics of a live session.
+
+    * ``frames``: Frames rendered.
+    * ``dropped``: Frames skipped because the previous frames were late.
+    * ``late``: Frames over the latency budget.
+    * ``latencies``: Seconds from the time each frame was due to when it was shown.
+    * ``levels``: ``(frame, level)`` of every degradation level change.
+    """
+    budget: float
+    frames: int
+    dropped: int
+    late: int
+    latencies: List[float]
+    levels: List[Tuple[int, int]]
+
+    def __init__(self, budget: float) -> None:
+        self.budget = budget
+        self.frames = 0
+        self.dropped = 0
+        self.late = 0
+        self.latencies = []
+        self.levels = []
+
+    def summary(self) -> str:
+        """
+        Summary as text.
+        """
+        latencies = np.array(self.latencies) * 1000
+        lines = [
+            f"Frames: {self.frames} rendered, {self.dropped} dropped, {self.late} late "
+            f"(budget {self.budget*1000:.1f} ms)",
+        ]
+        if len(latencies) > 0:
+            lines.append(f"Latency: mean {latencies.mean():.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms, "
+                f"max {latencies.max():.1f} ms")
+        lines.append(f"Degradation level changes: {self.levels}")
+        return "\n".join(lines)
+
+
+class Degrader:
+    """
+    Scales down properties when frames miss the latency budget, and restores them
+    when there is time to spare. At level ``n``, each property is its original
+    value times ``factor**n``.
+
+    The level goes up when 3 of the last 10 frames were late, and down after one
+    second of frames taking less than half the budget.
+
+    :param factors: Property (e.g. ``"smoke.pps"``) to factor per level. Properties
+        of missing add-ons are skipped.
+    :param max_level: Highest level.
+    """
+    level: int
+
+    def __init__(self, video: Video, factors: Dict[str, float], max_level: int) -> None:
+        self.level = 0
+        self._video = video
+        self._max_level = max_level
+        self._props = []
+        for name, factor in factors.items():
+            group, prop = name.split(".")
+            if group in video.props._items:
+                self._props.append((getattr(video.props, group), prop, factor, multigetattr(video.props, name)))
+
+        self._late = deque(maxlen=10)
+        self._fast = 0
+
+    def update(self, latency: float, budget: float) -> bool:
+        """
+        Record the latency of a frame, and change the level if needed.
+        Returns whether the level changed.
+        """
+        self._late.append(latency > budget)
+        self._fast = self._fast+1 if latency < budget/2 else 0
+
+        if sum(self._late) >= 3 and self.level < self._max_level:
+            self._set_level(self.level+1)
+            return True
+        if self._fast >= self._video.fps and self.level > 0:
+            self._set_level(self.level-1)
+            return True
+        return False
+
+    def restore(self) -> None:
+        self._set_level(0)
+
+    def _set_level(self, level: int) -> None:
+        self.level = level
+        self._late.clear()
+        self._fast = 0
+        for group, prop, factor, value in self._props:
+            setattr(group, prop, value * factor**level)
+
+
+def live(context: Video, source, sink=None, duration: Optional[float] = None, budget: Optional[float] = None,
+        degrade: Dict[str, float] = DEGRADE, max_level: int = 4) -> LiveStats:
+    """
+    Render frames in real time from live MIDI input, until the sink stops,
+    ``duration`` is reached, or the source is done (plus ``core.pause_end``).
+    Ctrl+C also stops.
+
+    :param source: ``PortSource`` or ``ReplaySource``.
+    :param sink: ``WindowSink`` (default) or ``RawSink``.
+    :param duration: Seconds to run for.
+    :param budget: Latency budget of a frame in seconds. Default one frame.
+    :param degrade: Properties to scale down when frames are late (see ``Degrader``).
+    :param max_level: Highest degradation level.
+    :return: Statistics of the session.
+    """
+    sink = WindowSink() if sink is None else sink
+    budget = 1 / context.fps if budget is None else budget
+    stats = LiveStats(budget)
+
+    pause_start, reverse = context.props.core.pause_start, context.props.midi.reverse
+    context.live_input = LiveInput()
+    context.props.core.pause_start = 0
+    context.props.midi.reverse = True
+    degrader = Degrader(context, degrade, max_level)
+    try:
+        exe_slot(context, "init")
+        source.start()
+        start = time.perf_counter()
+
+        frame = 0
+        last = None
+        end = None if duration is None else duration*context.fps
+        while end is None or frame < end:
+            due = start + frame/context.fps
+            time.sleep(max(due-time.perf_counter(), 0))
+
+            context.live_input.messages = [(t*context.fps, msg) for t, msg in source.poll()]
+            # Simulations step over the dropped frames.
+            context.frame_step = 1 if last is None else frame-last
+            img = render_frame(context, frame)
+            running = sink.write(img)
+            context.buffers.release(img)
+
+            latency = time.perf_counter() - due
+            stats.frames += 1
+            stats.late += latency > budget
+            stats.latencies.append(latency)
+            if degrader.update(latency, budget):
+                stats.levels.append((frame, degrader.level))
+
+            # Simulations only read the previous frame.
+            if last is not None:
+                for cache in context.caches._items.values():
+                    cache.discard(last)
+
+            if not running:
+                break
+            if end is None and source.done:
+                end = frame + context.props.core.pause_end*context.fps
+
+            last = frame
+            frame = max(frame+1, int((time.perf_counter()-start) * context.fps))
+            stats.dropped += frame - last - 1
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        exe_slot(context, "deinit")
+        degrader.restore()
+        sink.close()
+        source.close()
+        context.live_input = None
+        context.props.core.pause_start = pause_start
+        context.props.midi.reverse = reverse
+        context.frame_step = 1
+
+    return stats
@@ -0,0 +1,89 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Static overlays (``pv.Overlay``), combined once per video.
+"""
+
+import numpy as np
+import pv
+from typing import TYPE_CHECKING, List, Tuple
+from .lib import *
+
+Video = None
+if TYPE_CHECKING:
+    from .video import Video
+
+AR_I64 = np.ctypeslib.ndpointer(dtype=np.int64, ndim=1, flags="aligned, c_contiguous")
+LIB.img_overlay.argtypes = (IMG, I32, I32, I32, I32, I32, AR_DBL, I32, AR_I64, AR_UCH)
+
+
+class StaticOverlay:
+    """
+    All registered overlays, built into one gain map and floor. Built in the
+    ``overlay_init`` job and stored at ``video.data.core.overlay``.
+
+    Only the box of pixels with a gain other than 1 is multiplied, and only the
+    pixels with a floor are raised, so overlays that touch a few rows or columns
+    cost little per frame.
+
+    * ``box``: ``(y0, y1, x0, x1)`` of the gain, empty if the gain is 1 everywhere.
+    * ``gain``: Gain of the box, flattened.
+    * ``indices``, ``values``: Flat indices into the image of the pixels (and
+      channels) with a floor, and their floor.
+    * ``floor_boxes``: Boxes ``(y0, y1, x0, x1)`` around the pixels with a floor,
+      one per run of neighboring columns.
+    """
+    box: Tuple[int, int, int, int]
+    floor_boxes: List[Tuple[int, int, int, int]]
+    gain: np.ndarray
+    indices: np.ndarray
+    values: np.ndarray
+
+    def __init__(self, video: Video) -> None:
+        width, height = video.resolution
+        gain = np.ones((height, width), dtype=np.float64)
+        floor = np.zeros((height, width, 3), dtype=np.uint8)
+        for cls in pv.utils._get_overlays():
+            cls().build(video, gain, floor)
+
+        self.box = (0, 0, 0, 0)
+        self.gain = np.ones(0)
+        rows = np.flatnonzero((gain != 1).any(axis=1))
+        if len(rows) > 0:
+            cols = np.flatnonzero((gain != 1).any(axis=0))
+            self.box = (rows[0], rows[-1]+1, cols[0], cols[-1]+1)
+            self.gain = np.ascontiguousarray(gain[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1]).ravel()
+
+        self.indices = np.flatnonzero(floor).astype(np.int64)
+        self.values = floor.ravel()[self.indices]
+
+        self.floor_boxes = []
+        cols = np.flatnonzero(floor.any(axis=(0, 2)))
+        for run in np.split(cols, np.flatnonzero(np.diff(cols) > 1) + 1):
+            if len(run) > 0:
+                rows = np.flatnonzero(floor[:, run[0]:run[-1]+1].any(axis=(1, 2)))
+                self.floor_boxes.append((rows[0], rows[-1]+1, run[0], run[-1]+1))
+
+    def apply(self, video: Video) -> None:
+        """
+        Apply on the render image.
+        """
+        img = video.render_img
+        LIB.img_overlay(img, img.shape[1], *self.box, self.gain, len(self.indices), self.indices, self.values)
@@ -0,0 +1,410 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Timing and memory usage of jobs, operators and frames.
+
+Enable timing with ``video.export(path, profile="trace.json")``. While a profiler
+is set at ``video.profiler``, ``exe_job`` and ``pv.utils.call_op`` record the wall
+and CPU time of every job and operator. After the export, a summary table is
+printed, and all events are saved as a Chrome trace, which can be opened in
+``chrome://tracing`` or https://ui.perfetto.dev
+
+Enable memory profiling with ``video.export(path, memory="memory.json")``. See
+``MemoryProfiler``.
+"""
+
+import os
+import sys
+import time
+import threading
+import json
+import tracemalloc
+import numpy as np
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Profiler:
+    """
+    Records timed spans. Thread safe.
+
+    Each event is ``(category, name, start, wall, cpu, thread, frame)``, with times
+    in seconds. ``start`` is relative to the creation of the profiler.
+    """
+    events: List[Tuple[str, str, float, float, float, int, Optional[int]]]
+
+    def __init__(self) -> None:
+        self.events = []
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, category: str, name: str, frame: Optional[int] = None):
+        """
+        Time the code in a ``with`` block.
+
+        :param category: e.g. ``"job"``, ``"op"``, ``"frame"``, ``"writer"``.
+        :param name: e.g. job or operator idname.
+        :param frame: Frame number to show in the trace.
+        """
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            event = (category, name, wall-self._start, time.perf_counter()-wall, time.thread_time()-cpu,
+                threading.get_ident(), frame)
+            with self._lock:
+                self.events.append(event)
+
+    def stats(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """
+        Statistics of each ``(category, name)``: count, total, mean, p50, p95, max
+        wall time, and mean CPU time, in seconds.
+        """
+        groups = {}
+        for category, name, _, wall, cpu, _, _ in self.events:
+            groups.setdefault((category, name), []).append((wall, cpu))
+
+        stats = {}
+        for key, values in groups.items():
+            values = np.array(values)
+            wall = values[:, 0]
+            stats[key] = {
+                "count": len(wall),
+                "total": wall.sum(),
+                "mean": wall.mean(),
+                "p50": np.percentile(wall, 50),
+                "p95": np.percentile(wall, 95),
+                "max": wall.max(),
+                "cpu": values[:, 1].mean(),
+            }
+        return stats
+
+    def summary(self) -> str:
+        """
+        Table of statistics in milliseconds. Share is the percent of total frame
+        time (or of the total recorded time if no frames were recorded).
+        Nested spans are included in their parents, so shares don't add up to 100.
+        """
+        stats = self.stats()
+        frame_total = sum(s["total"] for (cat, _), s in stats.items() if cat == "frame")
+        total = frame_total if frame_total > 0 else max(s["total"] for s in stats.values())
+
+        header = ("Name", "Count", "Mean", "P50", "P95", "Max", "CPU", "Share")
+        rows = []
+        for (category, name), s in sorted(stats.items(), key=lambda x: -x[1]["total"]):
+            rows.append((f"{category} {name}", str(s["count"]), *[f"{s[k]*1000:.2f}" for k in
+                ("mean", "p50", "p95", "max", "cpu")], f"{s['total']/total*100:.1f}%"))
+
+        widths = [max(len(r[i]) for r in (header, *rows)) for i in range(len(header))]
+        lines = ["Profile (times in ms):"]
+        for row in (header, *rows):
+            cells = [row[0].ljust(widths[0])] + [c.rjust(w) for c, w in zip(row[1:], widths[1:])]
+            lines.append("  ".join(cells))
+        return "\n".join(lines)
+
+    def write_trace(self, path: str) -> None:
+        """
+        Save events in the Chrome trace event format (complete events).
+        """
+        events = []
+        pid = os.getpid()
+        for category, name, start, wall, cpu, thread, frame in self.events:
+            args: Dict[str, Any] = {"cpu_ms": cpu*1000}
+            if frame is not None:
+                args["frame"] = frame
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start*1e6,
+                "dur": wall*1e6,
+                "pid": pid,
+                "tid": thread,
+                "args": args,
+            })
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+
+def rss() -> int:
+    """
+    Resident set size of this process in bytes. On systems without ``/proc``, the
+    peak RSS is returned instead. 0 if unknown.
+    """
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak*1024
+    except ImportError:
+        return 0
+
+
+def deep_size(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    Approximate memory size of an object and everything it references, in bytes.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) if obj.base is None else obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(x, seen) for x in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    return size
+
+
+def dir_size(path: str) -> int:
+    """
+    Total size of the files in a folder, in bytes.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class MemoryProfiler:
+    """
+    Tracks memory usage during an export. Thread safe.
+
+    * Every ``every`` frames, RSS, memory traced by ``tracemalloc``, the size of
+      each data group (e.g. ``video.data.midi``) and of each cache folder are
+      recorded in ``samples``, with the lines that allocated the most since the
+      previous sample.
+    * On the same frames, the RSS and traced memory growth of every job and
+      operator is added up in ``growth``, to find which one leaks.
+    * After every frame, if RSS is over ``limit`` bytes, ``MemoryError`` is raised.
+
+    Frames are the frame indices of the export (see ``export.set_frame``), the same
+    for frame, job and operator spans, so the growth is recorded on the sampled
+    frames. With ``every=None``, only the limit is checked, and ``tracemalloc`` is
+    not started.
+    """
+    samples: List[Dict[str, Any]]
+    growth: Dict[Tuple[str, str], List[int]]
+
+    def __init__(self, video, every: Optional[int] = 30, limit: Optional[float] = None) -> None:
+        """
+        :param every: Sample every this many frames, or None to not sample.
+        :param limit: Memory ceiling in bytes, or None.
+        """
+        self.video = video
+        self.every = None if every is None else max(every, 1)
+        self.limit = limit
+        self.samples = []
+        self.growth = {}
+
+        self._start = time.perf_counter()
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if self.every is None:
+            return self
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._snapshot = self._take_snapshot()
+        self.sample(None, "start")
+        return self
+
+    def __exit__(self, *args):
+        if self.every is None:
+            return
+        self.sample(None, "end")
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        # Exclude the profilers' own records.
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+
+    def _sampled(self, frame: Optional[int]) -> bool:
+        return self.every is not None and frame is not None and frame % self.every == 0
+
+    @contextmanager
+    def span(self, category: str, name: str, frame: Optional[int] = None):
+        """
+        Record memory growth of a job or operator on sampled frames, and take a
+        sample and check the limit after each frame.
+        """
+        if category in ("job", "op") and self._sampled(frame):
+            before = (rss(), tracemalloc.get_traced_memory()[0])
+            try:
+                yield
+            finally:
+                after = (rss(), tracemalloc.get_traced_memory()[0])
+                with self._lock:
+                    growth = self.growth.setdefault((category, name), [0, 0, 0])
+                    growth[0] += 1
+                    growth[1] += after[0] - before[0]
+                    growth[2] += after[1] - before[1]
+        elif category == "frame":
+            try:
+                yield
+            finally:
+                if self._sampled(frame):
+                    self.sample(frame, name)
+                self.check_limit(frame)
+        else:
+            yield
+
+    def sample(self, frame: Optional[int], stage: str) -> None:
+        """
+        Record a sample.
+
+        :param stage: e.g. ``"render"`` or ``"simulate"``.
+        """
+        snapshot = self._take_snapshot()
+        top = snapshot.compare_to(self._snapshot, "lineno")[:5]
+        self._snapshot = snapshot
+
+        video = self.video
+        self.samples.append({
+            "frame": frame,
+            "stage": stage,
+            "time": time.perf_counter() - self._start,
+            "rss": rss(),
+            "traced": tracemalloc.get_traced_memory()[0],
+            "data": {name: deep_size(group) for name, group in video.data._items.items()},
+            "caches": {name: dir_size(cache.path) for name, cache in video.caches._items.items()},
+            "top": [str(stat) for stat in top if stat.size_diff > 0],
+        })
+
+    def check_limit(self, frame: Optional[int]) -> None:
+        """
+        Raise ``MemoryError`` if RSS is over the limit.
+        """
+        if self.limit is None:
+            return
+        usage = rss()
+        if usage > self.limit:
+            raise MemoryError(f"Memory limit exceeded at frame {frame}: RSS {usage/1e6:.1f} MB, "
+                f"limit {self.limit/1e6:.1f} MB.\n" + self.summary())
+
+    def summary(self) -> str:
+        """
+        Jobs and operators with the most growth, and total growth over the samples.
+        """
+        lines = ["Memory profile:"]
+        if len(self.samples) >= 2:
+            first, last = self.samples[0], self.samples[-1]
+            lines.append(f"* RSS: {first['rss']/1e6:.1f} MB -> {last['rss']/1e6:.1f} MB")
+            lines.append(f"* Traced: {first['traced']/1e6:.1f} MB -> {last['traced']/1e6:.1f} MB")
+            for key in ("data", "caches"):
+                for name, size in last[key].items():
+                    lines.append(f"* {key} {name}: {first[key].get(name, 0)/1e6:.1f} MB -> {size/1e6:.1f} MB")
+        growth = sorted(self.growth.items(), key=lambda x: -x[1][2])
+        for (category, name), (count, rss_growth, traced_growth) in growth[:10]:
+            lines.append(f"* {category} {name}: {traced_growth/count/1e3:+.1f} KB traced, "
+                f"{rss_growth/count/1e3:+.1f} KB RSS per sampled frame")
+        return "\n".join(lines)
+
+    def write(self, path: str) -> None:
+        """
+        Save samples and growth as JSON.
+        """
+        growth = [{"category": category, "name": name, "count": count, "rss": rss_growth, "traced": traced_growth}
+            for (category, name), (count, rss_growth, traced_growth) in self.growth.items()]
+        with open(path, "w") as fp:
+            json.dump({"every": self.every, "limit": self.limit, "samples": self.samples, "growth": growth},
+                fp, indent=4)
+
+
+class ProfilerGroup:
+    """
+    Runs ``span`` of several profilers, so timing and memory profiling can be used
+    at the same time.
+    """
+
+    def __init__(self, *profilers) -> None:
+        self.profilers = profilers
+
+    @contextmanager
+    def span(self, category: str, name: str, frame: Optional[int] = None):
+        with ExitStack() as stack:
+            for profiler in self.profilers:
+                stack.enter_context(profiler.span(category, name, frame))
+            yield
+
+
+@contextmanager
+def profile_video(video, trace_path: Optional[str], memory_path: Optional[str] = None,
+        memory_every: int = 30, memory_limit: Optional[float] = None):
+    """
+    Set ``video.profiler`` in a ``with`` block. On exit, print the summaries and
+    save the trace to ``trace_path`` and the memory samples to ``memory_path``.
+    Does nothing if both are None.
+
+    :param memory_limit: Memory ceiling in MB (see ``MemoryProfiler``). Only RSS is
+        checked if ``memory_path`` is None.
+    """
+    profilers = []
+    if trace_path is not None:
+        profilers.append(Profiler())
+    if memory_path is not None or memory_limit is not None:
+        profilers.append(MemoryProfiler(video, None if memory_path is None else memory_every,
+            None if memory_limit is None else memory_limit*1e6))
+    if len(profilers) == 0:
+        yield None
+        return
+
+    video.profiler = profilers[0] if len(profilers) == 1 else ProfilerGroup(*profilers)
+    try:
+        with ExitStack() as stack:
+            for profiler in profilers:
+                if isinstance(profiler, MemoryProfiler):
+                    stack.enter_context(profiler)
+            yield video.profiler
+    finally:
+        video.profiler = None
+        for profiler in profilers:
+            if isinstance(profiler, Profiler) and len(profiler.events) > 0:
+                print(profiler.summary())
+                profiler.write_trace(trace_path)
+                print(f"Saved trace to {trace_path}")
+            elif isinstance(profiler, MemoryProfiler) and memory_path is not None:
+                print(profiler.summary())
+                profiler.write(memory_path)
+                print(f"Saved memory profile to {memory_path}")
@@ -81,69 +81,272 @@ extern "C" void draw_circle(UCH* img, const int width, const int height, CD cx,
 }
 
 
-extern "C" void draw_rect(UCH* img, const int width, const int height, CD dx, CD dy, CD dw, CD dh,
-        CD border, CD border_rad, CD tl_rad, CD tr_rad, CD bl_rad, CD br_rad, CD r, CD g, CD b, CD a) {
-    CD radii[4] = {
-        (tl_rad < 0) ? border_rad : tl_rad,
-        (tr_rad < 0) ? border_rad : tr_rad,
-        (br_rad < 0) ? border_rad : br_rad,
-        (bl_rad < 0) ? border_rad : bl_rad,
-    };
-    double thresholds[4];
+/**
+ * Corner radii of a rectangle (top left, top right, bottom right, bottom left),
+ * and the inner radii of the border.
+ * Negative corner radii are replaced with border_rad.
+ */
+void rect_radii(double radii[4], double thresholds[4], CD border, CD border_rad, CD tl_rad, CD tr_rad,
+        CD br_rad, CD bl_rad) {
+    radii[0] = (tl_rad < 0) ? border_rad : tl_rad;
+    radii[1] = (tr_rad < 0) ? border_rad : tr_rad;
+    radii[2] = (br_rad < 0) ? border_rad : br_rad;
+    radii[3] = (bl_rad < 0) ? border_rad : bl_rad;
     for (int i = 0; i < 4; i++)
         thresholds[i] = ((border == 0) ? 0 : (radii[i]-border));
+}
 
-    CD afac = a / 255;
-    const UCH c1[3] = {(UCH)r, (UCH)g, (UCH)b};
 
-    const int xmin = max((int)(dx-1), 0);
-    const int xmax = min((int)(dx+dw+1), (int)width);
-    const int ymin = max((int)(dy-1), 0);
-    const int ymax = min((int)(dy+dh+1), (int)height);
-    for (int x = xmin; x <= xmax; x++) {
-        for (int y = ymin; y <= ymax; y++) {
-            bool is_corner = false;
-            UCH corner_no;
-            double corner_pos[2];
-            if (x < dx+radii[0] && y < dy+radii[0]) {
-                is_corner = true;
-                corner_no = 0;
-                corner_pos[0] = dx+radii[0];
-                corner_pos[1] = dy+radii[0];
-            } else if (x > dx+dw-radii[1] && y < dy+radii[1]) {
-                is_corner = true;
-                corner_no = 1;
-                corner_pos[0] = dx+dw-radii[1];
-                corner_pos[1] = dy+radii[1];
-            } else if (x > dx+dw-radii[2] && y > dy+dh-radii[2]) {
-                is_corner = true;
-                corner_no = 2;
-                corner_pos[0] = dx+dw-radii[2];
-                corner_pos[1] = dy+dh-radii[2];
-            } else if (x < dx+radii[3] && y > dy+dh-radii[3]) {
-                is_corner = true;
-                corner_no = 3;
-                corner_pos[0] = dx+radii[3];
-                corner_pos[1] = dy+dh-radii[3];
+/**
+ * Coverage (0 to 1) of a pixel by a rounded rectangle, or its border if border > 0.
+ */
+double rect_fac(const int x, const int y, CD dx, CD dy, CD dw, CD dh, CD border, const double radii[4],
+        const double thresholds[4]) {
+    bool is_corner = false;
+    UCH corner_no;
+    double corner_pos[2];
+    if (x < dx+radii[0] && y < dy+radii[0]) {
+        is_corner = true;
+        corner_no = 0;
+        corner_pos[0] = dx+radii[0];
+        corner_pos[1] = dy+radii[0];
+    } else if (x > dx+dw-radii[1] && y < dy+radii[1]) {
+        is_corner = true;
+        corner_no = 1;
+        corner_pos[0] = dx+dw-radii[1];
+        corner_pos[1] = dy+radii[1];
+    } else if (x > dx+dw-radii[2] && y > dy+dh-radii[2]) {
+        is_corner = true;
+        corner_no = 2;
+        corner_pos[0] = dx+dw-radii[2];
+        corner_pos[1] = dy+dh-radii[2];
+    } else if (x < dx+radii[3] && y > dy+dh-radii[3]) {
+        is_corner = true;
+        corner_no = 3;
+        corner_pos[0] = dx+radii[3];
+        corner_pos[1] = dy+dh-radii[3];
+    }
+
+    if (is_corner) {
+        CD dist = pythag(x-corner_pos[0], y-corner_pos[1]);
+        CD out_fac = dbounds(radii[corner_no]-dist+1);
+        CD in_fac = dbounds(dist-thresholds[corner_no]+1);
+        return out_fac*in_fac;
+    } else {
+        CD out_fac = dbounds(x-dx+1) * dbounds(dx+dw-x+1) * dbounds(y-dy+1) * dbounds(dy+dh-y+1);
+        CD in_fac = (border == 0) ? 1 :
+            dbounds(dx+border-x+1) + dbounds(x-(dx+dw-border)+1) + dbounds(dy+border-y+1) + dbounds(y-(dy+dh-border)+1);
+        return out_fac*in_fac;
+    }
+}
+
+
+constexpr int DRAW_RECTS_MAX_LAYERS = 8;
+
+
+/**
+ * One layer of a rectangle being drawn, see rect_layer_init.
+ */
+struct RectLayer {
+    double dx, dy, dw, dh, border;
+    double radii[4], thresholds[4];
+    double afac;
+    UCH color[3];
+    int box[4];  // xmin, xmax, ymin, ymax of pixels drawn.
+};
+
+
+void rect_layer_init(RectLayer& layer, const int width, const int height, CD dx, CD dy, CD dw, CD dh,
+        CD border, const double radii[4], const double thresholds[4], CD r, CD g, CD b, CD a) {
+    layer.dx = dx;
+    layer.dy = dy;
+    layer.dw = dw;
+    layer.dh = dh;
+    layer.border = border;
+    for (int i = 0; i < 4; i++) {
+        layer.radii[i] = radii[i];
+        layer.thresholds[i] = thresholds[i];
+    }
+    layer.afac = a / 255;
+    layer.color[0] = (UCH)r;
+    layer.color[1] = (UCH)g;
+    layer.color[2] = (UCH)b;
+
+    layer.box[0] = max((int)(dx-1), 0);
+    layer.box[1] = min((int)(dx+dw+1), (int)width-1);
+    layer.box[2] = max((int)(dy-1), 0);
+    layer.box[3] = min((int)(dy+dh+1), (int)height-1);
+}
+
+
+/**
+ * Interior span of a row of a layer: pixels that are not in a corner, an edge, or
+ * the border, where rect_fac only depends on the row.
+ * Returns false if the row is not drawn. Otherwise, pixels lo to hi (may be empty)
+ * have a coverage times alpha of fac.
+ */
+bool rect_layer_row(const RectLayer& l, const int y, int& lo, int& hi, double& fac) {
+    if (y < l.box[2] || y > l.box[3])
+        return false;
+
+    double left = l.dx, right = l.dx+l.dw;
+    if (l.border != 0) {
+        left = max(left, l.dx+l.border+1);
+        right = min(right, l.dx+l.dw-l.border-1);
+    }
+    if (y < l.dy+l.radii[0])
+        left = max(left, l.dx+l.radii[0]);
+    if (y > l.dy+l.dh-l.radii[3])
+        left = max(left, l.dx+l.radii[3]);
+    if (y < l.dy+l.radii[1])
+        right = min(right, l.dx+l.dw-l.radii[1]);
+    if (y > l.dy+l.dh-l.radii[2])
+        right = min(right, l.dx+l.dw-l.radii[2]);
+
+    lo = max((int)ceil(max(left, (double)l.box[0])), l.box[0]);
+    hi = min((int)floor(min(right, (double)l.box[1])), l.box[1]);
+
+    // Same as rect_fac with the x terms at their bounds.
+    CD out_fac = dbounds(y-l.dy+1) * dbounds(l.dy+l.dh-y+1);
+    CD in_fac = (l.border == 0) ? 1 : dbounds(l.dy+l.border-y+1) + dbounds(y-(l.dy+l.dh-l.border)+1);
+    fac = out_fac*in_fac * l.afac;
+    return true;
+}
+
+
+/**
+ * Draw layers of a rectangle on top of each other, in one pass over its pixels.
+ * Same result as drawing each layer separately with draw_rect.
+ *
+ * Coverage is only calculated at the corners, edges and border. Interior spans
+ * use the coverage of their row, and where all layers are in their interior,
+ * the row is filled with one color. So the cost of the math scales with the
+ * perimeter, not the area.
+ */
+void draw_rect_layers(UCH* img, const int width, const RectLayer* layers, const int num_layers) {
+    int xmin = layers[0].box[0], xmax = layers[0].box[1], ymin = layers[0].box[2], ymax = layers[0].box[3];
+    for (int l = 1; l < num_layers; l++) {
+        xmin = min(xmin, layers[l].box[0]);
+        xmax = max(xmax, layers[l].box[1]);
+        ymin = min(ymin, layers[l].box[2]);
+        ymax = max(ymax, layers[l].box[3]);
+    }
+
+    bool active[DRAW_RECTS_MAX_LAYERS];
+    int los[DRAW_RECTS_MAX_LAYERS], his[DRAW_RECTS_MAX_LAYERS];
+    double facs[DRAW_RECTS_MAX_LAYERS];
+
+    for (int y = ymin; y <= ymax; y++) {
+        // Span where every layer drawn in this row is in its interior.
+        int span_lo = xmin, span_hi = xmax;
+        for (int l = 0; l < num_layers; l++) {
+            active[l] = rect_layer_row(layers[l], y, los[l], his[l], facs[l]);
+            if (active[l]) {
+                span_lo = max(span_lo, los[l]);
+                span_hi = min(span_hi, his[l]);
             }
+        }
 
-            double final_fac;
-            if (is_corner) {
-                CD dist = pythag(x-corner_pos[0], y-corner_pos[1]);
-                CD out_fac = dbounds(radii[corner_no]-dist+1);
-                CD in_fac = dbounds(dist-thresholds[corner_no]+1);
-                final_fac = out_fac*in_fac*afac;
-            } else {
-                CD out_fac = dbounds(x-dx+1) * dbounds(dx+dw-x+1) * dbounds(y-dy+1) * dbounds(dy+dh-y+1);
-                CD in_fac = (border == 0) ? 1 :
-                    dbounds(dx+border-x+1) + dbounds(x-(dx+dw-border)+1) + dbounds(dy+border-y+1) + dbounds(y-(dy+dh-border)+1);
-                final_fac = out_fac*in_fac*afac;
+        // In the span, the result only depends on the original color, unless a
+        // layer covers it fully.
+        int opaque = -1;
+        for (int l = 0; l < num_layers; l++) {
+            if (active[l] && facs[l] == 1)
+                opaque = l;
+        }
+        bool fill = (opaque >= 0 && span_lo <= span_hi);
+        UCH fill_color[3];
+        if (fill) {
+            for (int c = 0; c < 3; c++)
+                fill_color[c] = layers[opaque].color[c];
+            for (int l = opaque+1; l < num_layers; l++) {
+                if (active[l] && facs[l] > 0) {
+                    UCH mixed[3];
+                    img_mix(mixed, fill_color, layers[l].color, facs[l]);
+                    for (int c = 0; c < 3; c++)
+                        fill_color[c] = mixed[c];
+                }
             }
+        }
 
-            UCH c2[3], color[3];
-            img_getc(img, width, x, y, c2);
-            img_mix(color, c2, c1, final_fac);
-            img_setc(img, width, x, y, color[0], color[1], color[2]);
+        for (int x = xmin; x <= xmax; x++) {
+            if (fill && x == span_lo) {
+                for (; x <= span_hi; x++)
+                    img_setc(img, width, x, y, fill_color);
+                x = span_hi;
+                continue;
+            }
+
+            UCH color[3];
+            img_getc(img, width, x, y, color);
+            for (int l = 0; l < num_layers; l++) {
+                const RectLayer& layer = layers[l];
+                if (!active[l] || x < layer.box[0] || x > layer.box[1])
+                    continue;
+                CD fac = (los[l] <= x && x <= his[l]) ? facs[l] :
+                    rect_fac(x, y, layer.dx, layer.dy, layer.dw, layer.dh, layer.border, layer.radii,
+                        layer.thresholds) * layer.afac;
+                if (fac > 0) {
+                    UCH mixed[3];
+                    img_mix(mixed, color, layer.color, fac);
+                    for (int c = 0; c < 3; c++)
+                        color[c] = mixed[c];
+                }
+            }
+            img_setc(img, width, x, y, color);
+        }
+    }
+}
+
+
+extern "C" void draw_rect(UCH* img, const int width, const int height, CD dx, CD dy, CD dw, CD dh,
+        CD border, CD border_rad, CD tl_rad, CD tr_rad, CD bl_rad, CD br_rad, CD r, CD g, CD b, CD a) {
+    double radii[4], thresholds[4];
+    rect_radii(radii, thresholds, border, border_rad, tl_rad, tr_rad, br_rad, bl_rad);
+
+    RectLayer layer;
+    rect_layer_init(layer, width, height, dx, dy, dw, dh, border, radii, thresholds, r, g, b, a);
+    if (layer.box[0] <= layer.box[1] && layer.box[2] <= layer.box[3])
+        draw_rect_layers(img, width, &layer, 1);
+}
+
+
+/**
+ * Draw many rectangles, each with one or more layers drawn on top of each other
+ * (e.g. glow, fill and border), in one pass over the pixels of each rectangle.
+ * The result is the same as calling draw_rect for every layer in order.
+ *
+ * @param num Number of rectangles.
+ * @param layers Layers per rectangle, at most DRAW_RECTS_MAX_LAYERS.
+ * @param dims (num, layers, 4) X, Y, W, H.
+ * @param borders (num, layers) border thickness.
+ * @param radii (num, layers) corner radius.
+ * @param colors (num, layers, 4) RGBA.
+ * @param row_start First row to draw.
+ * @param row_end Row after the last row to draw.
+ */
+extern "C" void draw_rects(UCH* img, const int width, const int height, const int num, const int layers,
+        const double* dims, const double* borders, const double* radii, const double* colors,
+        const int row_start, const int row_end) {
+    RectLayer rect[DRAW_RECTS_MAX_LAYERS];
+    for (int i = 0; i < num; i++) {
+        // Layers outside the image are skipped.
+        int num_layers = 0;
+        for (int l = 0; l < layers; l++) {
+            const int j = layers*i + l;
+            CD* d = dims + 4*j;
+            CD* c = colors + 4*j;
+            double corner_radii[4], thresholds[4];
+            rect_radii(corner_radii, thresholds, borders[j], radii[j], -1, -1, -1, -1);
+            rect_layer_init(rect[num_layers], width, height, d[0], d[1], d[2], d[3], borders[j], corner_radii,
+                thresholds, c[0], c[1], c[2], c[3]);
+            int* box = rect[num_layers].box;
+            box[2] = max(box[2], row_start);
+            box[3] = min(box[3], row_end-1);
+            if (box[0] <= box[1] && box[2] <= box[3])
+                num_layers++;
         }
+        if (num_layers > 0)
+            draw_rect_layers(img, width, rect, num_layers);
     }
 }
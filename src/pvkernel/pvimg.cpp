@@ -33,6 +33,20 @@ MODS bool img_bounds(const int width, const int height, const int x, const int y
     return ((0<=x && x<width) && (0<=y && y<height));
 }
 
+MODS void img_box_add(int box[4], const int width, const int height, const int y0, const int y1,
+        const int x0, const int x1) {
+    const int cy0 = max(y0, 0), cy1 = min(y1, height);
+    const int cx0 = max(x0, 0), cx1 = min(x1, width);
+    if (cy0 >= cy1 || cx0 >= cx1)
+        return;
+    if (box[0] >= box[1]) {
+        box[0] = cy0, box[1] = cy1, box[2] = cx0, box[3] = cx1;
+    } else {
+        box[0] = min(box[0], cy0), box[1] = max(box[1], cy1);
+        box[2] = min(box[2], cx0), box[3] = max(box[3], cx1);
+    }
+}
+
 MODS void img_set(UCH* img, const int width, const int x, const int y, const UCH channel, const UCH value) {
     img[3*(y*width + x) + channel] = value;
 }
@@ -87,3 +101,91 @@ MODS void img_mixadd(UCH* img, const int width, const int x, const int y, CD fac
 MODS void img_mixadd(UCH* img, const int width, const int x, const int y, CD fac, const UCH input[3]) {
     img_mixadd(img, width, x, y, fac, input[0], input[1], input[2]);
 }
+
+
+/**
+ * Apply a static overlay: multiply a box of pixels by their gain, then raise
+ * pixels to their floor.
+ *
+ * @param y0, y1, x0, x1 Box of the gain.
+ * @param gain (y1-y0, x1-x0) gain of each pixel.
+ * @param num Number of channels with a floor.
+ * @param indices Flat indices into the image of the channels with a floor.
+ * @param values Floor of each channel.
+ */
+extern "C" void img_overlay(UCH* img, const int width, const int y0, const int y1, const int x0, const int x1,
+        const double* gain, const int num, const long long* indices, const UCH* values) {
+    const int box_width = x1 - x0;
+    for (int y = y0; y < y1; y++) {
+        for (int x = x0; x < x1; x++) {
+            CD fac = gain[(y-y0)*box_width + (x-x0)];
+            UCH* pixel = img + 3*(y*width + x);
+            for (int c = 0; c < 3; c++) {
+                const int value = pixel[c] * fac;
+                pixel[c] = min(max(value, 0), 255);
+            }
+        }
+    }
+
+    for (int i = 0; i < num; i++)
+        img[indices[i]] = max(img[indices[i]], values[i]);
+}
+
+
+/**
+ * Blend a premultiplied RGBA layer on an image.
+ *
+ * @param layer (height, width, 4) layer, same size as the image.
+ * @param y0, y1, x0, x1 Box to blend.
+ * @param blend 0 for over (the image times one minus alpha, plus the layer), 1 for
+ *     the maximum of each channel where alpha is not 0.
+ */
+extern "C" void img_composite(UCH* img, const int width, const UCH* layer, const int y0, const int y1,
+        const int x0, const int x1, const int blend) {
+    for (int y = y0; y < y1; y++) {
+        for (int x = x0; x < x1; x++) {
+            UCH* pixel = img + 3*(y*width + x);
+            const UCH* src = layer + 4*(y*width + x);
+            const UCH alpha = src[3];
+            if (alpha == 0)
+                continue;
+            for (int c = 0; c < 3; c++) {
+                if (blend == 0) {
+                    const int value = src[c] + pixel[c]*(255-alpha)/255.0;
+                    pixel[c] = min(value, 255);
+                } else {
+                    pixel[c] = max(pixel[c], src[c]);
+                }
+            }
+        }
+    }
+}
+
+
+/**
+ * Set the dirty tiles of an image to black.
+ *
+ * @param tiles (rows, cols) grid of tiles, not 0 if dirty.
+ * @param tile Tile size in pixels.
+ */
+extern "C" void img_clear_tiles(UCH* img, const int width, const int height, const UCH* tiles, const int tile) {
+    const int rows = (height+tile-1) / tile, cols = (width+tile-1) / tile;
+    for (int ty = 0; ty < rows; ty++) {
+        const UCH* row = tiles + ty*cols;
+        const int y0 = ty*tile, y1 = min(y0+tile, height);
+        int tx = 0;
+        while (tx < cols) {
+            if (!row[tx]) {
+                tx++;
+                continue;
+            }
+            // Clear a run of dirty tiles at once.
+            const int start = tx;
+            while (tx < cols && row[tx])
+                tx++;
+            const int x0 = start*tile, x1 = min(tx*tile, width);
+            for (int y = y0; y < y1; y++)
+                std::fill(img + 3*(y*width+x0), img + 3*(y*width+x1), 0);
+        }
+    }
+}
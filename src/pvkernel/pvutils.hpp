@@ -130,6 +130,13 @@ MODS void hsv2rgb(UCH dest[3], CD h, CD s, CD v);
  */
 MODS bool img_bounds(const int width, const int height, const int x, const int y);
 
+/**
+ * Add a box of pixels to a bounding box, clipped to the image.
+ * @param box {y0, y1, x0, x1}, empty if y0 >= y1.
+ */
+MODS void img_box_add(int box[4], const int width, const int height, const int y0, const int y1,
+    const int x0, const int x1);
+
 /**
  * Set pixel and channel to value.
  */
@@ -0,0 +1,161 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Resume manifest for interrupted exports.
+"""
+
+import os
+import shutil
+import json
+import cv2
+from pv.props import Property
+from typing import Any, Dict, Optional, TYPE_CHECKING, Tuple
+
+Video = None
+if TYPE_CHECKING:
+    from .video import Video
+
+
+def props_snapshot(video: Video) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the values of all properties of a video, as JSON compatible dicts.
+    """
+    snapshot = {}
+    for idname, group in video.props._items.items():
+        values = {}
+        for name in dir(type(group)):
+            if isinstance(getattr(type(group), name), Property):
+                values[name] = getattr(group, name)
+        snapshot[idname] = values
+    return json.loads(json.dumps(snapshot, default=str))
+
+
+def segment_frames(path: str) -> int:
+    """
+    Number of frames in a segment file.
+    """
+    capture = cv2.VideoCapture(path)
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    return count
+
+
+class ResumeManifest:
+    """
+    Keeps track of the finished parts of an export, so an interrupted export can
+    continue where it stopped.
+
+    The manifest is saved next to the output as ``<output>.pvresume.json``, and the
+    finished segments are in the folder ``<output>.pvparts``. The manifest records:
+
+    * ``settings``: Export settings and all property values. If they differ from the
+      current export, the manifest and segments are discarded.
+    * ``cache``: Cache folder of the video, so simulation results can be reused.
+    * ``checkpoint``: Last frame the simulation caches are complete up to.
+    * ``segments``: Finished segments, ``"start-end"``: segment path.
+    """
+    path: str
+    parts: str
+
+    def __init__(self, out_path: str, video: Video, settings: Dict[str, Any]) -> None:
+        """
+        Load the manifest if it exists and matches ``settings``, otherwise start a new one.
+        If loaded, the video's cache folder is set to the previous one, and existing
+        cache frames up to the checkpoint are loaded.
+        """
+        out_path = os.path.abspath(out_path)
+        self.path = out_path + ".pvresume.json"
+        self.parts = out_path + ".pvparts"
+        self._video = video
+
+        settings = dict(settings, props=props_snapshot(video))
+        settings = json.loads(json.dumps(settings))
+
+        self.data = None
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as fp:
+                data = json.load(fp)
+            if data["settings"] == settings and os.path.isdir(data["cache"]):
+                self.data = data
+            else:
+                print("Export settings changed, discarding resume data.")
+
+        if self.data is None:
+            if os.path.isdir(self.parts):
+                shutil.rmtree(self.parts)
+            self.data = {
+                "settings": settings,
+                "cache": video.cache,
+                "checkpoint": None,
+                "segments": {},
+            }
+            self.save()
+        else:
+            video._set_cache(self.data["cache"])
+            if self.checkpoint is not None:
+                for cache in video.caches._items.values():
+                    cache.load(int(self.checkpoint - video.props.core.pause_start*video.fps))
+
+        os.makedirs(self.parts, exist_ok=True)
+
+    @property
+    def checkpoint(self) -> Optional[int]:
+        return self.data["checkpoint"]
+
+    def set_checkpoint(self, frame: Optional[int]) -> None:
+        """
+        Record that the simulation caches are complete up to ``frame``.
+        """
+        self.data["checkpoint"] = frame
+        self.save()
+
+    def segment_path(self, span: Tuple[int, int]) -> str:
+        return os.path.join(self.parts, f"{span[0]}-{span[1]}.mkv")
+
+    def finished(self, span: Tuple[int, int]) -> bool:
+        """
+        Whether the segment of frames ``span[0]`` to ``span[1]`` is finished and intact.
+        """
+        path = self.data["segments"].get(f"{span[0]}-{span[1]}")
+        return path is not None and os.path.isfile(path) and segment_frames(path) == span[1]-span[0]
+
+    def add_segment(self, span: Tuple[int, int], path: str) -> None:
+        """
+        Record a finished segment.
+        """
+        self.data["segments"][f"{span[0]}-{span[1]}"] = path
+        self.save()
+
+    def save(self) -> None:
+        """
+        Write the manifest. The old file is replaced atomically.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(self.data, fp, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        """
+        Remove the manifest and segments after the export is done.
+        """
+        shutil.rmtree(self.parts, ignore_errors=True)
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,444 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""
+Sharded rendering over a shared folder.
+
+Any number of processes, possibly on different machines sharing a (e.g. NFS)
+folder, render one video together. Each process calls ``Video.export`` with the
+same settings and the same ``shard`` folder. The folder contains:
+
+* ``shard.json``: Export settings. Written by the first process, and checked by
+  the others.
+* ``claims/<start>-<end>``: Lock file of a chunk being rendered, containing the
+  owner's token (unique per claim). Created with a hard link, which fails if the
+  file exists (also on NFS), so only one process can claim a chunk. The owner
+  updates its mtime while rendering. A claim whose mtime didn't change for
+  ``STALE_TIME`` seconds, as seen by another process on its own clock (so clocks
+  of different hosts don't need to agree), is taken over, e.g. if the owner
+  crashed, and the stale claim is removed. Only the process whose token is in the
+  claim can finish the chunk or remove the claim, so an owner that was only slow
+  can't interfere.
+* ``segments/<start>-<end>.<token>.<ext>``: Rendered chunks, each encoded
+  independently with the output codec. Written under a temporary name and
+  renamed when complete. Names are unique per owner, so two owners of a chunk
+  never write the same file.
+* ``done/<start>-<end>.json``: Segment file, frame count and SHA-256 of a
+  finished chunk.
+* ``merge.lock``: Lock of the process merging the segments, kept alive and taken
+  over like a claim.
+* ``merged.json``: Written when the video is merged.
+
+Processes keep rendering until every chunk is done, waiting on chunks claimed
+by others, so stale claims are taken over. Then one process (``merge.lock``)
+merges the segments, after checking frame counts and checksums, by concatenating
+them without re-encoding (FFmpeg). The others wait until the video is merged, so
+they take over if the merging process dies.
+
+Example, to render with 3 local processes:
+
+.. code-block:: py
+
+    # Run this script 3 times at once.
+    video = pvkernel.Video()
+    ...
+    video.export("out.mp4", shard="/tmp/shard")
+"""
+
+import os
+import time
+import socket
+import hashlib
+import json
+import threading
+import uuid
+from subprocess import DEVNULL, PIPE, Popen
+from typing import Dict, List, Optional, TYPE_CHECKING, Tuple, Union
+from .export import copy_segment, exe_slot, open_writer, render_segment, simulate_range, split_range
+from .resume import props_snapshot, segment_frames
+from .utils import FFMPEG, HAS_FFMPEG
+
+Video = None
+if TYPE_CHECKING:
+    from .video import Video
+
+STALE_TIME = 300
+HEARTBEAT = 30
+# Seconds between checks while waiting on chunks claimed by other processes.
+POLL = 5
+# Key of the merge lock, used like the span of a chunk claim.
+MERGE = "merge"
+
+Lock = Union[Tuple[int, int], str]
+
+
+def file_hash(path: str) -> str:
+    """
+    SHA-256 hex digest of a file.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while True:
+            data = fp.read(1 << 20)
+            if len(data) == 0:
+                break
+            sha.update(data)
+    return sha.hexdigest()
+
+
+def create_exclusive(path: str, data: str) -> bool:
+    """
+    Create a file only if it doesn't exist.
+    The file is written fully before it appears, so readers never see partial data.
+
+    :return: Whether the file was created.
+    """
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fp:
+        fp.write(data)
+    try:
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_path)
+
+
+class Shard:
+    """
+    Work queue of a shard folder.
+    """
+    path: str
+    spans: List[Tuple[int, int]]
+
+    def __init__(self, path: str, settings: dict) -> None:
+        """
+        Create the shard folder, or join it if it was created with the same settings.
+        """
+        self.path = os.path.abspath(path)
+        for name in ("claims", "segments", "done"):
+            os.makedirs(os.path.join(self.path, name), exist_ok=True)
+
+        settings = json.loads(json.dumps(settings))
+        info_path = os.path.join(self.path, "shard.json")
+        create_exclusive(info_path, json.dumps(settings, indent=4))
+        with open(info_path, "r") as fp:
+            if json.load(fp) != settings:
+                raise ValueError(f"Shard folder {path} was created with different settings.")
+
+        self.settings = settings
+        self.spans = split_range(settings["start"], settings["end"], settings["chunk"])
+        self.ext = settings["ext"]
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # Locks are chunk claims, keyed by span, and the merge lock (``MERGE``).
+        self._tokens: Dict[Lock, str] = {}
+        # Locks of other processes: key to (mtime, local time it was first seen).
+        self._seen: Dict[Lock, Tuple[float, float]] = {}
+
+    @staticmethod
+    def name(span: Tuple[int, int]) -> str:
+        return f"{span[0]}-{span[1]}"
+
+    def claim_path(self, span: Tuple[int, int]) -> str:
+        return os.path.join(self.path, "claims", self.name(span))
+
+    def lock_path(self, key: Lock) -> str:
+        """
+        Claim of a chunk, or the merge lock.
+        """
+        return os.path.join(self.path, "merge.lock") if key == MERGE else self.claim_path(key)
+
+    def segment_path(self, span: Tuple[int, int]) -> str:
+        """
+        Segment this process renders a chunk it claimed into.
+        """
+        return os.path.join(self.path, "segments", f"{self.name(span)}.{self._tokens[span]}{self.ext}")
+
+    def done_path(self, span: Tuple[int, int]) -> str:
+        return os.path.join(self.path, "done", self.name(span)+".json")
+
+    def is_done(self, span: Tuple[int, int]) -> bool:
+        return os.path.isfile(self.done_path(span))
+
+    def all_done(self) -> bool:
+        return all(self.is_done(span) for span in self.spans)
+
+    def is_merged(self) -> bool:
+        return os.path.isfile(os.path.join(self.path, "merged.json"))
+
+    def token(self, key: Lock) -> Optional[str]:
+        """
+        Token of a lock this process took, or None.
+        """
+        return self._tokens.get(key)
+
+    def owns(self, key: Lock) -> bool:
+        """
+        Whether a lock (claim of a chunk, or ``MERGE``) still has this process's token.
+        """
+        try:
+            with open(self.lock_path(key), "r") as fp:
+                return fp.read() == self._tokens.get(key)
+        except FileNotFoundError:
+            return False
+
+    def release(self, key: Lock) -> None:
+        """
+        Remove a lock, if this process still owns it.
+        """
+        if self.owns(key):
+            os.remove(self.lock_path(key))
+        self._tokens.pop(key, None)
+
+    def is_stale(self, key: Lock) -> bool:
+        """
+        Whether a lock wasn't updated for ``STALE_TIME`` seconds, measured with the
+        local clock since this process first saw its mtime.
+        """
+        try:
+            mtime = os.path.getmtime(self.lock_path(key))
+        except FileNotFoundError:
+            self._seen.pop(key, None)
+            return False
+        seen = self._seen.get(key)
+        if seen is None or seen[0] != mtime:
+            self._seen[key] = (mtime, time.monotonic())
+            return False
+        return time.monotonic() - seen[1] > STALE_TIME
+
+    def lock(self, key: Lock) -> bool:
+        """
+        Take a lock if it is free or stale. A stale lock is renamed away (only one
+        process can), and removed once the new lock is created.
+
+        :return: Whether this process took the lock.
+        """
+        path = self.lock_path(key)
+        token = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        stale_path = None
+        if os.path.isfile(path):
+            if not self.is_stale(key):
+                return False
+            # Only one process can rename the stale lock away.
+            stale_path = f"{path}.stale.{token}"
+            try:
+                os.rename(path, stale_path)
+            except FileNotFoundError:
+                return False
+            self._seen.pop(key, None)
+
+        locked = create_exclusive(path, token)
+        if locked:
+            self._tokens[key] = token
+        if stale_path is not None:
+            os.remove(stale_path)
+        return locked
+
+    def claim(self, prefer: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """
+        Claim a chunk that is not done and not claimed by a live process.
+
+        :param prefer: Try the chunk starting at this frame first, so the simulation
+            can continue without warm-up.
+        :return: The claimed span, or None if there is nothing left to claim.
+        """
+        spans = sorted(self.spans, key=lambda s: s[0] != prefer)
+        for span in spans:
+            if self.is_done(span):
+                continue
+            if self.lock(span):
+                if self.is_done(span):
+                    # Finished between the check and the claim.
+                    self.release(span)
+                    continue
+                return span
+
+        return None
+
+    def finish(self, span: Tuple[int, int]) -> bool:
+        """
+        Record a rendered chunk and release the claim. If the claim was taken over,
+        or the chunk was already recorded, the segment is discarded.
+
+        :return: Whether the chunk was recorded.
+        """
+        path = self.segment_path(span)
+        recorded = False
+        if self.owns(span):
+            info = {
+                "segment": os.path.basename(path),
+                "frames": segment_frames(path),
+                "sha256": file_hash(path),
+                "owner": self.owner,
+            }
+            recorded = create_exclusive(self.done_path(span), json.dumps(info, indent=4))
+        if not recorded:
+            os.remove(path)
+        self.release(span)
+        return recorded
+
+    def done_segment(self, span: Tuple[int, int]) -> str:
+        """
+        Path of the segment recorded for a finished chunk.
+        """
+        with open(self.done_path(span), "r") as fp:
+            return os.path.join(self.path, "segments", json.load(fp)["segment"])
+
+    def verify(self) -> None:
+        """
+        Check that every chunk is done, and each segment has the expected number
+        of frames and checksum. Raises ``ValueError`` otherwise.
+        """
+        for span in self.spans:
+            if not self.is_done(span):
+                raise ValueError(f"Chunk {self.name(span)} is not done.")
+            with open(self.done_path(span), "r") as fp:
+                info = json.load(fp)
+            path = self.done_segment(span)
+            if info["frames"] != span[1]-span[0]:
+                raise ValueError(f"Segment {path} has {info['frames']} frames, expected {span[1]-span[0]}.")
+            if file_hash(path) != info["sha256"]:
+                raise ValueError(f"Segment {path} checksum mismatch.")
+
+
+class Heartbeat:
+    """
+    Updates the mtime of a lock file (claim of a chunk, or ``MERGE``) in the
+    background while this process owns it, so other processes know the owner is
+    alive.
+    """
+
+    def __init__(self, shard: Shard, key: Lock) -> None:
+        self.shard = shard
+        self.key = key
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(HEARTBEAT):
+            if not self.shard.owns(self.key):
+                break
+            try:
+                os.utime(self.shard.lock_path(self.key))
+            except FileNotFoundError:
+                pass
+
+
+def export_shard(context: Video, path: str, shard_path: str, chunk: float, warmup: int,
+        pipeline: int, start: int, end: int) -> None:
+    """
+    Render chunks from a shard folder until none are left, then merge if all are done.
+    The ``init`` jobs must have been run.
+    """
+    settings = {
+        "start": start,
+        "end": end,
+        "chunk": max(int(chunk*context.fps), 1),
+        "fps": context.fps,
+        "resolution": context.resolution,
+        "ffmpeg": context.ffmpeg,
+        "ext": os.path.splitext(path)[1],
+        "props": props_snapshot(context),
+    }
+    shard = Shard(shard_path, settings)
+
+    # Frame the simulation caches of this process are complete up to.
+    sim_frame = None
+    while not shard.all_done():
+        span = shard.claim(None if sim_frame is None else sim_frame+1)
+        if span is None:
+            # Wait for chunks claimed by other processes to finish or become stale.
+            time.sleep(POLL)
+            continue
+
+        print(f"Rendering chunk {shard.name(span)}")
+        with Heartbeat(shard, span):
+            if sim_frame != span[0]-1:
+                simulate_range(context, max(span[0]-warmup, 0), span[0])
+            render_segment(context, span, shard.segment_path(span), False, pipeline, lossless=False)
+        if not shard.finish(span):
+            print(f"Chunk {shard.name(span)} was taken over by another process, discarded.")
+        sim_frame = span[1] - 1
+
+    exe_slot(context, "deinit")
+
+    # One process merges, the others wait, and take over if it dies.
+    waiting = False
+    while not shard.is_merged():
+        if not shard.lock(MERGE):
+            if not waiting:
+                print("Another process is merging the video.")
+                waiting = True
+            time.sleep(POLL)
+            continue
+
+        # Merged under a temporary name, in case the lock is taken over.
+        root, ext = os.path.splitext(path)
+        tmp_path = f"{root}.{shard.token(MERGE)}{ext}"
+        try:
+            with Heartbeat(shard, MERGE):
+                merge_shard(context, shard, tmp_path)
+            if shard.owns(MERGE):
+                os.replace(tmp_path, path)
+                create_exclusive(os.path.join(shard.path, "merged.json"), json.dumps({"owner": shard.owner}))
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            shard.release(MERGE)
+
+
+def merge_shard(context: Video, shard: Shard, path: str) -> None:
+    """
+    Verify all segments and concatenate them into ``path``.
+    """
+    shard.verify()
+    print("Merging segments...")
+
+    if HAS_FFMPEG:
+        list_path = os.path.join(shard.path, f"segments.{shard.token(MERGE)}.txt")
+        with open(list_path, "w") as fp:
+            for span in shard.spans:
+                fp.write(f"file '{shard.done_segment(span)}'\n")
+        args = [FFMPEG, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", path]
+        p = Popen(args, stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE)
+        _, err = p.communicate()
+        os.remove(list_path)
+        if p.returncode != 0:
+            raise RuntimeError(f"FFmpeg concat failed with exit code {p.returncode}:\n{err.decode(errors='replace')}")
+    else:
+        # Without FFmpeg, segments can only be re-encoded.
+        print("WARNING: FFmpeg not found, re-encoding segments instead of concatenating.")
+        with open_writer(context, path) as video:
+            for span in shard.spans:
+                copy_segment(shard.done_segment(span), video)
+
+    total = shard.spans[-1][1] - shard.spans[0][0]
+    frames = segment_frames(path)
+    if frames != total:
+        raise ValueError(f"Merged video has {frames} frames, expected {total}.")
@@ -19,6 +19,7 @@
 
 import sys
 import os
+import hashlib
 from subprocess import DEVNULL, PIPE, Popen, STDOUT
 from .utils import ADDON_PATHS
 
@@ -36,6 +37,23 @@ def register_addons():
         sys.path.pop(0)
 
 
+def source_hash() -> str:
+    """
+    Hash of the native sources (C++, CUDA and Makefile), so the library is rebuilt
+    whenever they change, not only on a new version.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(PARENT):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith((".cpp", ".hpp", ".cu", ".cuh")) or file == "Makefile":
+                path = os.path.join(root, file)
+                digest.update(os.path.relpath(path, PARENT).encode())
+                with open(path, "rb") as fp:
+                    digest.update(fp.read())
+    return digest.hexdigest()
+
+
 def clean():
     p3 = Popen(["make", "clean"], cwd=PARENT, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)
     p3.wait()
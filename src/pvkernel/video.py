@@ -24,12 +24,18 @@ __all__ = (
 import os
 import random
 import string
+from contextlib import contextmanager
 import numpy as np
 import pv
+from pv.props import Property
 from pv.types import Cache, DataGroup, Job, OpGroup, Operator, PropertyGroup
 from pv.utils import get
-from typing import Sequence, Tuple, Type
+from typing import Any, Optional, Sequence, Tuple, Type
+from .buffers import BufferPool
+from .dirty import DirtyRegion
 from .export import export
+from .layers import Layer, LayerStack
+from .live import LiveStats, live
 from .utils import HAS_FFMPEG, Namespace
 
 
@@ -40,7 +46,9 @@ class Video:
 
     Attributes users can use:
 
-    * ``export(path)``: Render and save video to path.
+    * ``export(path, workers=1)``: Render and save video to path.
+    * ``draft(scale, step)``: Context manager for fast, low resolution previews.
+    * ``live(source, sink)``: Render in real time from live MIDI input.
     * ``clear_jobs(slot)``: Clear all the jobs of a slot.
     * ``add_job(idname, slot)``: Add a job to a slot.
     * ``get_jobs(slot)``: Return the jobs of a slot.
@@ -50,16 +58,41 @@ class Video:
     * ``frame``: Current frame that is rendering.
     * ``render_img``: Modify this attribute to update the render image.
     * ``cache``: Cache directory. You should extend off of this if you need cache.
+    * ``shared_cache``: Cache directory kept between runs and shared by all videos.
+      Only store results that are keyed by all their inputs here.
+    * ``buffers``: Pool of reusable image buffers (see ``pvkernel.buffers.BufferPool``).
+      Use these instead of allocating full size images every frame.
+    * ``profiler``: Set while profiling (see ``pvkernel.profiler``), otherwise None.
+      Time parts of an operator with ``profiler.span(category, name)``.
+    * ``pixel_scale``: Render scale relative to the set resolution (less than 1 in
+      draft mode). Multiply hardcoded pixel sizes by this.
+    * ``frame_step``: Frames between two rendered frames (more than 1 in draft mode,
+      and after dropped frames in live mode). Simulations should step this many
+      frames at once.
+    * ``live_input``: Set in live mode (see ``pvkernel.live.LiveInput``), otherwise None.
+    * ``layers``: Layers of jobs with a ``layer`` (see ``pvkernel.layers``).
+    * ``layer``: While a job with a layer runs, the layer to draw on, otherwise None.
+    * ``dirty``: Region of the render image drawn on in the current frame (see
+      ``pvkernel.dirty``). Operators can add what they drew with ``dirty.add``.
     """
     resolution: Tuple[int, int]
     fps: float
     ffmpeg: bool
+    pixel_scale: float
+    frame_step: int
+    buffers: BufferPool
+    profiler: Optional[Any]
+    live_input: Optional[Any]
+    layers: LayerStack
+    layer: Optional[Layer]
+    dirty: DirtyRegion
 
     props: Namespace
     ops: Namespace
     data: Namespace
 
     _frame: int
+    _export_frame: Optional[int]
     _render_img: np.ndarray
 
     def __init__(self, resolution: Tuple[int, int] = (1920, 1080), fps: float = 30.0, ffmpeg: bool = ...) -> None:
@@ -68,21 +101,33 @@ class Video:
 
         :param resolution: (X, Y) pixel resolution.
         :param fps: Frames per second. Can be float, but will be rounded down in export.
-        :param ffmpeg: Use FFmpeg to compile video. Default True if ffmpeg is present.
+        :param ffmpeg: Stream frames to FFmpeg to encode (libx265) instead of OpenCV.
+            Default False.
         :return: None
         """
         self.resolution = resolution
         self.fps = fps
-        self.ffmpeg = False #HAS_FFMPEG if ffmpeg == ... else ffmpeg
+        self.ffmpeg = False if ffmpeg == ... else ffmpeg
+        assert HAS_FFMPEG or not self.ffmpeg, "FFmpeg not found."
+        self.pixel_scale = 1.0
+        self.frame_step = 1
+        self.buffers = BufferPool()
+        self.profiler = None
+        self.live_input = None
+        self.layers = LayerStack()
+        self.layer = None
+        self.dirty = DirtyRegion((resolution[1], resolution[0]))
 
         rand = "".join(random.choices(string.ascii_letters+string.digits, k=32))
         self.cache = os.path.join(os.getcwd(), ".pvcache", rand)
+        self.shared_cache = os.path.join(os.getcwd(), ".pvcache", "shared")
         os.makedirs(self.cache)
 
         self._jobs = {
             "init": [],
             "intro": [],
             "frame_init": [],
+            "simulate": [],
             "frame": [],
             "frame_deinit": [],
             "outro": [],
@@ -92,6 +137,7 @@ class Video:
 
         self._render_img = None
         self._frame = None
+        self._export_frame = None
 
         self._add_callbacks()
         self._add_default_jobs()
@@ -110,11 +156,75 @@ class Video:
         assert self._frame is not None, "Frame not initialized (kernel fault)."
         return self._frame
 
-    def export(self, path: str) -> None:
+    def export(self, path: str, **kwargs) -> None:
         """
         Calls ``pvkernel.export.export``
+
+        Keyword arguments (e.g. ``workers``, ``two_phase``, ``pipeline``) are passed on.
+        See ``pvkernel.export.export`` for options.
+        """
+        export(self, path, **kwargs)
+
+    def live(self, source, sink=None, **kwargs) -> LiveStats:
+        """
+        Calls ``pvkernel.live.live``
+
+        :param source: ``pvkernel.live.PortSource`` or ``pvkernel.live.ReplaySource``.
+        :param sink: ``pvkernel.live.WindowSink`` (default) or ``pvkernel.live.RawSink``.
+        """
+        return live(self, source, sink, **kwargs)
+
+    @contextmanager
+    def draft(self, scale: float = 0.5, step: int = 4):
+        """
+        Draft preview mode. Inside the ``with`` block, the video renders at ``scale``
+        times the resolution and only every ``step`` frames. Properties with the
+        ``"PIXEL"`` subtype are scaled, and simulations use a ``step`` times larger
+        timestep, in a separate cache. Everything is restored on exit.
+
+        .. code-block:: py
+
+            with video.draft(0.25, 4):
+                video.export("preview.mp4")
+
+        :param scale: Resolution multiplier.
+        :param step: Render every ``step`` frames.
         """
-        export(self, path)
+        assert 0 < scale <= 1, "Draft scale must be between 0 and 1."
+        assert step >= 1, "Draft step must be at least 1."
+
+        def scale_value(value):
+            if isinstance(value, (list, tuple)):
+                return [scale_value(v) for v in value]
+            return value * scale
+
+        pixel_props = []
+        for group in self.props._items.values():
+            for name in dir(type(group)):
+                if isinstance(getattr(type(group), name), Property):
+                    prop = group._get_prop(name)
+                    if prop.subtype == "PIXEL":
+                        pixel_props.append((prop, prop.value))
+
+        resolution, cache, caches = self.resolution, self.cache, self.caches
+        try:
+            for prop, value in pixel_props:
+                prop.value = scale_value(value)
+            # Even sizes, for encoders with chroma subsampling.
+            self.resolution = tuple(max(int(x*scale)//2*2, 2) for x in resolution)
+            self.pixel_scale = scale
+            self.frame_step = step
+            self.caches = Namespace()
+            self._set_cache(os.path.join(cache, "draft"))
+            yield self
+        finally:
+            for prop, value in pixel_props:
+                prop.value = value
+            self.resolution = resolution
+            self.pixel_scale = 1.0
+            self.frame_step = 1
+            self.cache = cache
+            self.caches = caches
 
     def clear_jobs(self, slot: str) -> None:
         """
@@ -143,9 +253,14 @@ class Video:
         self.add_job("midi", "init")
         self.add_job("core", "init")
         self.add_job("keyboard_init", "init")
+        self.add_job("blocks_init", "init")
+        self.add_job("overlay_init", "init")
 
         self.add_job("midi_frame_init", "frame_init")
+        self.add_job("smoke_sim", "simulate")
+        self.add_job("ptcls_sim", "simulate")
         self.add_job("blocks", "frame")
+        self.add_job("overlay", "frame")
         self.add_job("keyboard_render", "frame")
         self.add_job("smoke", "frame")
         self.add_job("ptcls", "frame")
@@ -199,3 +314,12 @@ class Video:
 
     def _add_cache(self, cls: Type[Cache]) -> None:
         setattr(self.caches, cls.idname, cls(self))
+
+    def _set_cache(self, path: str) -> None:
+        """
+        Change the cache directory and create new caches in it. Internal use.
+        """
+        self.cache = path
+        os.makedirs(self.cache, exist_ok=True)
+        for cls in pv.utils._get_caches():
+            self._add_cache(cls)
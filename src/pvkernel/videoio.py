@@ -21,12 +21,16 @@
 Provides convenient video read and write classes.
 """
 
-import sys
-import os
+import time
+import threading
+import queue
 import numpy as np
 import cv2
-from subprocess import PIPE, STDOUT, Popen, DEVNULL
-from typing import TYPE_CHECKING, Tuple
+from collections import deque
+from subprocess import PIPE, Popen, DEVNULL
+from typing import Any, Callable, Dict, TYPE_CHECKING, Tuple
+from .buffers import BufferPool
+from .profiler import Profiler
 from .utils import FFMPEG
 
 Video = None
@@ -38,16 +42,21 @@ class VideoWriter:
     """Writes a video."""
     path: str
 
-    def __init__(self, path: str, resolution: Tuple[int, int], fps: int, video: Video) -> None:
+    def __init__(self, path: str, resolution: Tuple[int, int], fps: float, video: Video,
+            fourcc: str = "mp4v") -> None:
+        """
+        :param fourcc: OpenCV codec. Use ``FFV1`` for lossless output.
+        """
         self.path = path
         self.resolution = resolution
         self.fps = fps
+        self.fourcc = fourcc
 
         self._entered = False
         self._pos = 0
 
     def __enter__(self):
-        self._video = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*"mp4v"),
+        self._video = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc),
             self.fps, self.resolution)
         self._entered = True
         return self
@@ -77,49 +86,241 @@ class VideoWriter:
 
 
 class VideoWriterFFmpeg:
-    """Writes a video and compiles using FFmpeg."""
+    """
+    Writes a video by streaming raw frames to an FFmpeg process.
+
+    FFmpeg is started on ``__enter__`` and encodes while frames are written, so no
+    intermediate files are needed. If FFmpeg fails, ``RuntimeError`` is raised with
+    its output.
+    """
     path: str
 
-    def __init__(self, path: str, resolution: Tuple[int, int], fps: int, video: Video) -> None:
+    def __init__(self, path: str, resolution: Tuple[int, int], fps: float, video: Video,
+            codec: str = "libx265", crf: int = 25) -> None:
+        """
+        :param codec: FFmpeg video encoder.
+        :param crf: Constant rate factor (lower is higher quality).
+        """
         self.path = path
         self.resolution = resolution
-        self.fps = int(fps)
-        self.cache = os.path.join(video.cache, "ffmpeg_export")
+        self.fps = fps
+        self.codec = codec
+        self.crf = crf
 
         self._entered = False
-        self._frame = 0
+        self._pos = 0
+        self._proc = None
+        self._log = deque(maxlen=100)
 
     def __enter__(self):
-        os.makedirs(self.cache, exist_ok=True)
+        width, height = self.resolution
+        args = [FFMPEG, "-y", "-loglevel", "error", "-nostats",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-",
+            "-an", "-c:v", self.codec, "-pix_fmt", "yuv420p", "-crf", str(self.crf), self.path]
+        self._proc = Popen(args, stdin=PIPE, stdout=DEVNULL, stderr=PIPE)
+
+        # Drain FFmpeg's output so it never blocks on a full pipe.
+        self._log_thread = threading.Thread(target=self._read_log, daemon=True)
+        self._log_thread.start()
+
         self._entered = True
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self._entered = False
-        if exc_type == KeyboardInterrupt:
+        if exc_type is not None:
+            # Rendering failed or was interrupted. Don't leave FFmpeg running.
+            self._proc.kill()
+            self._proc.wait()
             return
 
-        args = [FFMPEG, "-y", "-i", os.path.join(self.cache, "%d.jpg"), "-c:v", "libx265", "-an", "-r", str(self.fps),
-            "-crf", "25", self.path]
-        print("Compiling video...")
-        p = Popen(args, stdin=DEVNULL, stdout=PIPE, stderr=STDOUT)
-        p.wait()
-
-        if p.returncode != 0:
-            if input("FFmpeg failed. Show output? [Y/n] ").lower().strip() == "n":
-                return
-            while True:
-                data = p.stdin.read(1024)
-                sys.stderr.write(data)
-                if len(data) < 1024:
-                    break
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._proc.wait()
+        self._log_thread.join()
+        if self._proc.returncode != 0:
+            self._raise()
 
     def _check_entered(self):
         assert self._entered, "VideoWriterFFmpeg can only be used in a \"with\" statement."
 
-    def write(self, img: np.ndarray) -> None:
+    def _read_log(self) -> None:
+        for line in self._proc.stderr:
+            self._log.append(line.decode(errors="replace"))
+
+    def _raise(self) -> None:
+        self._proc.wait()
+        self._log_thread.join()
+        raise RuntimeError(f"FFmpeg failed with exit code {self._proc.returncode}:\n" + "".join(self._log))
+
+    def tell(self) -> int:
+        """
+        Return number of frames written.
+        """
+        self._check_entered()
+        return self._pos
+
+    def write(self, img: np.ndarray) -> int:
         """Write a frame. Return the total number of frames written."""
         self._check_entered()
-        path = os.path.join(self.cache, f"{self._frame}.jpg")
-        cv2.imwrite(path, img)
-        self._frame += 1
+        assert img.shape == (self.resolution[1], self.resolution[0], 3) and img.dtype == np.uint8, \
+            "VideoWriterFFmpeg: image does not match resolution."
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(img).data)
+        except BrokenPipeError:
+            self._raise()
+        self._pos += 1
+        return self._pos
+
+
+class PipelinedWriter:
+    """
+    Converts (RGB to BGR) and writes frames to another writer in background threads.
+
+    The render loop, color conversion, and encoding run concurrently, joined by
+    queues of at most ``depth`` frames. If the writer is slower than the renderer,
+    ``write`` blocks until there is room (back-pressure).
+
+    Busy time of each stage and queue depths are recorded. See ``report``.
+    """
+    STAGES = ("render", "convert", "encode")
+
+    def __init__(self, writer: Any, depth: int = 8, pool: BufferPool = None,
+            profiler: Profiler = None) -> None:
+        """
+        :param writer: Writer to write converted frames to (e.g. ``VideoWriter``).
+        :param depth: Max frames in each queue. Set to 0 to convert and write in the
+            calling thread.
+        :param pool: If given, converted frames are borrowed from the pool, and
+            written frames are released to it.
+        :param profiler: If given, each conversion and write is recorded.
+        """
+        self.writer = writer
+        self.depth = depth
+        self.pool = pool
+        self.profiler = profiler
+
+        self.busy: Dict[str, float] = {name: 0 for name in self.STAGES}
+        self.depth_samples = []
+
+        self._error = None
+        self._threads = []
+        self._start = None
+        self._last = None
+
+    def __enter__(self):
+        self._start = self._last = time.perf_counter()
+        if self.depth > 0:
+            self._queues = (queue.Queue(self.depth), queue.Queue(self.depth))
+            self._threads = [
+                threading.Thread(target=self._stage, args=("convert", self._convert, *self._queues), daemon=True),
+                threading.Thread(target=self._stage, args=("encode", self._encode, self._queues[1], None), daemon=True),
+            ]
+            for thread in self._threads:
+                thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.depth > 0:
+            self._queues[0].put(None)
+            for thread in self._threads:
+                thread.join()
+        self._end = time.perf_counter()
+        if self._error is not None and exc_type is None:
+            raise self._error
+
+    def write(self, img: np.ndarray) -> None:
+        """
+        Queue a rendered (RGB) frame.
+        The image must not be modified after passing it in. If there is a pool, it
+        is released to it after conversion.
+        """
+        now = time.perf_counter()
+        self.busy["render"] += now - self._last
+
+        if self._error is not None:
+            raise self._error
+        if self.depth > 0:
+            self.depth_samples.append((self._queues[0].qsize(), self._queues[1].qsize()))
+            self._queues[0].put(img)
+        else:
+            self._encode(self._convert(img, "convert"), "encode")
+
+        self._last = time.perf_counter()
+
+    def report(self) -> str:
+        """
+        Utilization of each stage (fraction of total time busy) and queue depths.
+        The busiest stage is the bottleneck.
+        """
+        total = max(self._end-self._start, 1e-9)
+        util = {name: self.busy[name]/total for name in self.STAGES}
+        bottleneck = max(util, key=util.get)
+
+        lines = ["Pipeline utilization:"]
+        for name in self.STAGES:
+            lines.append(f"* {name}: {util[name]*100:.1f}% busy" + (" (bottleneck)" if name == bottleneck else ""))
+        if len(self.depth_samples) > 0:
+            samples = np.array(self.depth_samples)
+            for i, name in enumerate(("convert", "encode")):
+                lines.append(f"* {name} queue: mean {samples[:, i].mean():.1f}, max {samples[:, i].max()} of {self.depth}")
+        return "\n".join(lines)
+
+    def _convert(self, img: np.ndarray, name: str) -> np.ndarray:
+        if self.profiler is not None:
+            with self.profiler.span("writer", name):
+                return self._convert_frame(img, name)
+        return self._convert_frame(img, name)
+
+    def _encode(self, img: np.ndarray, name: str) -> None:
+        if self.profiler is not None:
+            with self.profiler.span("writer", name):
+                return self._encode_frame(img, name)
+        return self._encode_frame(img, name)
+
+    def _convert_frame(self, img: np.ndarray, name: str) -> np.ndarray:
+        t = time.perf_counter()
+        region = None if self.pool is None else self.pool.region(img)
+        if self.pool is None:
+            out = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        elif region is None:
+            out = self.pool.acquire(img.shape, img.dtype)
+            cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=out)
+            self.pool.release(img)
+        else:
+            # Outside the region of the frame, both images are black.
+            out = self.pool.acquire(img.shape, img.dtype, zero=True)
+            region.convert(img, out, cv2.COLOR_BGR2RGB)
+            self.pool.set_region(out, region)
+            self.pool.release(img)
+        self.busy[name] += time.perf_counter() - t
+        return out
+
+    def _encode_frame(self, img: np.ndarray, name: str) -> None:
+        t = time.perf_counter()
+        self.writer.write(img)
+        if self.pool is not None:
+            self.pool.release(img)
+        self.busy[name] += time.perf_counter() - t
+
+    def _stage(self, name: str, func: Callable, in_queue: queue.Queue, out_queue: queue.Queue) -> None:
+        """
+        Thread target. Runs ``func`` on each item until None is received.
+        After an error, keeps draining the input so the producer never blocks.
+        """
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            if self._error is None:
+                try:
+                    item = func(item, name)
+                    if out_queue is not None:
+                        out_queue.put(item)
+                except Exception as e:
+                    self._error = e
+
+        if out_queue is not None:
+            out_queue.put(None)
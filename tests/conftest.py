@@ -0,0 +1,70 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+"""
+Shared fixtures of the tests. Run the tests with ``python -m pytest tests``.
+"""
+
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fixtures
+
+
+def new_video(folder, resolution=(640, 360), fps=30, notes=(240, 4, 4, 0.4)):
+    """
+    Video of a small synthetic piece (see ``benchmarks/fixtures.py``). The MIDI
+    file and keyboard video are written to ``folder`` if they don't exist.
+
+    :param resolution: ``(width, height)``
+    :param notes: ``(number of notes, notes per chord, chords per second, note length)``
+    """
+    import pvkernel
+    midi = os.path.join(folder, f"piece_{notes[0]}_{notes[1]}_{notes[2]}_{notes[3]}.mid")
+    keyboard = os.path.join(folder, f"keyboard_{resolution[0]}x{resolution[1]}_{fps}.mp4")
+    if not os.path.isfile(midi):
+        fixtures.make_midi(midi, *notes)
+    if not os.path.isfile(keyboard):
+        fixtures.make_keyboard(keyboard, resolution, 300, fps)
+
+    video = pvkernel.Video(resolution, fps)
+    video.props.midi.paths = midi
+    video.props.midi.cache = False
+    video.props.keyboard.video_path = keyboard
+    video.props.keyboard.crop = fixtures.keyboard_crop(resolution)
+    return video
+
+
+@pytest.fixture
+def make_video(tmp_path, monkeypatch):
+    """
+    Returns ``new_video`` with its cache and inputs in a temporary folder.
+    """
+    monkeypatch.chdir(tmp_path)
+
+    def make(*args, **kwargs):
+        return new_video(str(tmp_path), *args, **kwargs)
+
+    return make
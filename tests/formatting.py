@@ -26,11 +26,12 @@ GREEN = "\x1b[32m"
 
 # List of (dir, recursive, (glob1, glob2, glob3))
 PATHS = (
-    (".",         False, ("*.md", "*.gitignore", "*.txt")),
-    ("./build",   False, ("*.py",)),
-    ("./docs",    True,  ("*.rst", "*.py", "Makefile")),
-    ("./src",     True,  ("*.py", "*.c", "*.cpp", "*.h", "*.hpp", "*.cu", "*.cuh", "Makefile")),
-    ("./tests",   True,  ("*.py",)),
+    (".",            False, ("*.md", "*.gitignore", "*.txt")),
+    ("./benchmarks", False, ("*.py",)),
+    ("./build",      False, ("*.py",)),
+    ("./docs",       True,  ("*.rst", "*.py", "Makefile")),
+    ("./src",        True,  ("*.py", "*.c", "*.cpp", "*.h", "*.hpp", "*.cu", "*.cuh", "Makefile")),
+    ("./tests",      True,  ("*.py",)),
 )
 
 
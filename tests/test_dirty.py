@@ -0,0 +1,121 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+import cv2
+import numpy as np
+from pv.utils import call_op, get
+
+
+def tile_mask(region):
+    """Pixel mask of the dirty tiles of a region, brute force."""
+    from pvkernel.dirty import TILE
+    height, width = region.shape
+    mask = np.zeros((height, width), dtype=bool)
+    for ty, tx in zip(*np.nonzero(region.tiles)):
+        mask[ty*TILE:(ty+1)*TILE, tx*TILE:(tx+1)*TILE] = True
+    return mask
+
+
+def boxes_mask(boxes, shape):
+    """Pixel mask of boxes. Fails if two boxes overlap."""
+    mask = np.zeros(shape, dtype=bool)
+    for y0, y1, x0, x1 in boxes:
+        assert not mask[y0:y1, x0:x1].any()
+        mask[y0:y1, x0:x1] = True
+    return mask
+
+
+def test_region_tiles():
+    from pvkernel.dirty import DirtyRegion
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        shape = tuple(rng.integers(1, 200, 2))
+        region = DirtyRegion(shape)
+        drawn = np.zeros(shape, dtype=bool)
+        for _ in range(rng.integers(0, 6)):
+            y0, y1 = sorted(rng.integers(-20, shape[0]+20, 2))
+            x0, x1 = sorted(rng.integers(-20, shape[1]+20, 2))
+            region.add(y0, y1, x0, x1)
+            drawn[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)] = True
+
+        mask = tile_mask(region)
+        assert not (drawn & ~mask).any()
+        assert region.empty == (not mask.any())
+        assert np.array_equal(boxes_mask(region.boxes(), shape), mask)
+
+
+def test_region_clear_convert():
+    from pvkernel.dirty import DirtyRegion
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, (130, 170, 3), dtype=np.uint8)
+    for boxes in ([(5, 40, 10, 100), (90, 130, 150, 170)], [(0, 130, 0, 170)]):
+        region = DirtyRegion(img.shape)
+        for box in boxes:
+            region.add(*box)
+        mask = tile_mask(region)
+
+        cleared = img.copy()
+        region.clear(cleared)
+        assert not cleared[mask].any()
+        assert np.array_equal(cleared[~mask], img[~mask])
+
+        out = np.zeros_like(img)
+        region.convert(img, out, cv2.COLOR_BGR2RGB)
+        assert np.array_equal(out[mask], img[..., ::-1][mask])
+        assert not out[~mask].any()
+
+
+def test_glare_region(make_video):
+    from pvkernel.export import exe_slot, set_frame
+    video = make_video((640, 1080), notes=(240, 8, 4, 0.5))
+    video.props.glare.radius = 450
+    exe_slot(video, "init")
+    job = get(video.get_jobs("frame"), "glare")
+
+    start = int(video.props.core.pause_start * video.fps)
+    for frame in range(start, start+60, 2):
+        set_frame(video, frame)
+        call_op(video, "midi.notes_playing")
+        video.render_img = np.zeros((1080, 640, 3), dtype=np.uint8)
+        call_op(video, "glare.apply")
+        mask = boxes_mask(job.region(video), (1080, 640))
+        assert not video.render_img[~mask].any()
+    exe_slot(video, "deinit")
+
+
+def test_frame_region(make_video):
+    """
+    Every default job draws inside the region it reports, and reused frame
+    buffers are black again.
+    """
+    from pvkernel.export import exe_slot, render_frame
+    video = make_video()
+    video.props.smoke.pps = 500
+    exe_slot(video, "init")
+
+    for frame in range(0, 200, 3):
+        img = render_frame(video, frame)
+        assert not img[~tile_mask(video.dirty)].any()
+        video.buffers.release(img)
+
+        buf = video.buffers.acquire(img.shape, img.dtype, zero=True)
+        assert buf is img and not buf.any()
+        video.buffers.release(buf)
+    exe_slot(video, "deinit")
@@ -0,0 +1,76 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+import pvkernel
+from pvkernel import draw
+
+
+def random_rects(rng, shape, num, layers, scale):
+    """Random dims, colors, borders and radii of ``draw.rects``."""
+    height, width = shape
+    dims = np.empty((num, layers, 4))
+    dims[..., 0] = rng.uniform(-20, width, (num, layers))
+    dims[..., 1] = rng.uniform(-20, height, (num, layers))
+    dims[..., 2] = rng.uniform(0, width*scale, (num, layers))
+    dims[..., 3] = rng.uniform(0, height*scale, (num, layers))
+    colors = rng.uniform(0, 255, (num, layers, 4))
+    borders = rng.choice([0, 0, 1, 2.5, 4], (num, layers))
+    radii = rng.choice([0, 0, 2, 5.5, 30], (num, layers))
+    return (dims, colors, borders, radii)
+
+
+def draw_each(img, dims, colors, borders, radii):
+    """``draw.rects`` with ``draw.rect`` for each layer."""
+    for i in range(dims.shape[0]):
+        for j in range(dims.shape[1]):
+            draw.rect(img, colors[i, j], dims[i, j], borders[i, j], radii[i, j])
+
+
+def test_rects():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        shape = tuple(rng.integers(20, 120, 2))
+        args = random_rects(rng, shape, rng.integers(1, 6), rng.integers(1, 4), 0.7)
+        img = rng.integers(0, 256, (*shape, 3), dtype=np.uint8)
+        expect = img.copy()
+        draw.rects(img, *args)
+        draw_each(expect, *args)
+        assert np.array_equal(img, expect)
+
+
+def test_rects_interior():
+    # Large rectangles, mostly interior, often past the image.
+    rng = np.random.default_rng(1)
+    for _ in range(100):
+        shape = tuple(rng.integers(50, 200, 2))
+        args = random_rects(rng, shape, rng.integers(1, 4), rng.integers(1, 4), 3)
+        img = rng.integers(0, 256, (*shape, 3), dtype=np.uint8)
+        expect = img.copy()
+        draw_each(expect, *args)
+
+        # Only some rows, the rest is unchanged.
+        y0, y1 = np.sort(rng.integers(0, shape[0]+1, 2))
+        rows = img.copy()
+        draw.rects(rows, *args, rows=(y0, y1))
+        assert np.array_equal(rows[y0:y1], expect[y0:y1])
+        assert np.array_equal(rows[:y0], img[:y0]) and np.array_equal(rows[y1:], img[y1:])
+
+        draw.rects(img, *args)
+        assert np.array_equal(img, expect)
@@ -0,0 +1,56 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import os
+from pvkernel import export
+from pvkernel.resume import segment_frames
+
+RESOLUTION = (160, 96)
+NOTES = (24, 4, 4, 0.4)
+
+
+def test_worker_caches(make_video, tmp_path, monkeypatch):
+    # More chunks than workers, so workers render several.
+    log_path = str(tmp_path / "log.txt")
+    render_segment = export.render_segment
+
+    def logged_render(context, span, *args, **kwargs):
+        with open(log_path, "a") as fp:
+            fp.write(f"{os.getpid()} {context.cache}\n")
+        render_segment(context, span, *args, **kwargs)
+
+    monkeypatch.setattr(export, "render_segment", logged_render)
+    video = make_video(RESOLUTION, notes=NOTES)
+    video.props.core.pause_start = 0.5
+    video.props.core.pause_end = 0.5
+    out_path = str(tmp_path / "out.mp4")
+    video.export(out_path, workers=2, chunk=0.25, pipeline=0)
+
+    with open(log_path, "r") as fp:
+        lines = [line.split() for line in fp.read().splitlines()]
+    assert len(lines) > 2
+    # One cache per worker process, all removed when done.
+    caches = {}
+    for pid, cache in lines:
+        assert caches.setdefault(pid, cache) == cache
+    assert len(set(caches.values())) == len(caches)
+    assert all(os.path.basename(cache) == f"worker_{pid}" for pid, cache in caches.items())
+    assert not any(os.path.exists(cache) for cache in caches.values())
+    assert not any(name.startswith("workers_") for name in os.listdir(video.cache))
+    assert segment_frames(out_path) == video.data.core.running_time
@@ -0,0 +1,73 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import cv2
+import numpy as np
+import pytest
+from pv.utils import call_op
+from pvkernel.export import exe_slot, set_frame
+
+RESOLUTION = (320, 180)
+
+
+def baseline_render(video):
+    """``keyboard.render`` before the scratch buffers, on a new image."""
+    from keyboard import apply_lighting, read_frame
+    height_mid = video.resolution[1] // 2
+    data = video.data.keyboard
+    props = video.props.keyboard
+
+    img = read_frame(video, video.frame)
+    img = cv2.warpPerspective(img, data.crop, data.size)
+    img = cv2.resize(img, data.size)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    apply_lighting(video, img)
+
+    img = img * data.mask_img
+    img = cv2.resize(img, (0, 0), fx=1, fy=props.height_fac)
+    img = np.maximum(img.astype(np.int16)-props.sub_dim, 0).astype(np.uint8)
+    img = img * props.mult_dim
+    for i in range(3):
+        img[..., i] *= props.rgb_mod[i]
+
+    render_img = np.zeros((video.resolution[1], video.resolution[0], 3), dtype=np.uint8)
+    render_img[height_mid:height_mid+img.shape[0], ...] = img[:height_mid, ...]
+    return render_img
+
+
+@pytest.mark.parametrize("sub_dim, mult_dim, rgb_mod", [
+    (10, 0.8, [1, 1, 1]),
+    (10, 0.7, [1, 1, 1]),
+    (12.5, 0.9, [0.9, 1.1, 0.75]),
+    (0, 1.3, [0.3, 0.55, 1]),
+])
+def test_render(make_video, sub_dim, mult_dim, rgb_mod):
+    video = make_video(RESOLUTION)
+    video.props.keyboard.sub_dim = sub_dim
+    video.props.keyboard.mult_dim = mult_dim
+    video.props.keyboard.rgb_mod = rgb_mod
+    exe_slot(video, "init")
+
+    for frame in (0, 40, 80):
+        set_frame(video, frame)
+        expect = baseline_render(video)
+        video.render_img = np.zeros_like(expect)
+        call_op(video, "keyboard.render")
+        assert np.array_equal(video.render_img, expect)
+    exe_slot(video, "deinit")
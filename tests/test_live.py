@@ -0,0 +1,113 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import io
+import pytest
+import pvkernel.live as live
+from conftest import new_video
+
+RESOLUTION = (160, 96)
+NOTES = (24, 4, 4, 0.4)
+# Powers of two, so frame times are exact.
+FPS = 32
+
+
+class Clock:
+    """Stands in for the ``time`` module, time only passes in ``sleep``."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class SlowSink(live.RawSink):
+    """
+    Takes ``cost`` seconds per frame, and records the degraded properties and the
+    number of notes.
+    """
+
+    def __init__(self, video, clock: Clock, cost: float) -> None:
+        super().__init__(io.BytesIO())
+        self.video, self.clock, self.cost = video, clock, cost
+        self.props = []
+        self.notes = []
+
+    def write(self, img):
+        self.clock.now += self.cost
+        self.props.append((self.video.props.smoke.pps, self.video.props.glare.radius))
+        self.notes.append(len(self.video.data.midi.note_table))
+        return super().write(img)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(live, "time", clock)
+    return clock
+
+
+def test_live_replay(tmp_path, monkeypatch, clock):
+    monkeypatch.chdir(tmp_path)
+    video = new_video(str(tmp_path), RESOLUTION, fps=FPS, notes=NOTES)
+    pps, radius = video.props.smoke.pps, video.props.glare.radius
+    source = live.ReplaySource(video.props.midi.paths)
+    # Every frame takes 2.5 frames, so frames are dropped and all are late.
+    sink = SlowSink(video, clock, 2.5/FPS)
+    stats = video.live(source, sink, duration=1, budget=1/FPS)
+
+    # Frames 0, 2, 5, 7, ..., 27, 30: each starts when the last one is shown.
+    assert stats.frames == 13
+    assert stats.dropped == FPS - 13
+    assert stats.late == 13
+    assert stats.latencies == [2.5/FPS] + [3/FPS if i % 2 else 2.5/FPS for i in range(1, 13)]
+    assert len(sink.fp.getvalue()) == 13 * RESOLUTION[0]*RESOLUTION[1]*3
+    # The notes of the file played so far are shown, a chord at the start.
+    assert sink.notes[0] == NOTES[1] and max(sink.notes) > NOTES[1]
+
+    # One level up every 3 late frames.
+    assert stats.levels == [(5, 1), (12, 2), (20, 3), (27, 4)]
+    assert sink.props[0] == (pps, radius)
+    assert sink.props[-1] == (pps * 0.5**4, radius * 0.75**4)
+    assert (video.props.smoke.pps, video.props.glare.radius) == (pps, radius)
+    assert video.live_input is None
+
+
+def test_degrader_restore(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    video = new_video(str(tmp_path), RESOLUTION, fps=FPS, notes=NOTES)
+    pps, radius = video.props.smoke.pps, video.props.glare.radius
+    degrader = live.Degrader(video, live.DEGRADE, 2)
+    budget = 1 / FPS
+
+    changes = [degrader.update(2*budget, budget) for _ in range(9)]
+    assert changes == [False, False, True, False, False, True, False, False, False]
+    assert degrader.level == 2
+    assert (video.props.smoke.pps, video.props.glare.radius) == (pps * 0.25, radius * 0.75**2)
+
+    # One second of fast frames for each level down.
+    changes = [degrader.update(budget/4, budget) for _ in range(FPS)]
+    assert changes == [False]*(FPS-1) + [True]
+    assert (video.props.smoke.pps, video.props.glare.radius) == (pps * 0.5, radius * 0.75)
+    degrader.restore()
+    assert (video.props.smoke.pps, video.props.glare.radius) == (pps, radius)
@@ -0,0 +1,175 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import mido
+import numpy as np
+import pvkernel
+import midi
+from utils import NoteIndex
+
+
+def random_events(rng, num, types=("note_on", "note_off")):
+    """Event table of random note events sorted by time, with repeated times."""
+    events = np.zeros(num, dtype=midi.EVENT_DTYPE)
+    events["time"] = np.sort(rng.integers(0, num//2 + 1, num)).astype(np.float64)
+    events["type"] = [midi.EVENT_TYPES.index(t) for t in rng.choice(types, num)]
+    events["data1"] = rng.integers(18, 112, num)
+    events["data2"] = rng.choice([0, 1, 64, 127], num)
+    return events
+
+
+def random_notes(rng, num):
+    """Note table of random notes sorted by start, with a few long notes."""
+    table = np.zeros(num, dtype=midi.NOTE_DTYPE)
+    table["start"] = np.sort(rng.uniform(-10, 500, num))
+    lengths = np.where(rng.random(num) < 0.05, rng.uniform(0, 200, num), rng.uniform(0, 8, num))
+    table["end"] = table["start"] + lengths
+    table["note"] = rng.integers(0, 88, num)
+    table["velocity"] = rng.integers(1, 128, num)
+    return table
+
+
+def brute_notes(events, min_frames):
+    """``midi.parse_notes``, one event at a time."""
+    last_on = {}
+    notes = []
+    for time, type, _, note, velocity in events.tolist():
+        key = note - 21
+        if midi.EVENT_TYPES[type] not in ("note_on", "note_off") or not 0 <= key < 88:
+            continue
+        if midi.EVENT_TYPES[type] == "note_on" and velocity > 0:
+            last_on[key] = time
+        else:
+            start = last_on.get(key, 0)
+            notes.append((start, start+max(min_frames, time-start), key, velocity))
+    table = np.array(notes, dtype=midi.NOTE_DTYPE)
+    return table[np.argsort(table["start"], kind="stable")]
+
+
+def test_event_table(tmp_path):
+    # Two tracks with tempo changes in both, and other messages in between.
+    path = str(tmp_path / "tempo.mid")
+    rng = np.random.default_rng(0)
+    with mido.MidiFile(ticks_per_beat=96) as file:
+        for _ in range(2):
+            track = mido.MidiTrack()
+            for _ in range(300):
+                time = int(rng.integers(0, 40))
+                kind = rng.integers(0, 4)
+                if kind == 0:
+                    track.append(mido.MetaMessage("set_tempo", tempo=int(rng.integers(200000, 900000)), time=time))
+                elif kind == 1:
+                    track.append(mido.Message("program_change", program=int(rng.integers(0, 128)), time=time))
+                else:
+                    track.append(mido.Message("note_on" if kind == 2 else "note_off", note=int(rng.integers(21, 109)),
+                        velocity=int(rng.integers(0, 128)), time=time))
+            file.tracks.append(track)
+        file.save(path)
+
+    fps = 30
+    events = midi.read_file_events(path, fps)
+
+    # Times in seconds of playing the file with mido.
+    expect = []
+    time = 0
+    for msg in mido.MidiFile(path):
+        time += msg.time
+        if msg.type in ("note_on", "note_off"):
+            expect.append((time*fps, msg.type, msg.note, msg.velocity))
+
+    assert len(events) == len(expect)
+    assert np.allclose(events["time"], [e[0] for e in expect], rtol=0, atol=1e-6)
+    assert [midi.EVENT_TYPES[t] for t in events["type"]] == [e[1] for e in expect]
+    assert events["data1"].tolist() == [e[2] for e in expect]
+    assert events["data2"].tolist() == [e[3] for e in expect]
+
+
+def test_parse_notes():
+    rng = np.random.default_rng(1)
+    for num in (0, 1, 2, 10, 200, 2000):
+        events = random_events(rng, num, ("note_on", "note_off", "control_change"))
+        for min_frames in (0, 1.5):
+            table = midi.parse_notes(events, min_frames)
+            assert table.dtype == midi.NOTE_DTYPE
+            assert np.array_equal(table, brute_notes(events, min_frames))
+
+
+def test_merge_events():
+    rng = np.random.default_rng(2)
+    for sizes in ((), (0,), (5,), (0, 7), (30, 30), (1, 50, 0, 20), (500, 300, 800)):
+        tables = [random_events(rng, size) for size in sizes]
+        for i, table in enumerate(tables):
+            # Tell the tables apart at equal times.
+            table["channel"] = i
+        merged = midi.merge_events(tables)
+
+        expect = np.concatenate(tables) if tables else np.empty(0, dtype=midi.EVENT_DTYPE)
+        expect = expect[np.argsort(expect["time"], kind="stable")]
+        assert np.array_equal(merged, expect)
+
+
+def test_note_index():
+    rng = np.random.default_rng(3)
+    for num in (0, 1, 5, 100, 1000):
+        table = random_notes(rng, num)
+        index = NoteIndex(table)
+        for _ in range(100):
+            t0, t1 = np.sort(rng.uniform(-30, 530, 2))
+            if rng.random() < 0.2:
+                t0 = t1
+            window = index.query(t0, t1)
+            assert np.array_equal(window, np.unique(window))
+            inside = np.zeros(num, dtype=bool)
+            inside[window] = True
+            overlap = (table["start"] <= t1) & (table["end"] >= t0)
+            assert not (overlap & ~inside).any()
+
+
+def test_note_index_long_note():
+    # A note during the whole piece, like an unmatched note off.
+    rng = np.random.default_rng(5)
+    table = random_notes(rng, 5000)
+    table["end"] = table["start"] + rng.uniform(0, 2, len(table))
+    table["start"][0], table["end"][0] = -10, 600
+    index = NoteIndex(table)
+    for t in np.linspace(0, 500, 200):
+        window = index.query(t, t+1)
+        overlap = (table["start"] <= t+1) & (table["end"] >= t)
+        assert overlap[window].sum() == overlap.sum()
+        assert len(window) <= overlap.sum() + 40
+
+
+def test_note_timeline():
+    rng = np.random.default_rng(4)
+    key_pos = np.stack((rng.uniform(0, 1000, 88), rng.uniform(5, 20, 88)), axis=1)
+    for num in (0, 1, 5, 300):
+        table = random_notes(rng, num)
+        # Some notes shorter than a frame, between two frames.
+        table["end"][::7] = table["start"][::7] + 0.2
+        first = float(table["start"][0]) if num > 0 else 0.0
+        timeline = midi.NoteTimeline(table, first)
+
+        for frame in range(-20, 560):
+            playing = (table["start"] <= first+frame) & (first+frame <= table["end"])
+            notes = table["note"][playing]
+            assert np.array_equal(timeline.playing(frame), notes)
+
+            starts, ends = timeline.key_bounds(frame, key_pos, 1.5)
+            assert np.array_equal(starts, key_pos[notes, 0] + 1.5)
+            assert np.array_equal(ends, key_pos[notes, 0] + key_pos[notes, 1] - 1.5)
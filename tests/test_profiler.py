@@ -0,0 +1,77 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import json
+import tracemalloc
+from pvkernel.profiler import MemoryProfiler, Profiler
+
+RESOLUTION = (160, 96)
+NOTES = (24, 4, 4, 0.4)
+
+
+def test_span_frames(make_video, tmp_path, monkeypatch):
+    # Keep the profiler, which is unset when the export is done.
+    profilers = []
+    monkeypatch.setattr(Profiler, "write_trace", lambda self, path: profilers.append(self))
+    video = make_video(RESOLUTION, notes=NOTES)
+    # An intro that isn't a whole number of anything.
+    video.props.core.pause_start = 0.37
+    video.export(str(tmp_path / "out.mp4"), start=5, end=40, pipeline=0, profile=str(tmp_path / "trace.json"))
+
+    events = profilers[0].events
+    frames = [e for e in events if e[0] == "frame"]
+    assert {e[6] for e in frames if e[1] == "render"} == set(range(5, 40))
+    # Every job and operator span is inside the frame span of its frame.
+    for category, name, start, wall, _, thread, frame in events:
+        if category in ("job", "op") and frame is not None:
+            assert any(f[6] == frame and f[5] == thread and f[2] <= start and start+wall <= f[2]+f[3]
+                for f in frames), (category, name, frame)
+
+
+def test_memory_frames(make_video, tmp_path, monkeypatch):
+    # Frames the growth of the job is measured on.
+    measured = set()
+    span = MemoryProfiler.span
+
+    def logged_span(self, category, name, frame=None):
+        if category == "job" and name == "midi_frame_init" and self._sampled(frame):
+            measured.add(frame)
+        return span(self, category, name, frame)
+
+    monkeypatch.setattr(MemoryProfiler, "span", logged_span)
+    video = make_video(RESOLUTION, notes=NOTES)
+    # 15 intro frames, not a multiple of the sample interval.
+    video.props.core.pause_start = 0.5
+    path = str(tmp_path / "memory.json")
+    video.export(str(tmp_path / "out.mp4"), start=5, end=40, pipeline=0, memory=path, memory_every=4)
+
+    with open(path, "r") as fp:
+        profile = json.load(fp)
+    frames = {sample["frame"] for sample in profile["samples"] if sample["frame"] is not None}
+    assert len(frames) > 0 and measured == frames
+
+
+def test_memory_limit_only(make_video, tmp_path, monkeypatch):
+    def start():
+        raise AssertionError("tracemalloc started")
+
+    monkeypatch.setattr(tracemalloc, "start", start)
+    video = make_video(RESOLUTION, notes=NOTES)
+    video.export(str(tmp_path / "out.mp4"), end=10, pipeline=0, memory_limit=1e6)
+    assert not tracemalloc.is_tracing()
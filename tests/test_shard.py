@@ -0,0 +1,161 @@
+#
+#  Piano Video
+#  A free piano visualizer.
+#  Copyright Patrick Huang 2021
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+import os
+import json
+import time
+import multiprocessing
+import cv2
+import numpy as np
+from conftest import new_video
+
+RESOLUTION = (160, 96)
+NOTES = (24, 4, 4, 0.4)
+
+
+def shard_worker(folder: str, shard_path: str, out_path: str) -> None:
+    """
+    Export with a shard folder, logging every rendered chunk and merge.
+    """
+    import pvkernel.shard as shard
+    render_segment, merge_shard = shard.render_segment, shard.merge_shard
+    log_path = os.path.join(folder, "log.txt")
+
+    def log(line):
+        with open(log_path, "a") as fp:
+            fp.write(line + "\n")
+
+    def logged_render(context, span, *args, **kwargs):
+        log(f"render {span[0]}-{span[1]}")
+        render_segment(context, span, *args, **kwargs)
+
+    def logged_merge(*args, **kwargs):
+        log("merge")
+        merge_shard(*args, **kwargs)
+
+    shard.render_segment, shard.merge_shard = logged_render, logged_merge
+    shard.POLL = 0.1
+
+    os.chdir(folder)
+    video = new_video(folder, RESOLUTION, notes=NOTES)
+    video.props.core.pause_start = 0.5
+    video.props.core.pause_end = 0.5
+    video.export(out_path, chunk=0.25, pipeline=0, shard=shard_path)
+
+
+def test_shard_processes(tmp_path):
+    from pvkernel.resume import segment_frames
+    from pvkernel.shard import Shard
+    folder = str(tmp_path)
+    shard_path = os.path.join(folder, "shard")
+    out_path = os.path.join(folder, "out.mp4")
+    new_video(folder, RESOLUTION, notes=NOTES)
+
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=shard_worker, args=(folder, shard_path, out_path)) for _ in range(3)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(300)
+        assert proc.exitcode == 0
+
+    with open(os.path.join(folder, "log.txt"), "r") as fp:
+        lines = fp.read().splitlines()
+    with open(os.path.join(shard_path, "shard.json"), "r") as fp:
+        settings = json.load(fp)
+    shard = Shard(shard_path, settings)
+
+    renders = [line.split()[1] for line in lines if line.startswith("render")]
+    assert sorted(renders) == sorted(shard.name(span) for span in shard.spans)
+    assert lines.count("merge") == 1
+    assert shard.is_merged()
+    assert os.listdir(os.path.join(shard_path, "claims")) == []
+    assert not os.path.exists(os.path.join(shard_path, "merge.lock"))
+    assert segment_frames(out_path) == settings["end"] - settings["start"]
+    # Only the recorded segment of each chunk is kept.
+    assert len(os.listdir(os.path.join(shard_path, "segments"))) == len(shard.spans)
+
+
+def write_segment(path: str, frames: int) -> None:
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, RESOLUTION)
+    for _ in range(frames):
+        writer.write(np.zeros((RESOLUTION[1], RESOLUTION[0], 3), dtype=np.uint8))
+    writer.release()
+
+
+def test_shard_takeover(tmp_path, monkeypatch):
+    """
+    A stale claim is taken over, and the old owner can't finish the chunk or
+    remove the new owner's claim.
+    """
+    import pvkernel.shard as shard_mod
+    monkeypatch.setattr(shard_mod, "STALE_TIME", 0.05)
+    settings = {"start": 0, "end": 10, "chunk": 10, "ext": ".mp4"}
+    old = shard_mod.Shard(str(tmp_path), settings)
+    new = shard_mod.Shard(str(tmp_path), settings)
+    span = (0, 10)
+
+    assert old.claim() == span
+    # Not stale until the claim is seen unchanged for STALE_TIME.
+    assert new.claim() is None
+    time.sleep(0.1)
+    assert new.claim() == span
+    assert not old.owns(span) and new.owns(span)
+    assert old.segment_path(span) != new.segment_path(span)
+
+    old_segment = old.segment_path(span)
+    write_segment(old_segment, 10)
+    write_segment(new.segment_path(span), 10)
+    assert not old.finish(span)
+    assert not os.path.isfile(old_segment)
+    assert new.owns(span)
+
+    assert new.finish(span)
+    assert new.all_done()
+    new.verify()
+    # The stale claim was removed.
+    assert os.listdir(os.path.join(str(tmp_path), "claims")) == []
+
+
+def test_merge_takeover(tmp_path, monkeypatch):
+    """
+    The merge lock of a process that died while merging is taken over.
+    """
+    import pvkernel.shard as shard_mod
+    monkeypatch.setattr(shard_mod, "STALE_TIME", 0.3)
+    folder = str(tmp_path)
+    shard_path = os.path.join(folder, "shard")
+    out_path = os.path.join(folder, "out.mp4")
+    new_video(folder, RESOLUTION, notes=NOTES)
+    # Lock of a dead process, which is never updated.
+    os.makedirs(shard_path)
+    with open(os.path.join(shard_path, "merge.lock"), "w") as fp:
+        fp.write("dead")
+
+    proc = multiprocessing.get_context("fork").Process(target=shard_worker, args=(folder, shard_path, out_path))
+    proc.start()
+    proc.join(300)
+    assert proc.exitcode == 0
+
+    with open(os.path.join(folder, "log.txt"), "r") as fp:
+        assert fp.read().splitlines().count("merge") == 1
+    assert os.path.isfile(os.path.join(shard_path, "merged.json"))
+    assert sorted(os.listdir(shard_path)) == ["claims", "done", "merged.json", "segments", "shard.json"]
+    assert os.path.isfile(out_path)